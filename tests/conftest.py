@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the utils package is imported from the repository root, like main.py does
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
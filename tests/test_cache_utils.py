@@ -0,0 +1,103 @@
+import gzip
+import json
+import os
+
+from docling_core.types.doc.base import ImageRefMode
+from docling_core.types.doc.document import DoclingDocument, ImageRef
+from PIL import Image
+
+from utils.cache_utils import ParseCache
+from utils.docling_utils import _document_exists, _load_document, _save_document
+from utils.storage_utils import inline_images, save_compact, save_indexed_document_json
+
+
+def _document() -> DoclingDocument:
+    document = DoclingDocument(name='doc')
+    document.add_text(label='text', text='first paragraph')
+    document.add_picture(image=ImageRef.from_pil(Image.new('RGB', (20, 10), (0, 0, 255)), dpi=72))
+    return document
+
+
+def test_save_document_writes_only_the_compact_copy(tmp_path):
+    document = _document()
+    save_indexed_document_json(document, tmp_path / 'document.json')
+    _save_document(document, tmp_path)
+    assert not (tmp_path / 'document.json').exists()
+    assert not (tmp_path / 'document.index.json').exists()
+    assert _document_exists(tmp_path)
+
+    restored = _load_document(tmp_path)
+    # images are left in the sidecar files, not inlined again
+    assert not str(restored.pictures[0].image.uri).startswith('data:')
+    assert restored.pictures[0].image.pil_image.size == (20, 10)
+    assert restored.export_to_markdown() == document.export_to_markdown()
+
+
+def test_cache_round_trip(tmp_path):
+    document = _document()
+    source_dir, target_dir = tmp_path / 'source', tmp_path / 'target'
+    source_dir.mkdir()
+    _save_document(document, source_dir)
+    save_compact({'input': {'file': 'doc.pdf'}, 'status': 'success'}, source_dir / 'conversion_result.json.gz')
+
+    cache = ParseCache(tmp_path / 'cache')
+    cache.put('ab-key', source_dir)
+    assert cache.contains('ab-key')
+    assert cache.get('ab-key', target_dir)
+    with gzip.open(target_dir / 'conversion_result.json.gz', 'rb') as f:
+        assert json.loads(f.read())['input']['file'] == 'doc.pdf'
+    assert _load_document(target_dir).export_to_markdown() == document.export_to_markdown()
+    assert not cache.get('cd-missing', tmp_path / 'other')
+
+
+def test_embedded_export_round_trip(tmp_path):
+    document = _document()
+    _save_document(document, tmp_path)
+    restored = inline_images(_load_document(tmp_path))
+    assert restored.pictures[0].image.uri == document.pictures[0].image.uri
+    assert (restored.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
+            == document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED))
+
+
+def _entry_source(tmp_path, name: str, text: str):
+    source_dir = tmp_path / name
+    source_dir.mkdir()
+    document = DoclingDocument(name='doc')
+    document.add_text(label='text', text=text)
+    _save_document(document, source_dir)
+    return source_dir
+
+
+def test_put_replaces_an_existing_entry(tmp_path):
+    cache = ParseCache(tmp_path / 'cache')
+    cache.put('ab-key', _entry_source(tmp_path, 'first', 'old paragraph'))
+    cache.put('ab-key', _entry_source(tmp_path, 'second', 'new paragraph'))
+    assert cache.get('ab-key', tmp_path / 'target')
+    assert _load_document(tmp_path / 'target').texts[0].text == 'new paragraph'
+    # the replaced entry and the temporary copies are gone
+    assert [path.name for path in (tmp_path / 'cache' / 'ab').iterdir()] == ['ab-key']
+
+
+def test_least_recently_used_entries_are_evicted_by_size(tmp_path):
+    cache = ParseCache(tmp_path / 'cache')
+    for index, key in enumerate(('aa-first', 'bb-second', 'cc-third')):
+        cache.put(key, _entry_source(tmp_path, key, f"paragraph {index}"))
+        os.utime(cache._entry_dir(key), (index, index))
+    entry_bytes = max(size for _, size, _ in cache._entries())
+    # reading the first entry makes the second one the least recently used
+    assert cache.get('aa-first', tmp_path / 'target')
+    cache.max_bytes = 2 * entry_bytes
+    assert cache.evict() == 1
+    assert cache.contains('aa-first') and cache.contains('cc-third')
+    assert not cache.contains('bb-second')
+
+
+def test_stats(tmp_path):
+    cache = ParseCache(tmp_path / 'cache')
+    cache.put('ab-key', _entry_source(tmp_path, 'source', 'paragraph'))
+    assert cache.get('ab-key', tmp_path / 'target')
+    assert not cache.get('cd-missing', tmp_path / 'other')
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['puts'], stats['entries']) == (1, 1, 1, 1)
+    assert stats['hit_rate'] == 0.5
+    assert stats['bytes'] > 0 and stats['evictions'] == 0
@@ -0,0 +1,36 @@
+import json
+from dataclasses import asdict
+
+from docling_core.types.doc.document import DocItemLabel, ImageRef
+from PIL import Image
+
+from utils.benchmark_utils import synthetic_document
+from utils.chunk_utils import _chunk_one, iter_chunks, whitespace_token_counter
+from utils.docling_utils import _save_document
+from utils.storage_utils import load_lazy_document
+
+
+def _document():
+    document = synthetic_document(300, table_fraction=0.05)
+    caption = document.add_text(label=DocItemLabel.CAPTION, text='Figure 1: tuber yield per plot')
+    document.add_picture(image=ImageRef.from_pil(Image.new('RGB', (8, 8)), dpi=72), caption=caption)
+    return document
+
+
+def test_lazy_chunks_match_loaded_document(tmp_path):
+    document = _document()
+    _save_document(document, tmp_path)
+    expected = [asdict(chunk) for chunk in iter_chunks(document, max_tokens=64)]
+    with load_lazy_document(tmp_path) as lazy:
+        assert [asdict(chunk) for chunk in iter_chunks(lazy, max_tokens=64)] == expected
+    assert any('Figure 1' in chunk['text'] for chunk in expected)
+
+
+def test_chunk_one_streams_from_lazy_document(tmp_path):
+    document = _document()
+    _save_document(document, tmp_path)
+    result = _chunk_one(str(tmp_path), 64, whitespace_token_counter, 32)
+    assert result['ok'], result.get('traceback')
+    with open(tmp_path / 'chunks.jsonl', 'r') as f:
+        chunks = [json.loads(line) for line in f]
+    assert chunks == [asdict(chunk) for chunk in iter_chunks(document, max_tokens=64, batch_size=32)]
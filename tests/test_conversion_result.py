@@ -0,0 +1,106 @@
+import json
+
+from docling_core.types.doc import BoundingBox, DoclingDocument
+from docling_core.types.doc.page import BoundingRectangle, PdfPageGeometry, SegmentedPdfPage, TextCell
+
+from utils.docling_utils import _save_conversion_result, _save_document, load_conversion_result
+from utils.storage_utils import IndexedConversionResult, load_compact, save_indexed_conversion_result
+
+
+def _page_box() -> BoundingBox:
+    return BoundingBox(l=0, t=0, r=100, b=100)
+
+
+def _write_result(output_dir, page: dict):
+    with open(output_dir / 'conversion_result.json', 'w') as f:
+        json.dump({'input': {'file': 'x.pdf'}, 'status': 'success', 'pages': [page]}, f)
+
+
+def test_cells_restored_from_parsed_page(tmp_path):
+    rect = BoundingRectangle.from_bounding_box(BoundingBox(l=1, t=2, r=30, b=12))
+    cell = TextCell(index=0, text='yield', orig='yield', rect=rect, from_ocr=False)
+    box = BoundingRectangle.from_bounding_box(_page_box())
+    geometry = PdfPageGeometry(angle=0, rect=box, boundary_type='crop_box', art_bbox=_page_box(), bleed_bbox=_page_box(),
+                               crop_bbox=_page_box(), media_bbox=_page_box(), trim_bbox=_page_box())
+    parsed_page = SegmentedPdfPage(dimension=geometry, char_cells=[], word_cells=[], textline_cells=[cell])
+    _write_result(tmp_path, {'page_no': 0, 'size': {'width': 100, 'height': 100},
+                             'parsed_page': parsed_page.model_dump(mode='json')})
+
+    page = load_conversion_result(tmp_path, DoclingDocument(name='x')).pages[0]
+    assert [c.text for c in page.cells] == ['yield']
+    assert page.parsed_page is not None
+
+
+def test_cells_restored_from_legacy_result(tmp_path):
+    _write_result(tmp_path, {'page_no': 0, 'size': {'width': 100, 'height': 100},
+                             'cells': [{'id': 3, 'text': 'tuber', 'bbox': {'l': 1, 't': 2, 'r': 30, 'b': 12}}]})
+
+    page = load_conversion_result(tmp_path, DoclingDocument(name='x')).pages[0]
+    assert page.parsed_page is None
+    assert [(c.index, c.text) for c in page.cells] == [(3, 'tuber')]
+
+
+class _Result:
+    # stands in for a ConversionResult, which can only be made by converting a PDF
+    def __init__(self, data: dict):
+        self.data = data
+
+    def model_dump_json(self, exclude=None) -> str:
+        return json.dumps({key: value for key, value in self.data.items() if key not in (exclude or ())})
+
+
+def test_conversion_result_saved_compact(tmp_path):
+    document = DoclingDocument(name='doc')
+    document.add_text(label='text', text='tuber yield')
+    _save_document(document, tmp_path)
+    _write_result(tmp_path, {'page_no': 0})
+    _save_conversion_result(_Result({'input': {'file': 'doc.pdf'}, 'status': 'success', 'pages': [{'page_no': 0}],
+                                     'document': document.export_to_dict()}), tmp_path)
+
+    assert not (tmp_path / 'conversion_result.json').exists()
+    assert (tmp_path / 'conversion_result.json.gz').exists()
+    result = load_conversion_result(tmp_path)
+    assert 'document' not in result._data
+    assert result.input.file.name == 'doc.pdf'
+    assert [page.page_no for page in result.pages] == [0]
+    # the document comes from the saved document, not from a copy inside the result
+    assert result.document.export_to_markdown() == document.export_to_markdown()
+
+
+def _legacy_cell(i: int) -> dict:
+    return {'id': i, 'text': f"cell {i}", 'bbox': {'l': 1, 't': 2, 'r': 30, 'b': 12}}
+
+
+def _result_data() -> dict:
+    pages = [{'page_no': i, 'size': {'width': 100, 'height': 100}, 'cells': [_legacy_cell(i)]} for i in range(3)]
+    return {'input': {'file': 'doc.pdf'}, 'status': 'success', 'pages': pages, 'assembled': {'elements': []}}
+
+
+def test_indexed_result_is_one_gzip_stream(tmp_path):
+    save_indexed_conversion_result(_result_data(), tmp_path / 'conversion_result.json.gz')
+    assert load_compact(tmp_path / 'conversion_result.json.gz') == _result_data()
+
+
+def test_pages_are_read_on_demand(tmp_path, monkeypatch):
+    save_indexed_conversion_result(_result_data(), tmp_path / 'conversion_result.json.gz')
+    reads = []
+    read_page = IndexedConversionResult.page
+    monkeypatch.setattr(IndexedConversionResult, 'page', lambda self, i: reads.append(i) or read_page(self, i))
+
+    result = load_conversion_result(tmp_path, DoclingDocument(name='x'))
+    assert result.status == 'success'
+    assert [page.page_no for page in result.pages] == [0, 1, 2]
+    assert reads == []
+    assert [cell.text for cell in result.pages[1].cells] == ['cell 1']
+    assert reads == [1]
+
+
+def test_legacy_result_is_indexed_once(tmp_path):
+    with open(tmp_path / 'conversion_result.json', 'w') as f:
+        json.dump(_result_data(), f)
+    assert [c.text for c in load_conversion_result(tmp_path, DoclingDocument(name='x')).pages[2].cells] == ['cell 2']
+    mtime_ns = (tmp_path / 'conversion_result.json.gz').stat().st_mtime_ns
+
+    result = load_conversion_result(tmp_path, DoclingDocument(name='x'))
+    assert result.input.file.name == 'doc.pdf'
+    assert (tmp_path / 'conversion_result.json.gz').stat().st_mtime_ns == mtime_ns
@@ -0,0 +1,165 @@
+import json
+from io import BytesIO
+
+from docling_core.types.doc import BoundingBox, Size
+from docling_core.types.doc.document import DoclingDocument, ProvenanceItem, TableData
+import pytest
+from pypdf import PdfReader, PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject
+
+import utils.docling_utils as docling_utils
+from utils.docling_utils import (
+    _docling_parse_pages, checkout_converter, default_pipeline_options, docling_parse, get_converter, merge_documents,
+    release_converters,
+)
+from utils.storage_utils import save_compact
+
+
+def test_page_selection_may_be_a_generator(tmp_path):
+    writer = PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    writer.write(tmp_path / 'doc.pdf')
+    # the selection is read twice before anything is converted: once for the range check, once for the message
+    with pytest.raises(ValueError, match='Page selection 5 is out of range'):
+        _docling_parse_pages(tmp_path / 'doc.pdf', tmp_path, (page_no for page_no in [5]))
+
+
+def _write_pdf(path, contents):
+    writer = PdfWriter()
+    for content in contents:
+        page = writer.add_blank_page(width=612, height=792)
+        stream = DecodedStreamObject()
+        stream.set_data(content)
+        page[NameObject('/Contents')] = writer._add_object(stream)
+    writer.write(path)
+
+
+def _prov(page_no: int) -> ProvenanceItem:
+    return ProvenanceItem(page_no=page_no, bbox=BoundingBox(l=0, t=0, r=10, b=10), charspan=(0, 1))
+
+
+def _fake_convert_shards(converted):
+    # stands in for docling: every page becomes one paragraph holding the page's content stream
+    def convert_shards(document_path, shards, max_workers=None, pipeline_options=None):
+        results = []
+        for start, pdf_bytes in shards:
+            page, = PdfReader(BytesIO(pdf_bytes)).pages
+            text = page.get_contents().get_data().decode()
+            document = DoclingDocument(name=f"shard-{start}")
+            document.add_page(page_no=1, size=Size(width=612, height=792))
+            document.add_text(label='text', text=text, prov=_prov(1))
+            converted.append(start)
+            results.append((start, document.export_to_dict()))
+        return results
+    return convert_shards
+
+
+def test_incremental_parse_of_unchanged_pdf_leaves_outputs_alone(tmp_path, monkeypatch, capsys):
+    converted = []
+    monkeypatch.setattr(docling_utils, '_convert_shards', _fake_convert_shards(converted))
+    _write_pdf(tmp_path / 'doc.pdf', [b'page one', b'page two'])
+    output_dir = tmp_path / 'doc'
+    document, _ = docling_parse(tmp_path / 'doc.pdf', output_dir, incremental=True)
+    assert [text.text for text in document.texts] == ['page one', 'page two']
+    assert converted == [0, 1]
+
+    # a conversion result from an earlier run must survive a run that has nothing to convert
+    save_compact({'status': 'success'}, output_dir / 'conversion_result.json.gz')
+    mtimes = {path.name: path.stat().st_mtime_ns for path in output_dir.iterdir() if path.is_file()}
+    capsys.readouterr()
+    document, _ = docling_parse(tmp_path / 'doc.pdf', output_dir, incremental=True, verbose=True)
+    assert 'Converting document' not in capsys.readouterr().out
+    assert converted == [0, 1]
+    assert [text.text for text in document.texts] == ['page one', 'page two']
+    assert {path.name: path.stat().st_mtime_ns for path in output_dir.iterdir() if path.is_file()} == mtimes
+
+
+def test_incremental_parse_converts_only_the_changed_page(tmp_path, monkeypatch):
+    converted = []
+    monkeypatch.setattr(docling_utils, '_convert_shards', _fake_convert_shards(converted))
+    output_dir = tmp_path / 'doc'
+    _write_pdf(tmp_path / 'doc.pdf', [b'page one', b'page two'])
+    docling_parse(tmp_path / 'doc.pdf', output_dir, incremental=True)
+
+    converted.clear()
+    _write_pdf(tmp_path / 'doc.pdf', [b'page one', b'page 2 rewritten'])
+    document, _ = docling_parse(tmp_path / 'doc.pdf', output_dir, incremental=True)
+    assert converted == [1]
+    assert [text.text for text in document.texts] == ['page one', 'page 2 rewritten']
+    assert [text.prov[0].page_no for text in document.texts] == [1, 2]
+    with open(output_dir / 'page_report.json') as f:
+        assert json.load(f) == {'reused': [1], 'converted': [2]}
+
+
+def _shard(number: int) -> dict:
+    document = DoclingDocument(name=f"shard-{number}")
+    for page_no in (1, 2):
+        document.add_page(page_no=page_no, size=Size(width=612, height=792))
+    group = document.add_group(name=f"section {number}")
+    document.add_text(label='text', text=f"shard {number} paragraph", parent=group, prov=_prov(1))
+    caption = document.add_text(label='caption', text=f"shard {number} caption", prov=_prov(2))
+    document.add_table(data=TableData(num_rows=0, num_cols=0), caption=caption, prov=_prov(2))
+    return document.export_to_dict()
+
+
+def test_merge_documents_offsets_refs_and_pages():
+    merged = merge_documents([(0, _shard(0)), (2, _shard(1)), (4, _shard(2))], name='doc')
+    assert sorted(merged.pages) == [1, 2, 3, 4, 5, 6]
+    assert [item.self_ref for item in merged.texts] == [f"#/texts/{i}" for i in range(6)]
+    assert [item.self_ref for item in merged.groups] == ['#/groups/0', '#/groups/1', '#/groups/2']
+    assert [text.prov[0].page_no for text in merged.texts] == [1, 2, 3, 4, 5, 6]
+    assert [table.prov[0].page_no for table in merged.tables] == [2, 4, 6]
+    for shard in range(3):
+        group, paragraph, caption, table = (merged.groups[shard], merged.texts[2 * shard],
+                                            merged.texts[2 * shard + 1], merged.tables[shard])
+        assert paragraph.text == f"shard {shard} paragraph"
+        assert paragraph.parent.cref == group.self_ref
+        assert [child.cref for child in group.children] == [paragraph.self_ref]
+        assert table.captions[0].cref == caption.self_ref
+        assert caption.text == f"shard {shard} caption"
+    assert [child.cref for child in merged.body.children] == [
+        ref for shard in range(3) for ref in (f"#/groups/{shard}", f"#/texts/{2 * shard + 1}", f"#/tables/{shard}")]
+    # every reference resolves to an item of the merged document
+    for item, _level in merged.iterate_items():
+        assert item.parent.resolve(merged) is not None
+
+
+class _FakeConverter:
+    # stands in for DocumentConverter, counting how often a converter is built and warmed
+    built = []
+
+    def __init__(self, format_options):
+        self.format_options = format_options
+        self.initialized = False
+        _FakeConverter.built.append(self)
+
+    def initialize_pipeline(self, input_format):
+        self.initialized = True
+
+
+@pytest.fixture
+def fake_converters(monkeypatch):
+    _FakeConverter.built = []
+    monkeypatch.setattr(docling_utils, 'DocumentConverter', _FakeConverter)
+    monkeypatch.setattr(docling_utils, '_converters', {})
+    return _FakeConverter.built
+
+
+def test_converters_are_shared_per_pipeline_options(fake_converters):
+    options = default_pipeline_options()
+    with checkout_converter(options) as doc_converter:
+        assert doc_converter.initialized
+        # the lock of the entry is held for the block, so other threads wait for their turn
+        assert docling_utils._converters[docling_utils._pipeline_options_key(options)][1].locked()
+    # equal options give the same warmed converter, other options their own
+    assert get_converter(default_pipeline_options()) is doc_converter
+    assert get_converter() is doc_converter
+    other = default_pipeline_options()
+    other.do_ocr = False
+    assert get_converter(other) is not doc_converter
+    assert len(fake_converters) == 2
+
+    release_converters()
+    assert docling_utils._converters == {}
+    assert get_converter(options) is not doc_converter
+    assert len(fake_converters) == 3
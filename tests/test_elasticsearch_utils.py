@@ -0,0 +1,222 @@
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from docling_core.types.doc.document import DoclingDocument, DocumentOrigin
+from elasticsearch import Elasticsearch
+
+import utils.elasticsearch_utils as elasticsearch_utils
+from utils.elasticsearch_utils import BulkIndexer, IndexState, close_client, configure_client, get_client, sync_documents
+
+
+class StubBulkServer(ThreadingHTTPServer):
+    """A `_bulk` endpoint that rejects chosen requests and items, and records every request it was sent."""
+
+    def __init__(self, reject_requests=(), throttled_ids=None, failing_ids=()):
+        super().__init__(('127.0.0.1', 0), _StubHandler)
+        self.lock = threading.Lock()
+        self.docs = {}
+        self.requests = []
+        # request numbers answered with a whole-request 429, _id -> number of 429s left, _ids always rejected with 400
+        self.reject_requests = set(reject_requests)
+        self.throttled_ids = dict(throttled_ids or {})
+        self.failing_ids = set(failing_ids)
+
+    def bulk(self, body: bytes) -> dict:
+        lines = [json.loads(line) for line in body.split(b'\n') if line]
+        with self.lock:
+            self.requests.append({'bytes': len(body), 'actions': len(lines) // 2})
+            if len(self.requests) in self.reject_requests:
+                return None
+            items = []
+            for header, source in zip(lines[::2], lines[1::2]):
+                (op_type, meta), = header.items()
+                _id = meta['_id']
+                if _id in self.failing_ids:
+                    status = 400
+                elif self.throttled_ids.get(_id, 0) > 0:
+                    self.throttled_ids[_id] -= 1
+                    status = 429
+                else:
+                    status = 200 if _id in self.docs else 201
+                    self.docs[_id] = source
+                items.append({op_type: {'_id': _id, 'status': status}})
+        return {'took': 1, 'errors': any(next(iter(item.values()))['status'] >= 300 for item in items), 'items': items}
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def _reply(self, status: int, body: dict):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('X-Elastic-Product', 'Elasticsearch')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_PUT(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.split('?')[0].endswith('_bulk'):
+            return self._reply(404, {})
+        response = self.server.bulk(body)
+        if response is None:
+            return self._reply(429, {'error': {'type': 'es_rejected_execution_exception', 'reason': 'queue full'}, 'status': 429})
+        self._reply(200, response)
+
+    do_POST = do_PUT
+
+
+@pytest.fixture
+def stub_server():
+    servers = []
+
+    def start(**kwargs) -> StubBulkServer:
+        server = StubBulkServer(**kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _client(server: StubBulkServer) -> Elasticsearch:
+    return Elasticsearch(f"http://127.0.0.1:{server.server_address[1]}")
+
+
+def _indexer(server: StubBulkServer, **kwargs) -> BulkIndexer:
+    return BulkIndexer('items', _client(server), initial_backoff=0.0, **kwargs)
+
+
+def _actions(n: int, text: str = 'tuber yield'):
+    return [{'_id': f"doc:{i}", '_source': {'text': f"{text} {i}"}} for i in range(n)]
+
+
+def test_partial_failures_are_retried(stub_server):
+    server = stub_server(reject_requests={1}, throttled_ids={'doc:3': 2, 'doc:17': 1}, failing_ids={'doc:9'})
+    indexer = _indexer(server, max_docs=10, max_inflight=1)
+    report = indexer.index_actions(_actions(25))
+
+    assert report['docs'] == 25
+    assert report['succeeded'] == 24
+    assert report['failed'] == 1
+    assert indexer.failed_ids == {'doc:9'}
+    assert set(server.docs) == {f"doc:{i}" for i in range(25)} - {'doc:9'}
+    # the whole rejected batch is resent, plus three throttled items
+    assert report['retries'] == 10 + 3
+
+
+def test_throttling_backs_off_exponentially(stub_server, monkeypatch):
+    delays = []
+    monkeypatch.setattr(elasticsearch_utils.time, 'sleep', delays.append)
+    server = stub_server(reject_requests={1}, throttled_ids={'doc:0': 3})
+    indexer = BulkIndexer('items', _client(server), initial_backoff=0.5, max_backoff=1.5)
+    report = indexer.index_actions(_actions(2))
+
+    assert report['succeeded'] == 2
+    # one 429 for the whole request, then three for one item, each wait twice the last up to max_backoff
+    assert delays == [0.5, 1.0, 1.5, 1.5]
+    assert [request['actions'] for request in server.requests] == [2, 2, 1, 1, 1]
+
+
+def test_throttled_items_give_up_after_max_retries(stub_server):
+    server = stub_server(throttled_ids={'doc:1': 100})
+    indexer = _indexer(server, max_docs=10, max_retries=2)
+    report = indexer.index_actions(_actions(3))
+
+    assert report['succeeded'] == 2
+    assert indexer.failed_ids == {'doc:1'}
+    assert len(server.requests) == 3
+
+
+def test_batches_respect_count_and_byte_limits(stub_server):
+    server = stub_server()
+    max_bytes = 500
+    indexer = _indexer(server, max_docs=7, max_bytes=max_bytes)
+    report = indexer.index_actions(_actions(50, text='tuber yield ' * 5))
+
+    assert report['succeeded'] == 50
+    assert sum(request['actions'] for request in server.requests) == 50
+    assert all(request['actions'] <= 7 for request in server.requests)
+    assert all(request['bytes'] <= max_bytes for request in server.requests)
+    # the byte limit, not the count, cuts these batches
+    assert len(server.requests) > -(-50 // 7)
+    assert report['bytes'] == sum(request['bytes'] for request in server.requests)
+
+
+def _copy(filename: str) -> DoclingDocument:
+    # the same PDF bytes, stored under another name
+    document = DoclingDocument(name=filename.rsplit('.', 1)[0],
+                               origin=DocumentOrigin(filename=filename, binary_hash=1234, mimetype='application/pdf'))
+    document.add_text(label='text', text='tuber yield per plot')
+    return document
+
+
+def test_sync_skips_copies_of_the_same_pdf(stub_server, tmp_path):
+    server = stub_server()
+    state = IndexState(tmp_path / 'state')
+    first = sync_documents([_copy('a.pdf'), _copy('b.pdf')], 'items', state, _client(server))
+    assert first['inserts'] == 1
+    assert first['duplicates'] == 1
+    assert {doc['source'] for doc in server.docs.values()} == {'a.pdf'}
+
+    requests = len(server.requests)
+    second = sync_documents([_copy('a.pdf'), _copy('b.pdf')], 'items', state, _client(server), remove_missing=True)
+    assert second['inserts'] == second['updates'] == second['deletes'] == 0
+    assert len(server.requests) == requests
+
+
+@pytest.fixture
+def shared_client():
+    # the module-wide client and settings are restored after each test
+    settings = elasticsearch_utils._settings
+    close_client()
+    yield
+    close_client()
+    elasticsearch_utils._settings = settings
+
+
+def test_client_is_created_lazily(shared_client, stub_server):
+    server = stub_server()
+    configure_client(url=f"http://127.0.0.1:{server.server_address[1]}", connections_per_node=2)
+    assert elasticsearch_utils._client is None
+    client = get_client()
+    assert get_client() is client
+    assert elasticsearch_utils.es is client
+    assert not server.requests
+
+    # new settings close the client, the next use makes one with them
+    configure_client(request_timeout=5)
+    assert elasticsearch_utils._client is None
+    assert get_client() is not client
+
+
+@pytest.mark.skipif(not hasattr(os, 'fork'), reason='needs os.fork')
+def test_client_is_recreated_after_fork(shared_client):
+    configure_client(url='http://127.0.0.1:9')
+    parent_client = get_client()
+    pid = os.fork()
+    if pid == 0:
+        # the parent's client and its connections are dropped in the child, which makes its own on first use
+        ok = elasticsearch_utils._client is None and get_client() is not parent_client and get_client() is get_client()
+        os._exit(0 if ok else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
+    assert get_client() is parent_client
+
+
+def test_client_of_another_process_is_replaced(shared_client, monkeypatch):
+    # without register_at_fork, the pid check alone keeps a child from using the parent's client
+    configure_client(url='http://127.0.0.1:9')
+    parent_client = get_client()
+    monkeypatch.setattr(elasticsearch_utils, '_client_pid', -1)
+    assert get_client() is not parent_client
+    elasticsearch_utils._reset_after_fork()
+    assert elasticsearch_utils._client is None and elasticsearch_utils._client_pid is None
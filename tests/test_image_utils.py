@@ -0,0 +1,41 @@
+import gzip
+
+from docling_core.types.doc.document import DoclingDocument, ImageRef
+from PIL import Image
+
+from utils.image_utils import ImageResolutionPolicy, ImageWriter, apply_resolution_policy
+from utils.storage_utils import COMPACT_DOCUMENT_FILENAME, save_compact_document, spill_images
+
+
+def test_resolution_policy_replaces_spilled_images(tmp_path):
+    document = DoclingDocument(name='doc')
+    document.add_picture(image=ImageRef.from_pil(Image.new('RGB', (200, 100), (0, 255, 0)), dpi=144))
+    data = document.export_to_dict()
+    spill_images(data, tmp_path)
+    document = DoclingDocument.model_validate(data)
+    original = list((tmp_path / 'images').iterdir())
+    assert len(original) == 1
+
+    report = apply_resolution_policy(document, ImageResolutionPolicy(picture_max_pixels=800), tmp_path / 'images')
+    assert report['bytes_after'] < report['bytes_before']
+    # the full-resolution file is gone, the reduced one sits in its place
+    assert not original[0].exists()
+    remaining = list((tmp_path / 'images').iterdir())
+    assert len(remaining) == 1
+    assert document.pictures[0].image.pil_image.size == (40, 20)
+
+    save_compact_document(document, tmp_path)
+    with gzip.open(tmp_path / COMPACT_DOCUMENT_FILENAME, 'rt') as f:
+        saved = f.read()
+    assert f"sidecar:images/{remaining[0].name}" in saved
+    assert str(tmp_path) not in saved
+
+
+def test_image_writer_records_errors_per_image(tmp_path):
+    with ImageWriter(max_workers=2) as image_writer:
+        image_writer.submit('#/pictures/0', Image.new('RGB', (4, 2)), tmp_path / 'picture-1.png')
+        image_writer.submit('#/pictures/1', None, tmp_path / 'picture-2.png')
+        manifest = image_writer.flush()
+    assert manifest[0]['width'] == 4 and 'error' not in manifest[0]
+    assert manifest[1]['error'].startswith('AttributeError')
+    assert (tmp_path / 'picture-1.png').exists() and not (tmp_path / 'picture-2.png').exists()
@@ -0,0 +1,38 @@
+from utils.ingest_utils import MAX_CRASH_ATTEMPTS, _retry_crashed
+
+
+class FakePool:
+    # a pool run that includes a poisoned job dies and leaves every job of the run unfinished
+    def __init__(self, poisoned):
+        self.poisoned = set(poisoned)
+        self.calls = []
+
+    def __call__(self, jobs, workers):
+        self.calls.append((list(jobs), workers))
+        return list(jobs) if self.poisoned & set(jobs) else []
+
+
+def test_unlucky_jobs_finish_in_fresh_pools():
+    jobs = [(name, name) for name in 'abcd']
+    run_pool = FakePool(poisoned=[])
+    assert _retry_crashed(jobs, run_pool, 4) == []
+    assert run_pool.calls == [(jobs[:2], 2), (jobs[2:], 2)]
+
+
+def test_poison_job_is_bisected_out():
+    jobs = [(str(i), str(i)) for i in range(16)]
+    poison = ('5', '5')
+    run_pool = FakePool(poisoned=[poison])
+    assert _retry_crashed(jobs, run_pool, 4) == [(poison, MAX_CRASH_ATTEMPTS)]
+    # every half without the poison job finishes in its own pool, only the poisoned halves are split further
+    assert len(run_pool.calls) == 2 * 3 + 1 + MAX_CRASH_ATTEMPTS
+    isolated = [call_jobs[0] for call_jobs, workers in run_pool.calls if len(call_jobs) == 1]
+    assert isolated.count(poison) == MAX_CRASH_ATTEMPTS
+    assert set(isolated) == {poison, ('4', '4')}
+    assert all(workers <= 4 for _, workers in run_pool.calls)
+
+
+def test_nothing_to_retry():
+    run_pool = FakePool(poisoned=[])
+    assert _retry_crashed([], run_pool, 4) == []
+    assert run_pool.calls == []
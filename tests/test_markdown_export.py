@@ -0,0 +1,128 @@
+import pytest
+from docling_core.types.doc.base import ImageRefMode
+from docling_core.types.doc.document import DocItemLabel, DoclingDocument, GroupLabel, ImageRef, TableCell, TableData, TextItem
+from PIL import Image
+
+from utils.benchmark_utils import synthetic_document
+import utils.docling_utils as docling_utils
+from utils.docling_utils import ModifiedExportDocument, _save_document, docling_export, register_markdown_renderer
+
+pytestmark = pytest.mark.filterwarnings('ignore::DeprecationWarning')
+
+
+def _document() -> DoclingDocument:
+    document = DoclingDocument(name='doc')
+    document.add_title(text='Title')
+    document.add_heading(text='Section', level=1)
+    document.add_text(label=DocItemLabel.TEXT, text='first paragraph')
+    group = document.add_group(label=GroupLabel.LIST, name='list')
+    document.add_list_item(text='tuber', parent=group)
+    document.add_list_item(text='yield', parent=group)
+    caption = document.add_text(label=DocItemLabel.CAPTION, text='Figure 1')
+    document.add_picture(image=ImageRef.from_pil(Image.new('RGB', (4, 4)), dpi=72), caption=caption)
+    cells = [
+        TableCell(text=text, start_row_offset_idx=r, end_row_offset_idx=r + 1, start_col_offset_idx=c,
+                  end_col_offset_idx=c + 1, column_header=r == 0)
+        for r, row in enumerate([['plot', 'yield'], ['a', '3']]) for c, text in enumerate(row)
+    ]
+    document.add_table(data=TableData(num_rows=2, num_cols=2, table_cells=cells))
+    document.add_text(label=DocItemLabel.TEXT, text='last paragraph')
+    return document
+
+
+def _rich_document() -> DoclingDocument:
+    # the items whose upstream rendering the fragment walk does not reproduce
+    document = DoclingDocument(name='doc')
+    document.add_title(text='Title')
+    for level in (1, 2, 3):
+        document.add_heading(text=f"Level {level} section", level=level)
+        document.add_text(label=DocItemLabel.TEXT, text=f"soil_moisture at level {level}")
+    document.add_text(label=DocItemLabel.FOOTNOTE, text='1 a footnote')
+    document.add_text(label=DocItemLabel.FORMULA, text='E = mc^2')
+    document.add_code(text='print(1)')
+    cells = [
+        TableCell(text=text, start_row_offset_idx=r, end_row_offset_idx=r + 1, start_col_offset_idx=c,
+                  end_col_offset_idx=c + 1, column_header=r == 0)
+        for r, row in enumerate([['plot_id', 'yield'], ['a_1', '3']]) for c, text in enumerate(row)
+    ]
+    table = document.add_table(data=TableData(num_rows=2, num_cols=2, table_cells=cells))
+    table.image = ImageRef.from_pil(Image.new('RGB', (6, 4)), dpi=72)
+    document.add_picture(image=ImageRef.from_pil(Image.new('RGB', (4, 4), (0, 128, 0)), dpi=72))
+    return document
+
+
+def test_docling_export_markdown_matches_upstream(tmp_path):
+    document = _rich_document()
+    _save_document(document, tmp_path)
+    docling_export(tmp_path / 'doc.pdf', str(tmp_path), attribution=lambda text, item, ix: text)
+    with open(tmp_path / 'doc.md', 'r') as f:
+        assert f.read() == document.export_to_markdown()
+    # a document loaded from its saved copy embeds the same image bytes as the converted one
+    with open(tmp_path / 'doc-with-images.md', 'r') as f:
+        assert f.read() == document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
+    assert (tmp_path / 'doc-attributed.md').exists()
+    assert (tmp_path / 'table-1.md').exists()
+
+
+def test_matches_upstream_export():
+    document = _document()
+    export_document = ModifiedExportDocument.from_document(document)
+    assert export_document.export_to_markdown() == DoclingDocument.export_to_markdown(document)
+
+
+def test_embedded_picture_alt_text():
+    document = _document()
+    upstream = DoclingDocument.export_to_markdown(document, image_mode=ImageRefMode.EMBEDDED)
+    markdown = ModifiedExportDocument.from_document(document).export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
+    picture_line = f"![Image]({document.pictures[0].image.uri})"
+    assert picture_line in upstream
+    assert picture_line in markdown
+
+
+@pytest.mark.parametrize('image_mode', [ImageRefMode.PLACEHOLDER, ImageRefMode.EMBEDDED])
+def test_single_walk_exports_agree(image_mode):
+    document = synthetic_document(400, table_fraction=0.05)
+    document.add_picture(image=ImageRef.from_pil(Image.new('RGB', (4, 4)), dpi=72))
+    export_document = ModifiedExportDocument.from_document(document)
+
+    def postprocess(text, item, ix):
+        return f"{text}<!-- {item.self_ref} -->" if text else text
+
+    plain = export_document.export_to_markdown(image_mode=image_mode, use_cache=False)
+    attributed = export_document.export_to_markdown(image_mode=image_mode, postprocess=postprocess, use_cache=False)
+    variants = export_document.export_markdown_variants({
+        'plain': {'image_mode': image_mode},
+        'attributed': {'image_mode': image_mode, 'postprocess': postprocess},
+        'batched': {'image_mode': image_mode, 'batch_size': 7,
+                    'postprocess_batch': lambda batch: [postprocess(*fragment) for fragment in batch]},
+    })
+    assert variants == {'plain': plain, 'attributed': attributed, 'batched': attributed}
+    # streamed and cached exports give the same text
+    assert ''.join(export_document.iter_markdown(image_mode=image_mode, chunk_size=100)) == plain
+    assert export_document.export_to_markdown(image_mode=image_mode) == plain
+    assert export_document.export_to_markdown(image_mode=image_mode) == plain
+
+
+def test_registered_renderer_replaces_the_default(monkeypatch):
+    # registrations go to a copy of the registry, so other tests keep the built-in renderers
+    monkeypatch.setattr(docling_utils, 'MARKDOWN_RENDERERS', dict(docling_utils.MARKDOWN_RENDERERS))
+
+    @register_markdown_renderer(TextItem, DocItemLabel.TEXT)
+    def render_quote(item, level, ctx):
+        return [(f"> {item.text}\n", item)]
+
+    document = _document()
+    markdown = ModifiedExportDocument.from_document(document).export_to_markdown(use_cache=False)
+    assert '> first paragraph\n' in markdown and '> last paragraph' in markdown
+    # items with other labels keep their renderers
+    assert '# Title' in markdown and '- tuber' in markdown
+    assert markdown.replace('> ', '') == DoclingDocument.export_to_markdown(document)
+
+
+def test_renderers_of_one_export_leave_the_registry_alone():
+    document = _document()
+    export_document = ModifiedExportDocument.from_document(document)
+    shouting = {(TextItem, DocItemLabel.TEXT): lambda item, level, ctx: [(item.text.upper() + "\n", item)]}
+    markdown = export_document.export_to_markdown(renderers=shouting, use_cache=False)
+    assert 'FIRST PARAGRAPH' in markdown and 'Title' in markdown
+    assert export_document.export_to_markdown(use_cache=False) == DoclingDocument.export_to_markdown(document)
@@ -0,0 +1,43 @@
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, NameObject
+
+from utils.pdf_utils import _image_coverage, classify_pages
+
+
+def _write_pdf(path, content: bytes):
+    writer = PdfWriter()
+    page = writer.add_blank_page(width=612, height=792)
+    stream = DecodedStreamObject()
+    stream.set_data(content)
+    page[NameObject('/Contents')] = writer._add_object(stream)
+    writer.write(path)
+
+
+def test_malformed_operator_is_treated_as_a_scan(tmp_path):
+    # cm with two operands instead of six
+    _write_pdf(tmp_path / 'page.pdf', b'q 1 0 cm Q')
+    profile, = classify_pages(tmp_path / 'page.pdf')
+    assert profile.image_coverage == 1.0
+    assert profile.kind == 'scanned'
+    assert profile.needs_ocr
+
+
+def test_unparseable_stream_does_not_fail_the_document(tmp_path):
+    writer = PdfWriter()
+    writer.add_blank_page(width=612, height=792)
+    page = writer.add_blank_page(width=612, height=792)
+    stream = DecodedStreamObject()
+    stream.set_data(b'BT /F1 12 Tf (unterminated Tj ET')
+    page[NameObject('/Contents')] = writer._add_object(stream)
+    writer.write(tmp_path / 'doc.pdf')
+    profiles = classify_pages(tmp_path / 'doc.pdf')
+    assert [profile.page_no for profile in profiles] == [1, 2]
+    assert profiles[0].kind == 'born-digital'
+
+
+def test_image_coverage_clips_unbounded_images():
+    box = (0.0, 0.0, 100.0, 100.0)
+    infinite = (float('-inf'), float('-inf'), float('inf'), float('inf'))
+    assert _image_coverage([(infinite, 0)], box) == 1.0
+    assert _image_coverage([((0.0, 0.0, 50.0, 100.0), 0)], box) == 0.5
+    assert _image_coverage([((200.0, 200.0, 300.0, 300.0), 0)], box) == 0.0
@@ -0,0 +1,84 @@
+import math
+
+import numpy as np
+import pytest
+from docling_core.types.doc.document import DoclingDocument, DocumentOrigin
+
+from utils.search_utils import BM25_B, BM25_K1, SearchIndex, tokenize
+
+
+def _document(name: str, binary_hash: int, texts) -> DoclingDocument:
+    document = DoclingDocument(name=name, origin=DocumentOrigin(filename=f"{name}.pdf", binary_hash=binary_hash,
+                                                                mimetype='application/pdf'))
+    for text in texts:
+        document.add_text(label='text', text=text)
+    return document
+
+
+CORPUS = {
+    'potato': (1, ['potato tuber yield per plot', 'late blight on potato potato leaves', 'harvest dates']),
+    'cassava': (2, ['cassava root yield', 'tuber and root crops compared over a longer growing season']),
+}
+
+
+def _bm25(query: str, texts) -> list:
+    # the textbook BM25 over the whole corpus, Lucene's idf, to check the index against
+    docs = [tokenize(text) for text in texts]
+    avg_length = sum(len(doc) for doc in docs) / len(docs)
+    scores = []
+    for doc in docs:
+        score = 0.0
+        for term in dict.fromkeys(tokenize(query)):
+            df = sum(term in other for other in docs)
+            tf = doc.count(term)
+            idf = math.log(1 + (len(docs) - df + 0.5) / (df + 0.5))
+            score += idf * tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * len(doc) / avg_length))
+        scores.append(score)
+    return scores
+
+
+def _search(index: SearchIndex, query: str) -> list:
+    return [(result['source'], result['text'], pytest.approx(result['score'], rel=1e-5)) for result in index.search(query, k=10)]
+
+
+def test_bm25_ranking_across_segments(tmp_path):
+    index = SearchIndex(tmp_path / 'index')
+    for name, (binary_hash, texts) in CORPUS.items():
+        index.add_document(_document(name, binary_hash, texts))
+    assert index.stats()['segments'] == 2
+
+    texts = [(f"{name}.pdf", text) for name, (_, name_texts) in CORPUS.items() for text in name_texts]
+    scores = _bm25('potato tuber yield', [text for _, text in texts])
+    expected = sorted(((source, text, score) for (source, text), score in zip(texts, scores) if score > 0),
+                      key=lambda result: -result[2])
+    results = index.search('potato tuber yield', k=10)
+    assert [(result['source'], result['text']) for result in results] == [(source, text) for source, text, _ in expected]
+    assert [result['score'] for result in results] == pytest.approx([score for _, _, score in expected], rel=1e-5)
+    # the repeated term and the short item outrank the single mention in a long one
+    assert results[0]['text'] == 'potato tuber yield per plot'
+    assert results[-1]['text'].startswith('tuber and root crops')
+    assert index.search('yield', labels=['caption']) == []
+    assert [result['source'] for result in index.search('yield', document_ids=[f"{2:016x}"])] == ['cassava.pdf']
+
+
+def test_reopened_index_reads_persisted_segments(tmp_path):
+    index = SearchIndex(tmp_path / 'index')
+    for name, (binary_hash, texts) in CORPUS.items():
+        index.add_document(_document(name, binary_hash, texts))
+    before = _search(index, 'root tuber')
+
+    reopened = SearchIndex(tmp_path / 'index')
+    assert reopened.document_ids() == index.document_ids()
+    assert _search(reopened, 'root tuber') == before
+    # the arrays are memory maps of the segment files, not copies read into memory
+    for segment in reopened._segments.values():
+        assert isinstance(segment.postings_items, np.memmap)
+        assert isinstance(segment.item_lengths, np.memmap)
+
+    # a delete is only a tombstone in the manifest, which a reopened index honours, and compacting keeps the scores
+    index.delete_document(f"{1:016x}")
+    reopened = SearchIndex(tmp_path / 'index')
+    assert {result['source'] for result in reopened.search('root tuber')} == {'cassava.pdf'}
+    reopened.compact()
+    assert reopened.stats()['segments'] == 1
+    assert _search(SearchIndex(tmp_path / 'index'), 'root tuber') == _search(reopened, 'root tuber')
@@ -0,0 +1,67 @@
+import gzip
+import shutil
+
+from docling_core.types.doc.document import DoclingDocument, ImageRef
+from PIL import Image
+
+from utils.storage_utils import (
+    COMPACT_DOCUMENT_FILENAME, load_compact_document, load_lazy_document, migrate_output_dir,
+    save_compact_document, save_indexed_document_json, spill_images,
+)
+
+
+def _document(text: str = 'first paragraph') -> DoclingDocument:
+    document = DoclingDocument(name='doc')
+    document.add_heading(text='Heading')
+    document.add_text(label='text', text=text)
+    document.add_picture(image=ImageRef.from_pil(Image.new('RGB', (20, 10), (255, 0, 0)), dpi=72))
+    return document
+
+
+def test_compact_round_trip(tmp_path):
+    document = _document()
+    save_compact_document(document, tmp_path)
+    for embed_images in (True, False):
+        restored = load_compact_document(tmp_path, embed_images=embed_images)
+        assert restored.export_to_markdown() == document.export_to_markdown()
+        assert restored.pictures[0].image.pil_image.size == (20, 10)
+
+
+def test_lazy_document_after_remove_json(tmp_path):
+    document = _document()
+    save_indexed_document_json(document, tmp_path / 'document.json')
+    migrate_output_dir(tmp_path, remove_json=True)
+    assert not (tmp_path / 'document.json').exists()
+
+    with load_lazy_document(tmp_path) as lazy:
+        assert [text for _, text in lazy.iterate_texts()] == ['Heading', 'first paragraph']
+        picture = lazy.get_item('#/pictures/0')
+        assert picture.image.pil_image.size == (20, 10)
+        assert lazy.to_document().export_to_markdown() == document.export_to_markdown()
+
+
+def test_lazy_document_follows_compact_copy(tmp_path):
+    save_compact_document(_document(), tmp_path)
+    with load_lazy_document(tmp_path) as lazy:
+        assert lazy.get_item('#/texts/1').text == 'first paragraph'
+
+    save_compact_document(_document('rewritten paragraph'), tmp_path)
+    assert (tmp_path / COMPACT_DOCUMENT_FILENAME).exists()
+    with load_lazy_document(tmp_path) as lazy:
+        assert lazy.get_item('#/texts/1').text == 'rewritten paragraph'
+
+
+def test_spilled_images_are_saved_relative(tmp_path):
+    source_dir, moved_dir = tmp_path / 'source', tmp_path / 'moved'
+    data = _document().export_to_dict()
+    assert spill_images(data, source_dir) == 1
+    document = DoclingDocument.model_validate(data)
+    assert document.pictures[0].image.pil_image.size == (20, 10)
+
+    save_compact_document(document, source_dir)
+    with gzip.open(source_dir / COMPACT_DOCUMENT_FILENAME, 'rt') as f:
+        assert str(tmp_path) not in f.read()
+    shutil.move(source_dir, moved_dir)
+    restored = load_compact_document(moved_dir, embed_images=False)
+    assert str(restored.pictures[0].image.uri).startswith(str(moved_dir.resolve()))
+    assert restored.pictures[0].image.pil_image.size == (20, 10)
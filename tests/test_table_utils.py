@@ -0,0 +1,76 @@
+import pandas as pd
+import pytest
+from docling_core.types.doc.document import DoclingDocument, TableCell, TableData
+
+from utils.table_utils import TableStore, document_id, table_to_frame
+
+
+def _cell(text: str, row: int, col: int, row_span: int = 1, col_span: int = 1, header: bool = False) -> TableCell:
+    return TableCell(text=text, start_row_offset_idx=row, end_row_offset_idx=row + row_span, start_col_offset_idx=col,
+                     end_col_offset_idx=col + col_span, row_span=row_span, col_span=col_span, column_header=header)
+
+
+def _sales_document() -> DoclingDocument:
+    # two header rows, a header spanning both of them and one spanning two columns, and a body cell spanning two rows
+    document = DoclingDocument(name='sales')
+    document.add_table(data=TableData(num_rows=4, num_cols=3, table_cells=[
+        _cell('Region', 0, 0, row_span=2, header=True), _cell('Sales', 0, 1, col_span=2, header=True),
+        _cell('2023', 1, 1, header=True), _cell('2024', 1, 2, header=True),
+        _cell('North', 2, 0, row_span=2), _cell('10', 2, 1), _cell('12', 2, 2),
+        _cell('11', 3, 1), _cell('13', 3, 2),
+    ]))
+    return document
+
+
+def test_table_to_frame_spans_and_header_rows():
+    frame = table_to_frame(_sales_document().tables[0])
+    assert isinstance(frame.columns, pd.MultiIndex)
+    assert list(frame.columns) == [('Region', 'Region'), ('Sales', '2023'), ('Sales', '2024')]
+    assert frame.values.tolist() == [['North', '10', '12'], ['North', '11', '13']]
+
+
+def test_table_to_frame_header_rows_override():
+    table = _sales_document().tables[0]
+    frame = table_to_frame(table, header_rows=1)
+    assert list(frame.columns) == ['Region', 'Sales', 'Sales']
+    assert frame.values.tolist()[0] == ['Region', '2023', '2024']
+    assert table_to_frame(table, header_rows=0).shape == (4, 3)
+
+
+def test_table_without_headers_uses_its_first_row():
+    document = DoclingDocument(name='plain')
+    document.add_table(data=TableData(num_rows=2, num_cols=2, table_cells=[
+        _cell('a', 0, 0), _cell('b', 0, 1), _cell('1', 1, 0), _cell('2', 1, 1),
+    ]))
+    frame = table_to_frame(document.tables[0])
+    assert list(frame.columns) == ['a', 'b']
+    assert frame.values.tolist() == [['1', '2']]
+
+
+def test_table_store_round_trip(tmp_path):
+    # pyarrow is an optional dependency of the table store
+    ds = pytest.importorskip('pyarrow.dataset')
+    store = TableStore(tmp_path / 'tables')
+    sales = _sales_document()
+    other = DoclingDocument(name='other')
+    other.add_table(data=TableData(num_rows=2, num_cols=1, table_cells=[_cell('x', 0, 0, header=True), _cell('1', 1, 0)]))
+    assert store.write_document(sales) == 9
+    assert store.write_document(other) == 2
+
+    sales_id, other_id = document_id(sales), document_id(other)
+    assert store.document_ids() == sorted([sales_id, other_id])
+    assert sorted(path.name for path in (tmp_path / 'tables').iterdir()) == sorted(
+        [f"document_id={sales_id}", f"document_id={other_id}"])
+    stored = store.table_frame(f"{sales_id}:#/tables/0")
+    pd.testing.assert_frame_equal(stored, table_to_frame(sales.tables[0]))
+
+    rows = store.query(['text', 'document_id'], ds.field('column_header'), [sales_id])
+    assert set(rows.column('document_id').to_pylist()) == {sales_id}
+    assert sorted(rows.column('text').to_pylist()) == ['2023', '2024', 'Region', 'Sales']
+
+    # rewriting a document replaces its partition and leaves the other one alone
+    other.tables[0].data.table_cells[1].text = '2'
+    assert store.write_document(other) == 2
+    assert sorted(store.query(['text'], document_ids=[other_id]).column('text').to_pylist()) == ['2', 'x']
+    assert store.query(['text'], document_ids=[sales_id]).num_rows == 9
+    assert not [path for path in (tmp_path / 'tables').iterdir() if path.name.startswith('.')]
@@ -0,0 +1,169 @@
+import argparse
+import gc
+import random
+import statistics
+import tempfile
+import time
+import uuid
+from docling_core.types.doc.document import DocItemLabel, DoclingDocument, GroupLabel, TableCell, TableData
+from typing import Callable, Dict, List, Optional, Tuple
+
+from utils.docling_utils import ModifiedExportDocument
+from utils.search_utils import SearchIndex
+
+
+def synthetic_document(num_items: int = 10_000, table_fraction: float = 0.02, seed: int = 0,
+                       words: Optional[List[str]] = None, name: str = 'synthetic') -> DoclingDocument:
+    # document with the item mix of a long report: mostly paragraphs, with headers, lists and table_fraction tables
+    rng = random.Random(seed)
+    document = DoclingDocument(name=name)
+    words = words or ['yield', 'tuber', 'soil_moisture', 'variety', 'trial', 'nitrogen', 'plot', 'harvest', 'grade', 'storage']
+    count = 0
+    while count < num_items:
+        kind = rng.random()
+        if kind < 0.05:
+            document.add_heading(text=' '.join(rng.choices(words, k=4)), level=rng.randint(1, 3))
+            count += 1
+        elif kind < 0.15:
+            group = document.add_group(label=GroupLabel.LIST, name='list')
+            for _ in range(rng.randint(2, 6)):
+                document.add_list_item(text=' '.join(rng.choices(words, k=8)), parent=group)
+                count += 1
+        elif kind < 0.15 + table_fraction:
+            rows, cols = rng.randint(3, 12), rng.randint(2, 6)
+            cells = [
+                TableCell(text=rng.choice(words), start_row_offset_idx=r, end_row_offset_idx=r + 1,
+                          start_col_offset_idx=c, end_col_offset_idx=c + 1, column_header=r == 0)
+                for r in range(rows) for c in range(cols)
+            ]
+            document.add_table(data=TableData(num_rows=rows, num_cols=cols, table_cells=cells))
+            count += 1
+        else:
+            label = rng.choice([DocItemLabel.TEXT] * 8 + [DocItemLabel.FOOTNOTE, DocItemLabel.CODE])
+            document.add_text(label=label, text=' '.join(rng.choices(words, k=rng.randint(10, 60))))
+            count += 1
+    return document
+
+
+def time_call(fn: Callable[[], object], repeat: int = 5) -> Dict[str, float]:
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start_time = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start_time)
+    return {'best': min(times), 'median': statistics.median(times)}
+
+
+def benchmark_markdown_export(num_items: int = 10_000, repeat: int = 5, table_fraction: float = 0.0,
+                              verbose: bool = True) -> Dict[str, Dict[str, float]]:
+    """Time the upstream DoclingDocument.export_to_markdown against the dispatch-table exports of ModifiedExportDocument.
+
+    Table rendering is the same tabulate call in every export, so the default document is text only.
+    """
+    document = synthetic_document(num_items, table_fraction)
+    export_document = ModifiedExportDocument.from_document(document)
+    assert export_document.export_to_markdown() == ''.join(export_document.iter_markdown())
+
+    cases = {
+        'DoclingDocument.export_to_markdown': lambda: DoclingDocument.export_to_markdown(document),
+        'ModifiedExportDocument.export_to_markdown': lambda: export_document.export_to_markdown(),
+        'ModifiedExportDocument.iter_markdown': lambda: sum(len(chunk) for chunk in export_document.iter_markdown()),
+        'export_markdown_variants (2 variants)': lambda: export_document.export_markdown_variants({'plain': {}, 'attributed': {'postprocess': lambda text, item, ix: text}}),
+    }
+    results = {name: time_call(fn, repeat) for name, fn in cases.items()}
+    if verbose:
+        baseline = results['DoclingDocument.export_to_markdown']['best']
+        print(f"{len(list(document.iterate_items(with_groups=True)))} items, {len(document.tables)} tables, best of {repeat}")
+        for name, result in results.items():
+            print(f"{name:45s} {result['best'] * 1000:8.1f} ms  (median {result['median'] * 1000:8.1f} ms, {baseline / result['best']:.2f}x)")
+    return results
+
+
+def _latencies(run_query: Callable[..., object], queries: List[Tuple[str, dict]]) -> Dict[str, float]:
+    # per query latency of run_query(query, **filters)
+    times = []
+    for query, filters in queries:
+        start_time = time.perf_counter()
+        run_query(query, **filters)
+        times.append(time.perf_counter() - start_time)
+    times.sort()
+    return {'median': statistics.median(times), 'p95': times[int(0.95 * (len(times) - 1))], 'mean': statistics.fmean(times)}
+
+
+def benchmark_search(num_documents: int = 20, items_per_document: int = 2_000, num_queries: int = 200,
+                     vocabulary_size: int = 5_000, elasticsearch: bool = False, seed: int = 0,
+                     verbose: bool = True) -> Dict[str, dict]:
+    """Build time, index size and query latency of the offline SearchIndex, and of Elasticsearch if asked to.
+
+    The corpus is synthetic documents over a vocabulary of `vocabulary_size` words; queries are one to three
+    words, half of them filtered by label. The Elasticsearch run indexes the same records into a throwaway
+    index of the server configured for utils.elasticsearch_utils and deletes it afterwards.
+    """
+    rng = random.Random(seed)
+    # drawing the vocabulary with repeats gives frequent and rare words, like real text
+    vocabulary = [f"term{i}" for i in range(vocabulary_size)]
+    words = [vocabulary[min(int(rng.paretovariate(1.0)) - 1, vocabulary_size - 1)] for _ in range(vocabulary_size * 4)]
+    documents = [synthetic_document(items_per_document, seed=seed + i, words=words, name=f"synthetic-{i}") for i in range(num_documents)]
+    queries = [(' '.join(rng.choices(words, k=rng.randint(1, 3))), {'labels': ['text']} if i % 2 else {}) for i in range(num_queries)]
+    results = {}
+
+    with tempfile.TemporaryDirectory() as index_dir:
+        index = SearchIndex(index_dir)
+        start_time = time.perf_counter()
+        index.add_documents(documents)
+        build_seconds = time.perf_counter() - start_time
+        latencies = _latencies(lambda query, **filters: index.search(query, 10, **filters), queries)
+        results['SearchIndex'] = {'build_seconds': build_seconds, 'bytes': index.stats()['bytes'], **latencies}
+
+    if elasticsearch:
+        from utils.elasticsearch_utils import create_index, get_client, index_documents
+        client = get_client()
+        es_index = f"benchmark-{uuid.uuid4().hex[:8]}"
+        try:
+            create_index(es_index, client)
+            start_time = time.perf_counter()
+            index_documents(documents, es_index, client)
+            client.indices.refresh(index=es_index)
+            build_seconds = time.perf_counter() - start_time
+            # one segment like the compacted offline index, so the sizes compare like for like
+            client.indices.forcemerge(index=es_index, max_num_segments=1)
+
+            def es_search(query: str, labels: Optional[List[str]] = None):
+                filter_clauses = [{'terms': {'label': labels}}] if labels else []
+                return client.search(index=es_index, size=10, query={'bool': {
+                    'must': {'multi_match': {'query': query, 'fields': ['text', 'caption']}}, 'filter': filter_clauses}})
+
+            latencies = _latencies(es_search, queries)
+            store_bytes = client.indices.stats(index=es_index)['_all']['primaries']['store']['size_in_bytes']
+            results['Elasticsearch'] = {'build_seconds': build_seconds, 'bytes': store_bytes, **latencies}
+        finally:
+            client.indices.delete(index=es_index, ignore_unavailable=True)
+
+    if verbose:
+        num_items = sum(len(document.texts) + len(document.tables) for document in documents)
+        print(f"{num_documents} documents, {num_items} items, {num_queries} queries, top 10")
+        for name, result in results.items():
+            print(f"{name:15s} build {result['build_seconds']:7.2f} s  size {result['bytes'] / 2**20:8.1f} MiB  "
+                  f"query median {result['median'] * 1000:7.2f} ms  p95 {result['p95'] * 1000:7.2f} ms")
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark the markdown export or the search index on synthetic documents.")
+    parser.add_argument('benchmark', nargs='?', choices=['markdown', 'search'], default='markdown')
+    parser.add_argument('-n', '--items', type=int, default=10_000, help="items per document")
+    parser.add_argument('-r', '--repeat', type=int, default=5)
+    parser.add_argument('--tables', type=float, default=0.0, help="fraction of items that are tables")
+    parser.add_argument('-d', '--documents', type=int, default=20, help="documents in the search corpus")
+    parser.add_argument('-q', '--queries', type=int, default=200)
+    parser.add_argument('--elasticsearch', action='store_true', help="also benchmark the configured Elasticsearch server")
+    args = parser.parse_args(argv)
+    if args.benchmark == 'markdown':
+        benchmark_markdown_export(args.items, args.repeat, args.tables)
+    else:
+        benchmark_search(args.documents, args.items, args.queries, elasticsearch=args.elasticsearch)
+
+
+if __name__ == "__main__":
+    main()
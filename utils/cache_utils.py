@@ -0,0 +1,296 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import uuid
+from importlib import metadata
+from pathlib import Path
+from typing import Union, Optional, List, Tuple
+
+# files and directories of a docling_parse output directory that make up a cache entry
+# copied with their timestamps, which the document index and the compact copy use to detect staleness
+CACHED_FILES = ('document.json.gz', 'conversion_result.json.gz', 'conversion_result.index.json', 'conversion_result.json', 'document.json', 'document.index.json')
+# an entry is complete once it holds either form of the document; document.json only in entries from before the compact format
+DOCUMENT_FILES = ('document.json.gz', 'document.json')
+CACHED_DIRS = ('images',)
+# written next to the outputs so a later call can tell which cache entry an output directory holds
+CACHE_KEY_FILENAME = '.cache_key'
+
+
+def file_hash(path: Union[str, Path], block_size: int = 1 << 20) -> str:
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            hasher.update(block)
+    return hasher.hexdigest()
+
+
+def _package_version(name: str) -> str:
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def _has_document(directory: Path) -> bool:
+    return any((directory / filename).exists() for filename in DOCUMENT_FILES)
+
+
+def options_fingerprint(pipeline_options, extra: str = '') -> str:
+    # pipeline options plus the library versions, since a docling upgrade can change the output for the same input.
+    # extra covers settings applied after conversion, e.g. an ImageResolutionPolicy
+    options_json = pipeline_options.model_dump_json() if pipeline_options is not None else ''
+    fingerprint = '|'.join([
+        type(pipeline_options).__name__, options_json,
+        _package_version('docling'), _package_version('docling-core'),
+    ] + ([extra] if extra else []))
+    return hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+
+
+class ParseCache:
+    """Content-addressed store of docling_parse outputs shared by every output directory.
+
+    Entries are keyed by the SHA-256 of the input bytes plus a fingerprint of the pipeline options and docling
+    version, so renamed or duplicated PDFs are converted once and a changed PDF never serves stale output.
+    The cache is bounded to `max_bytes` on disk and evicts the least recently used entries first.
+    """
+
+    def __init__(self, cache_dir: Union[str, Path] = 'data/cache', max_bytes: int = 20 * 2**30):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def key(self, document_path: Union[str, Path], pipeline_options, extra: str = '') -> str:
+        return f"{file_hash(document_path)}-{options_fingerprint(pipeline_options, extra)[:16]}"
+
+    def _entry_dir(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / key
+
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def contains(self, key: str) -> bool:
+        return _has_document(self._entry_dir(key))
+
+    def get(self, key: str, output_dir: Union[str, Path]) -> bool:
+        """Make `output_dir` hold the cached outputs for `key`, copying them in if needed. Returns False on a miss."""
+        output_dir = Path(output_dir)
+        entry_dir = self._entry_dir(key)
+        if read_cache_key(output_dir) == key and _has_document(output_dir):
+            self._touch(entry_dir)
+            self._count('hits')
+            return True
+        try:
+            if not _has_document(entry_dir):
+                raise FileNotFoundError(entry_dir)
+            output_dir.mkdir(parents=True, exist_ok=True)
+            # the entry can be evicted by another process while we copy, which surfaces as FileNotFoundError
+            for filename in CACHED_FILES:
+                if (entry_dir / filename).exists():
+                    shutil.copy2(entry_dir / filename, output_dir / filename)
+                elif (output_dir / filename).exists():
+                    os.remove(output_dir / filename)
+            for dirname in CACHED_DIRS:
+                if (entry_dir / dirname).exists():
+                    shutil.copytree(entry_dir / dirname, output_dir / dirname, dirs_exist_ok=True)
+        except FileNotFoundError:
+            self._count('misses')
+            return False
+        write_cache_key(output_dir, key)
+        self._touch(entry_dir)
+        self._count('hits')
+        return True
+
+    def _touch(self, entry_dir: Path):
+        # mtime of the entry directory is the LRU clock
+        try:
+            os.utime(entry_dir)
+        except FileNotFoundError:
+            pass
+
+    def put(self, key: str, output_dir: Union[str, Path]):
+        """Store the outputs in `output_dir` under `key`, replacing an older entry, then enforce the size bound."""
+        output_dir = Path(output_dir)
+        entry_dir = self._entry_dir(key)
+        write_cache_key(output_dir, key)
+        # build the entry beside its final location and rename it into place so readers never see half an entry
+        tmp_dir = entry_dir.with_name(f".{key}.{uuid.uuid4().hex}")
+        tmp_dir.mkdir(parents=True)
+        for filename in CACHED_FILES:
+            if (output_dir / filename).exists():
+                shutil.copy2(output_dir / filename, tmp_dir / filename)
+        for dirname in CACHED_DIRS:
+            if (output_dir / dirname).exists():
+                shutil.copytree(output_dir / dirname, tmp_dir / dirname)
+        # a directory cannot be renamed over a non-empty one, so an existing entry is moved aside first; a reader
+        # in between sees a miss, never a mix of the old and new outputs
+        old_dir = entry_dir.with_name(f".{key}.{uuid.uuid4().hex}.old")
+        try:
+            os.rename(entry_dir, old_dir)
+        except FileNotFoundError:
+            old_dir = None
+        try:
+            os.rename(tmp_dir, entry_dir)
+        except OSError:
+            # another process stored the same entry in the meantime
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+        if old_dir is not None:
+            shutil.rmtree(old_dir, ignore_errors=True)
+        self._count('puts')
+        self.evict()
+
+    def _entries(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        if not self.cache_dir.exists():
+            return entries
+        for shard_dir in self.cache_dir.iterdir():
+            if not shard_dir.is_dir():
+                continue
+            for entry_dir in shard_dir.iterdir():
+                if entry_dir.name.startswith('.'):
+                    continue
+                try:
+                    size = sum(f.stat().st_size for f in entry_dir.rglob('*') if f.is_file())
+                    entries.append((entry_dir.stat().st_mtime, size, entry_dir))
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def evict(self) -> int:
+        entries = sorted(self._entries())
+        total_bytes = sum(size for _, size, _ in entries)
+        evicted = 0
+        for _, size, entry_dir in entries:
+            if total_bytes <= self.max_bytes:
+                break
+            shutil.rmtree(entry_dir, ignore_errors=True)
+            total_bytes -= size
+            evicted += 1
+        with self._lock:
+            self.evictions += evicted
+        return evicted
+
+    def clear(self):
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+
+    def stats(self) -> dict:
+        entries = self._entries()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'puts': self.puts,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for _, size, _ in entries),
+            'max_bytes': self.max_bytes,
+        }
+
+
+class PageStore:
+    """Per-page conversion results of one output directory, addressed by page fingerprint.
+
+    Each entry is the exported single-page DoclingDocument of one page, so a PDF whose pages are partly replaced
+    or reordered only needs its new pages converted. Results from other pipeline options are discarded.
+    """
+
+    def __init__(self, store_dir: Union[str, Path], options_key: str):
+        self.store_dir = Path(store_dir)
+        self.options_key = options_key
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+        self._index = self._read_index()
+        if self._index.get('options') != options_key:
+            self.prune(set())
+            self._index = {'options': options_key, 'document_pages': []}
+            self._write_index()
+
+    @property
+    def _index_path(self) -> Path:
+        return self.store_dir / 'index.json'
+
+    def _read_index(self) -> dict:
+        try:
+            with open(self._index_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write_index(self):
+        with open(self._index_path, 'w') as f:
+            json.dump(self._index, f)
+
+    def _page_path(self, fingerprint: str) -> Path:
+        return self.store_dir / f"{fingerprint}.json"
+
+    def has(self, fingerprint: str) -> bool:
+        return self._page_path(fingerprint).exists()
+
+    def get(self, fingerprint: str) -> dict:
+        with open(self._page_path(fingerprint), 'r') as f:
+            return json.load(f)
+
+    def put(self, fingerprint: str, page_document: dict):
+        tmp_path = self._page_path(fingerprint).with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(page_document, f)
+        os.replace(tmp_path, self._page_path(fingerprint))
+
+    def discard(self, fingerprint: str):
+        try:
+            os.remove(self._page_path(fingerprint))
+        except FileNotFoundError:
+            pass
+
+    @property
+    def document_pages(self) -> List[str]:
+        # page fingerprints, in order, of the document last assembled from this store
+        return self._index.get('document_pages', [])
+
+    @document_pages.setter
+    def document_pages(self, fingerprints: List[str]):
+        self._index['document_pages'] = list(fingerprints)
+        self._write_index()
+
+    def prune(self, keep: set) -> int:
+        removed = 0
+        for path in self.store_dir.glob('*.json'):
+            if path.name != self._index_path.name and path.stem not in keep:
+                os.remove(path)
+                removed += 1
+        return removed
+
+
+def read_cache_key(output_dir: Union[str, Path]) -> Optional[str]:
+    try:
+        with open(Path(output_dir) / CACHE_KEY_FILENAME, 'r') as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def write_cache_key(output_dir: Union[str, Path], key: str):
+    with open(Path(output_dir) / CACHE_KEY_FILENAME, 'w') as f:
+        f.write(key)
+
+
+if __name__ == "__main__":
+    import sys
+    cache = ParseCache(sys.argv[1] if len(sys.argv) > 1 else 'data/cache')
+    for name, value in cache.stats().items():
+        print(f"{name}: {value}")
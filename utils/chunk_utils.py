@@ -0,0 +1,377 @@
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import asdict, dataclass, field
+from docling_core.types.doc.document import (
+    DocItem, DocItemLabel, DoclingDocument, FloatingItem, GroupItem, GroupLabel, ListItem, NodeItem, PictureItem, RefItem,
+    SectionHeaderItem, TableItem, TextItem,
+)
+from pathlib import Path
+from typing import Callable, Iterator, List, Optional, Tuple, Union
+
+from utils.storage_utils import LazyDocument, load_lazy_document
+from utils.table_utils import document_id
+
+# counts the tokens of a batch of texts in one call, so model tokenizers can encode the whole batch at once
+TokenCounter = Callable[[List[str]], List[int]]
+
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+def whitespace_token_counter(texts: List[str]) -> List[int]:
+    return [len(text.split()) for text in texts]
+
+
+class HuggingFaceTokenCounter:
+    """Counts tokens with a Hugging Face tokenizer, e.g. the one of the embedding model the chunks are for.
+
+    Picklable: each worker process loads the tokenizer by name on first use.
+    """
+
+    def __init__(self, model_name: str):
+        self.model_name = model_name
+        self._tokenizer = None
+
+    def __getstate__(self):
+        return {'model_name': self.model_name, '_tokenizer': None}
+
+    def __call__(self, texts: List[str]) -> List[int]:
+        if self._tokenizer is None:
+            from transformers import AutoTokenizer
+            self._tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        return [len(ids) for ids in self._tokenizer(texts, add_special_tokens=False)['input_ids']]
+
+
+@dataclass
+class Chunk:
+    """A token-budgeted piece of a document with the provenance of every item it was made from.
+
+    `headings` is the section header path the chunk sits under, `self_refs` its items in reading order, and
+    `bboxes` one entry per item and page with the item's self_ref, page_no and l/t/r/b in the page's coordinates.
+    `tokens` is the sum of the token counts of its pieces, not a count of the joined text.
+    """
+    document_id: str
+    source: str
+    index: int
+    text: str
+    tokens: int
+    headings: List[str] = field(default_factory=list)
+    self_refs: List[str] = field(default_factory=list)
+    pages: List[int] = field(default_factory=list)
+    bboxes: List[dict] = field(default_factory=list)
+
+    @property
+    def contextualized_text(self) -> str:
+        # the text with its section path in front, the form to embed so a chunk keeps the context of its section
+        return '\n'.join(self.headings + [self.text]) if self.headings else self.text
+
+
+# a unit is a run of pieces that should stay in one chunk: a heading, a paragraph, a whole list or a whole table.
+# Each piece is (text, items it came from); a table's first piece is its header, repeated when it is split.
+_Piece = Tuple[str, List[DocItem]]
+
+
+@dataclass
+class _Unit:
+    kind: str
+    pieces: List[_Piece]
+    heading_level: int = 0
+    counts: List[int] = field(default_factory=list)
+
+    @property
+    def tokens(self) -> int:
+        return sum(self.counts)
+
+
+def _resolve(ref: RefItem, document: Union[DoclingDocument, LazyDocument]) -> NodeItem:
+    # a LazyDocument reads the item through its offset index, without its image
+    if isinstance(document, LazyDocument):
+        return document.get_item(ref.cref, with_image=False)
+    return ref.resolve(document)
+
+
+def _caption_text(item: FloatingItem, document: Union[DoclingDocument, LazyDocument]) -> str:
+    return ''.join(_resolve(caption, document).text for caption in item.captions)
+
+
+def _table_pieces(table: TableItem, document: Union[DoclingDocument, LazyDocument]) -> List[_Piece]:
+    # markdown rows; the leading column header rows, with the separator line, make up the first piece
+    rows = ['| ' + ' | '.join(cell.text.replace('|', '\\|').replace('\n', ' ') for cell in row) + ' |' for row in table.data.grid]
+    if not rows:
+        return []
+    header_rows = 0
+    while header_rows < len(rows) - 1 and all(cell.column_header for cell in table.data.grid[header_rows]):
+        header_rows += 1
+    header_rows = max(header_rows, 1)
+    separator = '|' + '---|' * table.data.num_cols
+    pieces = [('\n'.join(rows[:header_rows] + [separator]), [table])]
+    pieces.extend((row, [table]) for row in rows[header_rows:])
+    caption = _caption_text(table, document)
+    if caption:
+        pieces[0] = (f"{caption}\n\n{pieces[0][0]}", [table])
+    return pieces
+
+
+def _document_units(document: Union[DoclingDocument, LazyDocument]) -> Iterator[_Unit]:
+    # walks the body once; only the list being collected is held, never more of the document
+    list_unit: Optional[_Unit] = None
+    list_levels: List[int] = []
+    if isinstance(document, LazyDocument):
+        items = document.iterate_items(with_groups=True, with_images=False)
+    else:
+        items = document.iterate_items(with_groups=True)
+    for item, level in items:
+        while list_levels and level <= list_levels[-1]:
+            list_levels.pop()
+        if list_unit is not None and not list_levels:
+            yield list_unit
+            list_unit = None
+        if isinstance(item, GroupItem):
+            if item.label in (GroupLabel.LIST, GroupLabel.ORDERED_LIST):
+                list_levels.append(level)
+                if list_unit is None:
+                    list_unit = _Unit('list', [])
+            continue
+        if list_unit is not None and isinstance(item, ListItem):
+            marker = item.marker if item.enumerated and item.marker else '-'
+            list_unit.pieces.append((f"{'  ' * (len(list_levels) - 1)}{marker} {item.text}", [item]))
+            continue
+        if list_unit is not None and list_levels:
+            # anything else nested in a list (a paragraph inside a list item) stays with the list
+            if isinstance(item, TextItem) and item.text:
+                list_unit.pieces.append((f"{'  ' * len(list_levels)}{item.text}", [item]))
+            continue
+        if isinstance(item, TextItem) and item.label == DocItemLabel.TITLE:
+            yield _Unit('heading', [(f"# {item.text}", [item])], heading_level=0)
+        elif isinstance(item, SectionHeaderItem):
+            yield _Unit('heading', [(f"{'#' * (item.level + 1)} {item.text}", [item])], heading_level=item.level)
+        elif isinstance(item, TableItem):
+            pieces = _table_pieces(item, document)
+            if pieces:
+                yield _Unit('table', pieces)
+        elif isinstance(item, PictureItem):
+            caption = _caption_text(item, document)
+            if caption:
+                yield _Unit('text', [(caption, [item])])
+        elif isinstance(item, TextItem) and item.text:
+            # captions are chunked with their table or picture, only stray ones stand alone
+            if item.label == DocItemLabel.CAPTION and item.parent is not None \
+                    and isinstance(_resolve(item.parent, document), (TableItem, PictureItem)):
+                continue
+            yield _Unit('text', [(item.text, [item])])
+    if list_unit is not None:
+        yield list_unit
+
+
+def _split_text(text: str, max_tokens: int, count_tokens: TokenCounter) -> List[Tuple[str, int]]:
+    # a single paragraph over the budget is cut at sentence ends, and a sentence that is still too long in halves
+    sentences = [s for s in _SENTENCE_END.split(text) if s]
+    parts = []
+    for sentence, tokens in zip(sentences, count_tokens(sentences)):
+        words = sentence.split()
+        if tokens <= max_tokens or len(words) < 2:
+            parts.append((sentence, tokens))
+        else:
+            middle = len(words) // 2
+            parts.extend(_split_text(' '.join(words[:middle]), max_tokens, count_tokens))
+            parts.extend(_split_text(' '.join(words[middle:]), max_tokens, count_tokens))
+    return parts
+
+
+class _ChunkBuilder:
+    # packs units into chunks of at most max_tokens, flushing at section headers and before units that do not fit
+
+    def __init__(self, doc_id: str, source: str, max_tokens: int, count_tokens: TokenCounter):
+        self.doc_id = doc_id
+        self.source = source
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.headings: List[Tuple[int, str]] = []
+        self.index = 0
+        self._reset()
+
+    def _reset(self):
+        # (separator, text) parts: units are separated by a blank line, rows and list items of one unit by a newline
+        self.parts: List[Tuple[str, str]] = []
+        self.items: List[DocItem] = []
+        self.tokens = 0
+        self.only_headings = True
+        self.chunk_headings = [text for _, text in self.headings]
+
+    def _add(self, text: str, items: List[DocItem], tokens: int, separator: str = '\n\n', heading: bool = False):
+        self.parts.append((separator if self.parts else '', text))
+        for item in items:
+            if not self.items or self.items[-1] is not item:
+                self.items.append(item)
+        self.tokens += tokens
+        self.only_headings = self.only_headings and heading
+
+    def flush(self) -> Iterator[Chunk]:
+        if self.parts:
+            self_refs, pages, bboxes = [], set(), []
+            for item in self.items:
+                if item.self_ref not in self_refs:
+                    self_refs.append(item.self_ref)
+                for prov in item.prov:
+                    pages.add(prov.page_no)
+                    bboxes.append({'self_ref': item.self_ref, 'page_no': prov.page_no,
+                                   'l': prov.bbox.l, 't': prov.bbox.t, 'r': prov.bbox.r, 'b': prov.bbox.b})
+            yield Chunk(self.doc_id, self.source, self.index, ''.join(separator + text for separator, text in self.parts),
+                        self.tokens, self.chunk_headings, self_refs, sorted(pages), bboxes)
+            self.index += 1
+        self._reset()
+
+    def add_unit(self, unit: _Unit) -> Iterator[Chunk]:
+        if unit.kind == 'heading':
+            if not self.only_headings:
+                yield from self.flush()
+            text, items = unit.pieces[0]
+            self.headings = [(level, heading) for level, heading in self.headings if level < unit.heading_level]
+            self.headings.append((unit.heading_level, items[0].text))
+            if self.tokens + unit.tokens > self.max_tokens:
+                yield from self.flush()
+            if not self.parts:
+                # the heading itself opens the chunk's text, so its path stops at the heading's parent
+                self.chunk_headings = [heading for _, heading in self.headings[:-1]]
+            self._add(text, items, unit.tokens, heading=True)
+            return
+        if self.tokens + unit.tokens > self.max_tokens and unit.tokens <= self.max_tokens and not self.only_headings:
+            # the unit fits a chunk of its own, so it starts one rather than being split
+            yield from self.flush()
+        if self.tokens + unit.tokens <= self.max_tokens:
+            for i, ((text, items), tokens) in enumerate(zip(unit.pieces, unit.counts)):
+                self._add(text, items, tokens, '\n' if i else '\n\n')
+            return
+        yield from self._add_oversized(unit)
+
+    def _add_oversized(self, unit: _Unit) -> Iterator[Chunk]:
+        # split at piece boundaries, a paragraph at sentence ends; a table repeats its header in every chunk it spans
+        pieces = list(zip(unit.pieces, unit.counts))
+        header = pieces.pop(0) if unit.kind == 'table' else None
+        header_tokens = header[1] if header is not None else 0
+        budget = max(1, self.max_tokens - header_tokens)
+
+        def start_part():
+            if header is not None:
+                (text, items), tokens = header
+                self._add(text, items, tokens, '\n\n')
+                return '\n'
+            return '\n\n'
+
+        if (header is not None and not self.only_headings) or self.tokens + header_tokens > self.max_tokens:
+            # a table's header is never left at the end of a chunk without any of its rows
+            yield from self.flush()
+        separator = start_part()
+        for (text, items), tokens in pieces:
+            parts = [(text, tokens)] if tokens <= budget else _split_text(text, budget, self.count_tokens)
+            for part, part_tokens in parts:
+                if self.tokens + part_tokens > self.max_tokens and self.parts:
+                    yield from self.flush()
+                    separator = start_part()
+                self._add(part, items, part_tokens, separator)
+                separator = ' ' if unit.kind == 'text' else '\n'
+            if unit.kind == 'text':
+                separator = '\n\n'
+
+
+def iter_chunks(document: Union[DoclingDocument, LazyDocument], max_tokens: int = 512, count_tokens: TokenCounter = whitespace_token_counter,
+                batch_size: int = 256) -> Iterator[Chunk]:
+    """Stream `document` as chunks of at most `max_tokens` tokens, in reading order.
+
+    Chunks break at section headers, and lists and tables go into a single chunk whenever they fit one. Items are
+    read and counted `batch_size` pieces at a time, so memory stays bounded by the batch and the largest list or
+    table, whatever the length of the document. A single piece over the budget is split at sentence ends.
+    With a LazyDocument, items are read one at a time through its index and images are never loaded.
+    """
+    builder = _ChunkBuilder(document_id(document), document.origin.filename if document.origin is not None else document.name,
+                            max_tokens, count_tokens)
+    batch: List[_Unit] = []
+    batch_pieces = 0
+
+    def count_batch() -> Iterator[Chunk]:
+        texts = [text for unit in batch for text, _ in unit.pieces]
+        counts = iter(count_tokens(texts))
+        for unit in batch:
+            unit.counts = [next(counts) for _ in unit.pieces]
+            yield from builder.add_unit(unit)
+
+    for unit in _document_units(document):
+        batch.append(unit)
+        batch_pieces += len(unit.pieces)
+        if batch_pieces >= batch_size:
+            yield from count_batch()
+            batch = []
+            batch_pieces = 0
+    yield from count_batch()
+    yield from builder.flush()
+
+
+def _chunk_one(output_dir: str, max_tokens: int, count_tokens: TokenCounter, batch_size: int) -> dict:
+    # writes output_dir/chunks.jsonl one chunk at a time, under a temporary name until it is complete
+    start_time = time.time()
+    chunks_path = Path(output_dir) / 'chunks.jsonl'
+    tmp_path = chunks_path.with_name(f".chunks.{os.getpid()}.tmp")
+    try:
+        num_chunks = 0
+        num_tokens = 0
+        with load_lazy_document(output_dir) as document, open(tmp_path, 'w') as f:
+            for chunk in iter_chunks(document, max_tokens, count_tokens, batch_size):
+                f.write(json.dumps(asdict(chunk)) + '\n')
+                num_chunks += 1
+                num_tokens += chunk.tokens
+        os.replace(tmp_path, chunks_path)
+        return {'output_dir': output_dir, 'ok': True, 'chunks': num_chunks, 'tokens': num_tokens,
+                'seconds': time.time() - start_time}
+    except Exception as e:
+        if tmp_path.exists():
+            os.remove(tmp_path)
+        return {'output_dir': output_dir, 'ok': False, 'error': f"{type(e).__name__}: {e}",
+                'traceback': traceback.format_exc(), 'seconds': time.time() - start_time}
+
+
+def chunk_converted(converted_path: Union[str, Path] = 'data/converted', max_tokens: int = 512,
+                    count_tokens: TokenCounter = whitespace_token_counter, max_workers: Optional[int] = None,
+                    batch_size: int = 256, verbose: bool = False) -> Tuple[List[dict], List[dict]]:
+    """Chunk every converted document under converted_path into its chunks.jsonl with a pool of worker processes.
+
+    `count_tokens` is sent to the workers, so it has to be picklable, e.g. a module-level function or a
+    HuggingFaceTokenCounter. Returns (successes, failures) like ingest_utils.ingest_batch.
+    """
+    from utils.docling_utils import _document_exists
+    start_time = time.time()
+    output_dirs = [str(p) for p in sorted(Path(converted_path).iterdir()) if _document_exists(p)]
+    successes, failures = [], []
+    # spawn, like the ingest pool, so workers do not inherit the parent's torch/OpenMP state
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count() or 1,
+                             mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = [pool.submit(_chunk_one, output_dir, max_tokens, count_tokens, batch_size) for output_dir in output_dirs]
+        for future in as_completed(futures):
+            result = future.result()
+            (successes if result['ok'] else failures).append(result)
+    if verbose:
+        print(f"Chunked {len(successes)} documents into {sum(result['chunks'] for result in successes)} chunks "
+              f"({len(failures)} failed) in {time.time() - start_time:.2f} seconds.")
+        for failure in failures:
+            print(f"FAILED {failure['output_dir']}: {failure['error']}")
+    return successes, failures
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Chunk every converted document into <output dir>/chunks.jsonl.")
+    parser.add_argument('converted_path', nargs='?', default='data/converted')
+    parser.add_argument('-t', '--max-tokens', type=int, default=512)
+    parser.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--tokenizer', default=None, help="Hugging Face tokenizer to count tokens with (default: words)")
+    args = parser.parse_args(argv)
+    count_tokens = HuggingFaceTokenCounter(args.tokenizer) if args.tokenizer else whitespace_token_counter
+    _, failures = chunk_converted(args.converted_path, args.max_tokens, count_tokens, args.workers, verbose=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
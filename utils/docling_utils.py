@@ -1,64 +1,724 @@
+import asyncio
 import json
-import mdpd 
 import os
 import pandas as pd
+import gc
+import multiprocessing
 import re
 import sys
+import threading
 import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from functools import cached_property, partial
+from types import SimpleNamespace
 from docling_core.types.doc.document import *
+from docling_core.types.doc.page import BoundingRectangle, SegmentedPdfPage, TextCell
 from docling.datamodel.document import ConversionResult, InputDocument, _DocumentConversionInput
-from docling.datamodel.base_models import FigureElement, InputFormat, Table
+from docling.datamodel.base_models import AssembledUnit, ConversionStatus, DocumentStream, ErrorItem, FigureElement, InputFormat, PagePredictions, Table
 from docling.datamodel.pipeline_options import PdfPipelineOptions
-from docling.document_converter import DocumentConverter, PdfFormatOption, _format_to_default_options
-from pathlib import Path
+from docling.document_converter import DocumentConverter, PdfFormatOption
+from docling.utils.profiling import ProfilingItem
+from pathlib import Path, PurePath
+from io import BytesIO, TextIOBase
 from PIL import Image
-from typing import Union, Optional, Tuple, Dict, Callable
+from typing import Union, Optional, Tuple, Dict, Callable, Iterator, Iterable, List, Awaitable
+from utils.cache_utils import PageStore, ParseCache, file_hash, options_fingerprint
+from utils.storage_utils import COMPACT_CONVERSION_RESULT_FILENAME, COMPACT_DOCUMENT_FILENAME, CONVERSION_RESULT_INDEX_FILENAME, DOCUMENT_INDEX_FILENAME, IndexedConversionResult, LazyDocument, has_fresh_compact_document, inline_images, load_compact_document, load_indexed_conversion_result, load_lazy_document, save_compact_document, save_indexed_conversion_result, spill_images
+from utils.table_utils import TableStore, table_to_frame
+from utils.image_utils import ImageEncoding, ImageResolutionPolicy, ImageWriter, apply_resolution_policy, write_image_manifest
+from utils.pdf_utils import PageProfile, classify_pages, count_pdf_pages, page_fingerprint, page_fingerprints, pdf_pages_to_bytes, split_pdf_pages
+from pypdf import PdfReader
+from pydantic import PrivateAttr
 
 IMAGE_RESOLUTION_SCALE = 2.0
 
+# One warmed converter per distinct set of pipeline options, shared by every caller in the process.
+# Each entry carries its own lock because the docling PDF backends are not thread-safe.
+_converters: Dict[str, Tuple[DocumentConverter, threading.Lock]] = {}
+_converters_lock = threading.Lock()
 
-def docling_parse(document_path: Union[str, Path], output_dir: Optional[str]=None, force_parse: bool=False, verbose: bool=False) -> tuple[DoclingDocument, ConversionResult]:
+
+def default_pipeline_options() -> PdfPipelineOptions:
+    pipeline_options = PdfPipelineOptions()
+    pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
+    pipeline_options.generate_page_images = True
+    pipeline_options.generate_table_images = True
+    pipeline_options.generate_picture_images = True
+    return pipeline_options
+
+
+def _pipeline_options_key(pipeline_options: PdfPipelineOptions) -> str:
+    return f"{type(pipeline_options).__name__}:{pipeline_options.model_dump_json()}"
+
+
+def _get_converter_entry(pipeline_options: Optional[PdfPipelineOptions]=None) -> Tuple[DocumentConverter, threading.Lock]:
+    pipeline_options = pipeline_options or default_pipeline_options()
+    key = _pipeline_options_key(pipeline_options)
+    entry = _converters.get(key)
+    if entry is None:
+        with _converters_lock:
+            entry = _converters.get(key)
+            if entry is None:
+                doc_converter = DocumentConverter(
+                    format_options={
+                        InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
+                    }
+                )
+                # loads the layout and table structure models now instead of on the first convert()
+                doc_converter.initialize_pipeline(InputFormat.PDF)
+                entry = (doc_converter, threading.Lock())
+                _converters[key] = entry
+    return entry
+
+
+def get_converter(pipeline_options: Optional[PdfPipelineOptions]=None) -> DocumentConverter:
+    """Return the process-wide converter for `pipeline_options`, building and warming it on first use.
+
+    The returned converter must not be used from several threads at once, see `checkout_converter`.
+    """
+    return _get_converter_entry(pipeline_options)[0]
+
+
+@contextmanager
+def checkout_converter(pipeline_options: Optional[PdfPipelineOptions]=None) -> Iterator[DocumentConverter]:
+    """Hold exclusive use of the shared converter for `pipeline_options` for the duration of the block."""
+    doc_converter, lock = _get_converter_entry(pipeline_options)
+    with lock:
+        yield doc_converter
+
+
+def preload_converters(*pipeline_options: PdfPipelineOptions) -> None:
+    """Build and warm converters ahead of time, e.g. in a worker initializer. Defaults to the standard options."""
+    for options in (pipeline_options or (default_pipeline_options(),)):
+        _get_converter_entry(options)
+
+
+def release_converters() -> None:
+    """Drop every cached converter so their models can be garbage collected."""
+    with _converters_lock:
+        entries = list(_converters.values())
+        _converters.clear()
+    # wait for in-flight conversions before letting go of the models
+    for _, lock in entries:
+        with lock:
+            pass
+    del entries
+    gc.collect()
+
+
+def _save_document(document: DoclingDocument, output_dir: Path):
+    # the compact copy is the only one written; load_lazy_document expands it into its own indexed file on demand
+    save_compact_document(document, output_dir)
+    # a document.json from before the compact format is superseded, drop it with its offset index
+    for filename in ('document.json', DOCUMENT_INDEX_FILENAME):
+        if (output_dir / filename).exists():
+            os.remove(output_dir / filename)
+
+
+def _save_conversion_result(conv_res: ConversionResult, output_dir: Path):
+    # compact like the document, and without its own copy of the document, which _save_document writes
+    data = json.loads(conv_res.model_dump_json(exclude={'document'}))
+    save_indexed_conversion_result(data, output_dir / COMPACT_CONVERSION_RESULT_FILENAME)
+    if (output_dir / 'conversion_result.json').exists():
+        os.remove(output_dir / 'conversion_result.json')
+
+
+def _remove_conversion_result(output_dir: Path):
+    for filename in ('conversion_result.json', COMPACT_CONVERSION_RESULT_FILENAME, CONVERSION_RESULT_INDEX_FILENAME):
+        if (output_dir / filename).exists():
+            os.remove(output_dir / filename)
+
+
+def _document_exists(output_dir: Path) -> bool:
+    return (output_dir / 'document.json').exists() or has_fresh_compact_document(output_dir)
+
+
+def _load_document(output_dir: Path) -> DoclingDocument:
+    if has_fresh_compact_document(output_dir):
+        # images stay in the sidecar files until ImageRef.pil_image is used
+        return load_compact_document(output_dir, embed_images=False)
+    return DoclingDocument.load_from_json_file(output_dir / 'document.json')
+
+
+class RestoredPage:
+    """Read-only stand-in for a docling Page restored from a saved conversion result.
+
+    page_no and size come from the index; the page itself is only read, through `read_page`, when its cells,
+    predictions or assembled unit are first used. The page image is taken from the saved DoclingDocument only
+    when it is requested.
+    """
+
+    def __init__(self, summary: dict, document: Union[DoclingDocument, LazyDocument, None],
+                 read_page: Optional[Callable[[], dict]] = None):
+        self._summary = summary
+        self._read_page = read_page
+        self._document = document
+        self.page_no: int = summary['page_no']
+        self.size: Optional[Size] = Size.model_validate(summary['size']) if summary.get('size') else None
+
+    @cached_property
+    def _data(self) -> dict:
+        return self._read_page() if self._read_page is not None else self._summary
+
+    @cached_property
+    def parsed_page(self) -> Optional[SegmentedPdfPage]:
+        parsed_page = self._data.get('parsed_page')
+        return SegmentedPdfPage.model_validate(parsed_page) if parsed_page is not None else None
+
+    @cached_property
+    def cells(self) -> List[TextCell]:
+        # docling keeps the text cells in parsed_page; results saved by older versions have them as 'cells'
+        if self.parsed_page is not None:
+            return list(self.parsed_page.textline_cells)
+        return [TextCell(index=cell['id'], text=cell['text'], orig=cell['text'], from_ocr=False,
+                         rect=BoundingRectangle.from_bounding_box(BoundingBox.model_validate(cell['bbox'])))
+                for cell in self._data.get('cells', [])]
+
+    @cached_property
+    def predictions(self) -> PagePredictions:
+        return PagePredictions.model_validate(self._data.get('predictions', {}))
+
+    @cached_property
+    def assembled(self) -> Optional[AssembledUnit]:
+        assembled = self._data.get('assembled')
+        return AssembledUnit.model_validate(assembled) if assembled is not None else None
+
+    def _page_item(self) -> Optional[PageItem]:
+        # Page.page_no is 0-based, DoclingDocument pages are keyed by 1-based page number
+        if self._document is None:
+            return None
+        if isinstance(self._document, LazyDocument):
+            return self._document.get_page(self.page_no + 1) if self.page_no + 1 in self._document.page_numbers else None
+        return self._document.pages.get(self.page_no + 1)
+
+    def get_image(self, scale: float = 1.0) -> Optional[Image.Image]:
+        page_item = self._page_item()
+        if page_item is None or page_item.image is None or page_item.image.pil_image is None:
+            return None
+        image = page_item.image.pil_image
+        stored_scale = page_item.image.dpi / 72
+        if abs(stored_scale - scale) < 1e-6:
+            return image
+        return image.resize((round(image.width * scale / stored_scale), round(image.height * scale / stored_scale)))
+
+    @property
+    def image(self) -> Optional[Image.Image]:
+        return self.get_image()
+
+
+class RestoredConversionResult:
+    """Read-only equivalent of a ConversionResult, restored from conversion_result.json.gz (or a legacy conversion_result.json).
+
+    A docling InputDocument can only be built by re-opening the source PDF, so `input` is a plain namespace
+    of the saved fields. Only the index is read when an attribute is first used: each page is read when it
+    is used, and the assembled unit and a legacy copy of the document only if they are asked for.
+    """
+
+    def __init__(self, output_dir: Union[str, Path], document: Union[DoclingDocument, LazyDocument, None] = None):
+        self.output_dir = Path(output_dir)
+        self._document = document
+
+    @cached_property
+    def _result(self) -> IndexedConversionResult:
+        return load_indexed_conversion_result(self.output_dir)
+
+    @property
+    def _data(self) -> dict:
+        return self._result.header
+
+    @cached_property
+    def input(self) -> SimpleNamespace:
+        data = dict(self._data['input'])
+        data['file'] = PurePath(data['file'])
+        return SimpleNamespace(**data)
+
+    @cached_property
+    def status(self) -> ConversionStatus:
+        return ConversionStatus(self._data.get('status', ConversionStatus.SUCCESS))
+
+    @cached_property
+    def errors(self) -> List[ErrorItem]:
+        return [ErrorItem.model_validate(error) for error in self._data.get('errors', [])]
+
+    @cached_property
+    def timings(self) -> Dict[str, ProfilingItem]:
+        return {key: ProfilingItem.model_validate(value) for key, value in self._data.get('timings', {}).items()}
+
+    @cached_property
+    def pages(self) -> List[RestoredPage]:
+        return [RestoredPage(summary, self.document, partial(self._result.page, i))
+                for i, summary in enumerate(self._result.page_summaries)]
+
+    @cached_property
+    def assembled(self) -> AssembledUnit:
+        return AssembledUnit.model_validate(self._result.field('assembled', {}))
+
+    @cached_property
+    def document(self) -> Union[DoclingDocument, LazyDocument]:
+        if self._document is not None:
+            return self._document
+        if self._result.has_field('document'):
+            # only results saved before the document was left out of them
+            return DoclingDocument.model_validate(self._result.field('document'))
+        return _load_document(self.output_dir)
+
+
+def load_conversion_result(output_dir: Union[str, Path], document: Union[DoclingDocument, LazyDocument, None] = None) -> Optional[RestoredConversionResult]:
+    output_dir = Path(output_dir)
+    if not ((output_dir / 'conversion_result.json').exists() or (output_dir / COMPACT_CONVERSION_RESULT_FILENAME).exists()):
+        return None
+    return RestoredConversionResult(output_dir, document)
+
+
+def init_conversion_worker(pipeline_options: Optional[PdfPipelineOptions]=None, threads_per_worker: Optional[int]=None):
+    """Process pool initializer: cap torch threads and warm this worker's converter."""
+    if threads_per_worker:
+        try:
+            import torch
+            torch.set_num_threads(threads_per_worker)
+        except ImportError:
+            pass
+    preload_converters(*([pipeline_options] if pipeline_options is not None else []))
+
+
+def _convert_shard(name: str, pdf_bytes: bytes, pipeline_options: Optional[PdfPipelineOptions]=None) -> dict:
+    with checkout_converter(pipeline_options) as doc_converter:
+        conv_res = doc_converter.convert(DocumentStream(name=name, stream=BytesIO(pdf_bytes)))
+    return conv_res.document.export_to_dict()
+
+
+_MERGED_COLLECTIONS = ('groups', 'texts', 'pictures', 'tables', 'key_value_items')
+_REF_PATTERN = re.compile(r"^#/(" + "|".join(_MERGED_COLLECTIONS) + r")/(\d+)$")
+
+
+def _offset_refs(node, ref_offsets: Dict[str, int], page_offset: int):
+    # rewrites "#/texts/N" style pointers and provenance page numbers of a shard item in place
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key in ('self_ref', '$ref', 'cref') and isinstance(value, str):
+                match = _REF_PATTERN.match(value)
+                if match:
+                    node[key] = f"#/{match.group(1)}/{int(match.group(2)) + ref_offsets[match.group(1)]}"
+            elif key == 'prov' and isinstance(value, list):
+                for prov in value:
+                    prov['page_no'] += page_offset
+                    _offset_refs(prov, ref_offsets, page_offset)
+            else:
+                _offset_refs(value, ref_offsets, page_offset)
+    elif isinstance(node, list):
+        for value in node:
+            _offset_refs(value, ref_offsets, page_offset)
+
+
+def merge_documents(shards: List[Tuple[int, dict]], name: str, origin: Optional[DocumentOrigin]=None) -> DoclingDocument:
+    """Merge exported shard documents into one DoclingDocument.
+
+    `shards` holds (page offset, shard.export_to_dict()) in page order, the offset being the number of pages
+    that precede the shard in the original PDF. Items are appended in shard order so the merged `self_ref`s
+    stay dense and in reading order.
+    """
+    merged = DoclingDocument(name=name, origin=origin).export_to_dict()
+    for collection in _MERGED_COLLECTIONS:
+        merged.setdefault(collection, [])
+    merged['pages'] = {}
+
+    for page_offset, shard in sorted(shards, key=lambda shard: shard[0]):
+        ref_offsets = {collection: len(merged[collection]) for collection in _MERGED_COLLECTIONS}
+        for collection in _MERGED_COLLECTIONS:
+            for item in shard.get(collection, []):
+                _offset_refs(item, ref_offsets, page_offset)
+                merged[collection].append(item)
+        for root in ('body', 'furniture'):
+            children = shard.get(root, {}).get('children', [])
+            _offset_refs(children, ref_offsets, page_offset)
+            merged[root]['children'].extend(children)
+        for page in shard.get('pages', {}).values():
+            page['page_no'] += page_offset
+            merged['pages'][str(page['page_no'])] = page
+
+    return DoclingDocument.model_validate(merged)
+
+
+def _convert_shards(document_path: Path, shards: List[Tuple[int, bytes]], max_workers: Optional[int]=None,
+                    pipeline_options: Optional[PdfPipelineOptions]=None) -> List[Tuple[int, dict]]:
+    # converts (first page index, PDF bytes) shards, in this process when a single worker is requested
+    max_workers = min(max_workers or os.cpu_count() or 1, len(shards))
+    if max_workers <= 1:
+        return [(start, _convert_shard(f"{document_path.stem}-{start}.pdf", pdf_bytes, pipeline_options)) for start, pdf_bytes in shards]
+
+    threads_per_worker = max(1, (os.cpu_count() or 1) // max_workers)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=init_conversion_worker, initargs=(pipeline_options, threads_per_worker)) as pool:
+        futures = [
+            (start, pool.submit(_convert_shard, f"{document_path.stem}-{start}.pdf", pdf_bytes, pipeline_options))
+            for start, pdf_bytes in shards
+        ]
+        return [(start, future.result()) for start, future in futures]
+
+
+def _document_origin(document_path: Path) -> DocumentOrigin:
+    # the origin docling would have recorded for the whole PDF, rather than the one of any shard
+    return DocumentOrigin(mimetype='application/pdf', binary_hash=file_hash(document_path), filename=document_path.name)
+
+
+def _docling_parse_sharded(document_path: Path, shard_pages: int, max_workers: Optional[int]=None,
+                           pipeline_options: Optional[PdfPipelineOptions]=None, verbose: bool=False) -> DoclingDocument:
+    shards = split_pdf_pages(document_path, shard_pages)
+    if verbose: print(f"Converting {len(shards)} shards of {shard_pages} pages")
+    shard_documents = _convert_shards(document_path, shards, max_workers, pipeline_options)
+    return merge_documents(shard_documents, name=document_path.stem, origin=_document_origin(document_path))
+
+
+def _convert_missing_pages(document_path: Path, fingerprints: Dict[int, str], store: PageStore, max_workers: Optional[int]=1,
+                           pipeline_options: Optional[PdfPipelineOptions]=None, verbose: bool=False) -> set:
+    # converts the pages (0-based index -> fingerprint) that have no result in the store yet, one page per shard,
+    # and returns the indices that were converted. Identical pages within the PDF are converted once.
+    missing = {}
+    for i, fingerprint in sorted(fingerprints.items()):
+        if not store.has(fingerprint) and fingerprint not in missing:
+            missing[fingerprint] = i
+    if verbose: print(f"Converting {len(missing)} of {len(fingerprints)} pages of {document_path}")
+    if missing:
+        reader = PdfReader(document_path)
+        shards = [(i, pdf_pages_to_bytes(reader, [i])) for i in missing.values()]
+        for i, page_document in _convert_shards(document_path, shards, max_workers, pipeline_options):
+            store.put(fingerprints[i], page_document)
+    return set(missing.values())
+
+
+def _route_pipeline_options(route: str, pipeline_options: PdfPipelineOptions) -> PdfPipelineOptions:
+    # 'text' pages have a usable text layer and skip OCR, 'ocr' pages OCR their bitmap areas, 'full-ocr' pages are scans
+    pipeline_options = pipeline_options.model_copy(deep=True)
+    pipeline_options.do_ocr = route != 'text'
+    if route != 'text':
+        pipeline_options.ocr_options.force_full_page_ocr = route == 'full-ocr'
+    return pipeline_options
+
+
+def _page_route(profile: PageProfile) -> str:
+    return {'born-digital': 'text', 'mixed': 'ocr', 'scanned': 'full-ocr'}[profile.kind]
+
+
+def _docling_parse_routed(document_path: Path, max_workers: Optional[int]=1, pipeline_options: Optional[PdfPipelineOptions]=None,
+                          verbose: bool=False) -> Tuple[DoclingDocument, dict]:
+    # classifies every page with a cheap pypdf pass, then converts runs of consecutive pages that share a route
+    # with that route's pipeline options. Rotated pages are written upright before conversion, so their page
+    # size and provenance are those of the upright page.
+    pipeline_options = pipeline_options or default_pipeline_options()
+    start_time = time.time()
+    profiles = classify_pages(document_path)
+    classify_seconds = time.time() - start_time
+
+    runs: List[Tuple[str, List[int]]] = []
+    for i, profile in enumerate(profiles):
+        route = _page_route(profile)
+        if runs and runs[-1][0] == route:
+            runs[-1][1].append(i)
+        else:
+            runs.append((route, [i]))
+    rotations = {i: profile.upright_rotation for i, profile in enumerate(profiles) if profile.rotation}
+
+    reader = PdfReader(document_path)
+    shard_documents = []
+    route_stats = {}
+    for route in sorted({route for route, _ in runs}):
+        route_start = time.time()
+        shards = [(pages[0], pdf_pages_to_bytes(reader, pages, rotations)) for run_route, pages in runs if run_route == route]
+        shard_documents.extend(_convert_shards(document_path, shards, max_workers, _route_pipeline_options(route, pipeline_options)))
+        route_stats[route] = {
+            'pages': sum(len(pages) for run_route, pages in runs if run_route == route),
+            'shards': len(shards),
+            'seconds': time.time() - route_start,
+        }
+        if verbose: print(f"Converted {route_stats[route]['pages']} '{route}' pages in {route_stats[route]['seconds']:.2f} seconds")
+
+    document = merge_documents(shard_documents, name=document_path.stem, origin=_document_origin(document_path))
+    report = {
+        'classify_seconds': classify_seconds,
+        'kinds': dict(Counter(profile.kind for profile in profiles)),
+        'routes': route_stats,
+        'rotated_pages': len(rotations),
+        'pages': [dict(vars(profile), route=_page_route(profile), corrected=i in rotations) for i, profile in enumerate(profiles)],
+    }
+    return document, report
+
+
+def current_rss() -> int:
+    # resident set size of this process in bytes
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        import resource
+        # not Linux: fall back to the lifetime peak, reported in kilobytes (bytes on macOS)
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+class MemoryMonitor:
+    """Samples the RSS of this process on a background thread while in use as a context manager."""
+
+    def __init__(self, interval: float = 0.05):
+        self.interval = interval
+        self.peak = current_rss()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, current_rss())
+
+    def reset_peak(self):
+        self.peak = current_rss()
+
+    def __enter__(self) -> "MemoryMonitor":
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, current_rss())
+
+
+# page batches of the low-memory mode: the first batch measures the per-page cost, later ones fill the budget
+LOW_MEMORY_FIRST_BATCH_PAGES = 2
+LOW_MEMORY_MAX_BATCH_PAGES = 32
+
+
+def _docling_parse_low_memory(document_path: Path, output_dir: Path, pipeline_options: Optional[PdfPipelineOptions]=None,
+                              rss_budget_mb: Optional[float]=None, verbose: bool=False) -> Tuple[DoclingDocument, dict]:
+    # Converts the PDF a few pages at a time, writing every page, table and picture image of a batch to
+    # output_dir/images as soon as the batch is done, so only one batch of rendered pages is ever held in memory.
+    # The document refers to those images by absolute path while in memory; once saved to output_dir they are
+    # stored as sidecar references relative to it.
+    reader = PdfReader(document_path)
+    num_pages = len(reader.pages)
+    budget = rss_budget_mb * 2**20 if rss_budget_mb else None
+    report = {'budget_mb': rss_budget_mb, 'baseline_rss_mb': current_rss() / 2**20, 'batches': [], 'spilled_images': 0}
+
+    shard_documents = []
+    batch_pages = LOW_MEMORY_FIRST_BATCH_PAGES
+    start = 0
+    with MemoryMonitor() as monitor:
+        document_peak = monitor.peak
+        while start < num_pages:
+            end = min(start + batch_pages, num_pages)
+            rss_before = current_rss()
+            monitor.reset_peak()
+            shard = _convert_shard(f"{document_path.stem}-{start}.pdf", pdf_pages_to_bytes(reader, range(start, end)), pipeline_options)
+            report['spilled_images'] += spill_images(shard, output_dir)
+            shard_documents.append((start, shard))
+            gc.collect()
+
+            batch_peak = monitor.peak
+            document_peak = max(document_peak, batch_peak)
+            report['batches'].append({'pages': [start + 1, end], 'peak_rss_mb': batch_peak / 2**20})
+            if verbose: print(f"Converted pages {start + 1}-{end} of {num_pages}, peak RSS {batch_peak / 2**20:.0f} MiB")
+
+            if budget is not None:
+                per_page = max(batch_peak - rss_before, 1) / (end - start)
+                headroom = budget - current_rss()
+                batch_pages = int(min(max(headroom // per_page, 1), LOW_MEMORY_MAX_BATCH_PAGES))
+            start = end
+
+    report['peak_rss_mb'] = document_peak / 2**20
+    report['budget_exceeded'] = budget is not None and document_peak > budget
+    document = merge_documents(shard_documents, name=document_path.stem, origin=_document_origin(document_path))
+    return document, report
+
+
+def _pages_unchanged(output_dir: Path, fingerprints: List[str], store: PageStore) -> bool:
+    # the saved document was assembled from exactly these pages, with the same pipeline options
+    return _document_exists(output_dir) and store.document_pages == fingerprints
+
+
+def docling_parse_incremental(document_path: Union[str, Path], output_dir: Optional[str]=None, force_parse: bool=False,
+                              verbose: bool=False, pipeline_options: Optional[PdfPipelineOptions]=None,
+                              max_workers: Optional[int]=1) -> Tuple[DoclingDocument, dict]:
+    """Convert only the pages whose content changed since the previous run and splice them into the document.
+
+    Per-page results are kept in `output_dir/pages`, addressed by a fingerprint of each page's content stream
+    and resources. Returns the document and a report of the 1-based page numbers that were reused or converted,
+    which is also written to `output_dir/page_report.json`.
+    """
+    start_time = time.time()
+    document_path = Path(document_path)
+    output_dir = Path(output_dir or document_path.with_suffix(''))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    pipeline_options = pipeline_options or default_pipeline_options()
+
+    fingerprints = page_fingerprints(document_path)
+    store = PageStore(output_dir / 'pages', options_fingerprint(pipeline_options))
+    if not force_parse and _pages_unchanged(output_dir, fingerprints, store):
+        if verbose: print(f"No page of {document_path} changed, loading the saved document from {output_dir}")
+        report = {'reused': list(range(1, len(fingerprints) + 1)), 'converted': []}
+        return _load_document(output_dir), report
+
+    converted = _convert_missing_pages(document_path, dict(enumerate(fingerprints)), store, max_workers, pipeline_options, verbose)
+
+    page_documents = [(i, store.get(fingerprint)) for i, fingerprint in enumerate(fingerprints)]
+    document = merge_documents(page_documents, name=document_path.stem, origin=_document_origin(document_path))
+    _save_document(document, output_dir)
+    store.document_pages = fingerprints
+    store.prune(set(fingerprints))
+
+    report = {
+        'reused': [i + 1 for i in range(len(fingerprints)) if i not in converted],
+        'converted': sorted(i + 1 for i in converted),
+    }
+    with open(output_dir / 'page_report.json', 'w') as f:
+        json.dump(report, f)
+
+    end_time = time.time() - start_time
+    if verbose: print(f"Reused {len(report['reused'])} pages, converted {len(report['converted'])} pages in {end_time:.2f} seconds.")
+    return document, report
+
+
+def format_page_selection(pages: Iterable[int]) -> str:
+    # [1, 2, 3, 7] -> "1-3_7", used to name the outputs of a page selection
+    pages = sorted(set(pages))
+    ranges = []
+    for page_no in pages:
+        if ranges and page_no == ranges[-1][1] + 1:
+            ranges[-1][1] = page_no
+        else:
+            ranges.append([page_no, page_no])
+    return "_".join(f"{start}-{end}" if start != end else f"{start}" for start, end in ranges)
+
+
+def _docling_parse_pages(document_path: Path, output_dir: Path, pages: Iterable[int], force_parse: bool=False,
+                         verbose: bool=False, pipeline_options: Optional[PdfPipelineOptions]=None,
+                         max_workers: Optional[int]=1) -> DoclingDocument:
+    # pages are 1-based like provenance page numbers. Finished pages are kept in the same per-page store as
+    # incremental parsing, so a later selection, or the full document, reuses them.
+    pages = list(pages)
+    pipeline_options = pipeline_options or default_pipeline_options()
+    reader = PdfReader(document_path)
+    num_pages = len(reader.pages)
+    page_indices = sorted({page_no - 1 for page_no in pages})
+    if not page_indices or page_indices[0] < 0 or page_indices[-1] >= num_pages:
+        raise ValueError(f"Page selection {format_page_selection(pages)} is out of range for {document_path} with {num_pages} pages")
+
+    fingerprints = {i: page_fingerprint(reader.pages[i]) for i in page_indices}
+    store = PageStore(output_dir / 'pages', options_fingerprint(pipeline_options))
+    if force_parse:
+        for fingerprint in fingerprints.values():
+            store.discard(fingerprint)
+    converted = _convert_missing_pages(document_path, fingerprints, store, max_workers, pipeline_options, verbose)
+    if verbose: print(f"Reused {len(page_indices) - len(converted)} pages, converted {len(converted)} pages")
+
+    page_documents = [(i, store.get(fingerprint)) for i, fingerprint in fingerprints.items()]
+    return merge_documents(page_documents, name=document_path.stem, origin=_document_origin(document_path))
+
+
+def docling_parse(document_path: Union[str, Path], output_dir: Optional[str]=None, force_parse: bool=False, verbose: bool=False,
+                  pipeline_options: Optional[PdfPipelineOptions]=None, shard_pages: Optional[int]=None,
+                  max_workers: Optional[int]=None, cache: Optional[ParseCache]=None,
+                  incremental: bool=False, pages: Optional[Iterable[int]]=None,
+                  lazy: bool=False, low_memory: bool=False, rss_budget_mb: Optional[float]=None,
+                  resolution_policy: Optional[ImageResolutionPolicy]=None, route_pages: bool=False) -> tuple[Union[DoclingDocument, LazyDocument], Union[ConversionResult, RestoredConversionResult]]:
+    # With a cache, the output directory is reused only if it was produced from the same PDF bytes and pipeline
+    # options, and any output directory can be filled from another directory's conversion of an identical PDF.
+    # shard_pages splits PDFs longer than that many pages into page ranges converted in parallel by max_workers
+    # processes and merged back into one document. A sharded conversion has no single ConversionResult, so
+    # conv_res is None and no conversion result is written.
+    # incremental re-converts only the pages that changed since the last run, see docling_parse_incremental.
+    # pages (1-based) converts only those pages, keeping their original page numbers; the partial document is
+    # returned without being saved.
+    # lazy returns a LazyDocument view instead of loading the whole document when it is already on disk.
+    # low_memory converts in page batches sized to stay within rss_budget_mb and spills every image to
+    # output_dir/images as it is produced; the peak RSS is written to memory_report.json.
+    # resolution_policy replaces the single images_scale: pages are rendered once at the finest scale the policy
+    # needs, then every table, picture and page image is reduced to its label's scale or pixel budget before the
+    # document is saved; the time and bytes saved are written to resolution_report.json.
+    # route_pages pre-classifies pages as born-digital, scanned or mixed and only OCRs, and turns upright, the pages
+    # that need it; the per-page routing is written to routing_report.json.
+    # The document is saved as document.json.gz and the conversion result, if any, as conversion_result.json.gz,
+    # both with their images in output_dir/images. When the document is loaded from disk, conv_res is a
+    # RestoredConversionResult read from the saved result on first use, or None if there is none.
     start_time = time.time()
 
     document_path = Path(document_path)
     output_dir = Path(output_dir or document_path.with_suffix(''))
     if not output_dir.exists():
         output_dir.mkdir(parents=True)
+
+    if pages is not None:
+        document = _docling_parse_pages(document_path, output_dir, pages, force_parse, verbose, pipeline_options, max_workers or 1)
+        return document, None
     
-    document_json_path = output_dir / 'document.json'
-    full_output_json_path = output_dir / 'conversion_result.json'
-    
-    
-    if not document_json_path.exists() or force_parse:
+    document_file_path = output_dir / COMPACT_DOCUMENT_FILENAME
+
+    if resolution_policy is not None:
+        pipeline_options = resolution_policy.apply_to_pipeline_options(pipeline_options or default_pipeline_options())
+
+    if cache is not None:
+        pipeline_options = pipeline_options or default_pipeline_options()
+        cache_extra = '|'.join(filter(None, [resolution_policy.fingerprint() if resolution_policy else '', 'routed' if route_pages else '']))
+        cache_key = cache.key(document_path, pipeline_options, cache_extra)
+        needs_parse = force_parse or not cache.get(cache_key, output_dir)
+    elif incremental:
+        # page fingerprints, not the existence of the saved document, decide what is stale; when no page changed
+        # the outputs are loaded like any saved conversion and left untouched
+        store = PageStore(output_dir / 'pages', options_fingerprint(pipeline_options or default_pipeline_options()))
+        needs_parse = force_parse or not _pages_unchanged(output_dir, page_fingerprints(document_path), store)
+    else:
+        needs_parse = force_parse or not _document_exists(output_dir)
+
+    if needs_parse:
         if verbose: print(f"Converting document: {document_path}")
         
-        pipeline_options = PdfPipelineOptions()
-        pipeline_options.images_scale = IMAGE_RESOLUTION_SCALE
-        pipeline_options.generate_page_images = True
-        pipeline_options.generate_table_images = True
-        pipeline_options.generate_picture_images = True
-
-        doc_converter = DocumentConverter(
-            format_options={
-                InputFormat.PDF: PdfFormatOption(pipeline_options=pipeline_options)
-            }
-        )
-        conv_res = doc_converter.convert(document_path)
-        with open(full_output_json_path, 'w') as f:
-            f.write(conv_res.model_dump_json())
+        if incremental:
+            conv_res = None
+            document, _ = docling_parse_incremental(document_path, output_dir, force_parse, verbose, pipeline_options, max_workers or 1)
+        elif low_memory:
+            conv_res = None
+            document, memory_report = _docling_parse_low_memory(document_path, output_dir, pipeline_options, rss_budget_mb, verbose)
+            with open(output_dir / 'memory_report.json', 'w') as f:
+                json.dump(memory_report, f, indent=4)
+            if verbose: print(f"Peak RSS {memory_report['peak_rss_mb']:.0f} MiB over {len(memory_report['batches'])} batches")
+        elif route_pages:
+            conv_res = None
+            document, routing_report = _docling_parse_routed(document_path, max_workers or 1, pipeline_options, verbose)
+            with open(output_dir / 'routing_report.json', 'w') as f:
+                json.dump(routing_report, f, indent=4)
+            if verbose: print(f"Page kinds: {routing_report['kinds']}, {routing_report['rotated_pages']} pages turned upright")
+        elif shard_pages and count_pdf_pages(document_path) > shard_pages:
+            conv_res = None
+            document = _docling_parse_sharded(document_path, shard_pages, max_workers, pipeline_options, verbose)
+        else:
+            with checkout_converter(pipeline_options) as doc_converter:
+                conv_res = doc_converter.convert(document_path)
+            _save_conversion_result(conv_res, output_dir)
+            document = conv_res.document
 
-        document = conv_res.document
-        document.save_to_json_file(document_json_path)
+        if resolution_policy is not None:
+            resolution_report = apply_resolution_policy(document, resolution_policy, output_dir / 'images')
+            with open(output_dir / 'resolution_report.json', 'w') as f:
+                json.dump(resolution_report, f, indent=4)
+            if verbose: print(f"Image resolution policy saved {resolution_report['bytes_saved'] / 2**20:.1f} MiB in {resolution_report['seconds']:.2f} seconds")
+        if not incremental or resolution_policy is not None:
+            _save_document(document, output_dir)
+        if conv_res is None:
+            # left over from an earlier unsharded conversion, it no longer describes the saved document
+            _remove_conversion_result(output_dir)
+        if cache is not None:
+            cache.put(cache_key, output_dir)
         # with open(document_json_path, 'w') as f:
         #     f.write(document.model_dump_json(indent=4))
 
         end_time = time.time() - start_time
-        if verbose: print(f"Document converted and DoclingDocument exported to JSON in {end_time:.2f} seconds.")
+        if verbose: print(f"Document converted and DoclingDocument saved to {document_file_path} in {end_time:.2f} seconds.")
     else:
-        if verbose: print(f"Loading document from JSON: {document_json_path}")
+        if verbose: print(f"Loading document from {document_file_path}")
 
-        conv_res = None  # load_conversion_result(full_output_json_path)
-        document = DoclingDocument.load_from_json_file(document_json_path)
+        document = load_lazy_document(output_dir) if lazy else _load_document(output_dir)
+        conv_res = load_conversion_result(output_dir, document)
         # with open(document_json_path, 'r') as f:
         #     document = DoclingDocument(**json.load(f))
     
@@ -68,7 +728,7 @@ def docling_parse(document_path: Union[str, Path], output_dir: Optional[str]=Non
 def _extract_table(table: TableItem, document: DoclingDocument) -> Tuple[Image.Image, pd.DataFrame, str, str, str]:
     table_image = table.image.pil_image
     table_md = table.export_to_markdown()
-    table_df = mdpd.from_md(table_md)
+    table_df = table_to_frame(table)
     table_caption = table.caption_text(document)
     table_md_formatted = f"## {table_caption}\n\n---\n\n{table_md}\n"
     return table_image, table_df, table_md_formatted, table_md, table_caption
@@ -79,107 +739,518 @@ def _extract_picture(picture: PictureItem, document: Optional[DoclingDocument]=N
     return picture_image
     
 
-def docling_export(document_path: Union[str, Path], output_dir: Optional[str] = None, origin_in_md: bool = False) -> Tuple[Dict[str, list], list, list]:
+def docling_export(document_path: Union[str, Path], output_dir: Optional[str] = None, origin_in_md: bool = False,
+                   pipeline_options: Optional[PdfPipelineOptions] = None,
+                   pages: Optional[Iterable[int]] = None, image_encoding: Union[str, ImageEncoding, None] = None,
+                   picture_encoding: Union[str, ImageEncoding, None] = None, image_workers: int = 4,
+                   attribution: Optional[Callable[[str, DocItem, int], str]] = None,
+                   table_store: Optional[TableStore] = None) -> Tuple[Dict[str, list], list, list]:
+    # Table and picture images are encoded by a pool of image_workers threads while the markdown is generated.
+    # image_encoding ('png:6', 'webp:lossless', 'jpeg:85', or an ImageEncoding) applies to every image,
+    # picture_encoding overrides it for pictures. What was written, or failed, is listed in images_manifest.json.
+    # attribution is a ModifiedExportDocument postprocess callback; when given, <name>-attributed.md is written too.
+    # table_store gets every table of the document, replacing the rows it held for an earlier export of it.
     document_path = Path(document_path)
     output_dir = output_dir or document_path.with_suffix('')
-    document, _ = docling_parse(document_path, output_dir)
+    # used twice below, so a generator must not be used up by the first
+    pages = list(pages) if pages is not None else None
+    document, _ = docling_parse(document_path, output_dir, pipeline_options=pipeline_options, pages=pages)
+    # a document loaded from disk keeps its images in files; -with-images.md needs them as a fresh parse has them
+    document = inline_images(document)
     doc_filename = document_path.stem
+    if pages is not None:
+        # exports of a page selection go next to, not over, the exports of the full document
+        output_dir = Path(output_dir) / f"pages-{format_page_selection(pages)}"
+        output_dir.mkdir(parents=True, exist_ok=True)
 
     start_time = time.time()
+    table_encoding = ImageEncoding.parse(image_encoding)
+    picture_encoding = ImageEncoding.parse(picture_encoding or image_encoding)
+    # the writer is entered before the walk, so its threads are shut down even if the export fails half way
+    with ImageWriter(max_workers=image_workers) as image_writer:
+        # Element files and the attributed markdown come out of one walk over the document: on_item handles the
+        # tables and pictures as the markdown engine reaches them, and the table markdown is rendered once for both
+        elements = {}
+        texts = []
+        tables = []
+        images = []
+        table_markdown = {}
 
-    # Save images of figures and tables
-    elements = {}
-    texts = []
-    tables = []
-    images = []
-    # for i, (element, _level) in enumerate(conv_res.document.iterate_items()):
-    for i, (element, _level) in enumerate(document.iterate_items()):
-        print(i, element.label)
-        if element.label not in elements:
-            elements[element.label] = [element]
-        else:
-            elements[element.label].append(element)
-        
-        if isinstance(element, TableItem):
-            # table_image, table_df, table_md_formatted, table_md, table_caption = _extract_table(element, conv_res.document)
-            table_image, table_df, table_md_formatted, table_md, table_caption = _extract_table(element, document)
-            # table_counter += 1
-
-            element_image_filename = os.path.join(output_dir, f"table-{len(elements[element.label])}.png")
-            if not os.path.exists(element_image_filename):
-                with open(element_image_filename, "wb") as fp:
-                    table_image.save(fp, "PNG")
-
-            element_md_filename = os.path.join(output_dir, f"table-{len(elements[element.label])}.md")
-            if not os.path.exists(element_md_filename):
-                with open(element_md_filename, "w") as fp:
-                    fp.write(table_md_formatted)
-            
-            tables.append(table_df)
-
-        if isinstance(element, PictureItem):
-            # picture_counter += 1
-            picture_image = _extract_picture(element)
-            element_image_filename = os.path.join(output_dir, f"picture-{len(elements[element.label])}.png")
-            if not os.path.exists(element_image_filename):
-                with open(element_image_filename, "wb") as fp:
-                    picture_image.save(fp, "PNG")
-            
-            images.append(picture_image)
-        
+        def export_element(element: DocItem):
+            print(sum(len(elements_list) for elements_list in elements.values()), element.label)
+            if element.label not in elements:
+                elements[element.label] = [element]
+            else:
+                elements[element.label].append(element)
+
+            if isinstance(element, TableItem):
+                table_image, table_df, table_md_formatted, table_md, table_caption = _extract_table(element, document)
+                table_markdown[element.self_ref] = table_md
+
+                element_image_filename = os.path.join(output_dir, f"table-{len(elements[element.label])}.{table_encoding.extension}")
+                image_writer.submit(element.self_ref, table_image, element_image_filename, table_encoding)
+
+                element_md_filename = os.path.join(output_dir, f"table-{len(elements[element.label])}.md")
+                if not os.path.exists(element_md_filename):
+                    with open(element_md_filename, "w") as fp:
+                        fp.write(table_md_formatted)
+
+                tables.append(table_df)
+
+            if isinstance(element, PictureItem):
+                picture_image = _extract_picture(element)
+                element_image_filename = os.path.join(output_dir, f"picture-{len(elements[element.label])}.{picture_encoding.extension}")
+                image_writer.submit(element.self_ref, picture_image, element_image_filename, picture_encoding)
+
+                images.append(picture_image)
+
+        # the fragment walk writes the element files and the attributed markdown; the plain markdown files keep
+        # the upstream rendering (footnotes, heading levels, formulas, escaping), which the walk does not reproduce
+        variants = {}
+        if attribution is not None:
+            variants[f"{doc_filename}-attributed.md"] = {'postprocess': attribution}
+        export_document = ModifiedExportDocument.from_document(document)
+        markdown = export_document.export_markdown_variants(variants, on_item=export_element, rendered_tables=table_markdown)
+        markdown[f"{doc_filename}-with-images.md"] = document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)  # markdown with embedded pictures
+        markdown[f"{doc_filename}.md"] = document.export_to_markdown()  # markdown without embedded pictures
+        for filename, content_md in markdown.items():
+            md_filename = os.path.join(output_dir, filename)
+            if not os.path.exists(md_filename):
+                with open(md_filename, "w") as fp:
+                    fp.write(content_md)
+
+        if table_store is not None:
+            table_rows = table_store.write_document(document)
+            print(f"Table store: {table_rows} cells of {len(document.tables)} tables written to {table_store.root}")
 
-    # Save markdown with embedded pictures
-    # content_md = conv_res.document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)
-    content_md = document.export_to_markdown(image_mode=ImageRefMode.EMBEDDED)  # , origin=origin_in_md)
-    # content_md = document.export_to_markdown(image_mode=ImageRefMode.EXPORTED_TO_PNG)  # , image_dir=Path(output_dir) / 'images')  # , origin=origin_in_md)
-    md_filename = os.path.join(output_dir, f"{doc_filename}-with-images.md")
-    if not os.path.exists(md_filename):
-        with open(md_filename, "w") as fp:
-            fp.write(content_md)
-
-    # Save markdown without embedded pictures
-    # content_md_no_embed = conv_res.document.export_to_markdown()
-    content_md_no_embed = document.export_to_markdown()  # origin=origin_in_md)
-    md_filename_no_embed = os.path.join(output_dir, f"{doc_filename}.md")
-    if not os.path.exists(md_filename_no_embed):
-        with open(md_filename_no_embed, "w") as fp:
-            fp.write(content_md_no_embed)
+        # the export is only done once every image is on disk
+        image_manifest = image_writer.flush()
+    image_summary = write_image_manifest(image_manifest, os.path.join(output_dir, "images_manifest.json"))
+    for entry in image_manifest:
+        if 'error' in entry:
+            print(f"Failed to write {entry['path']} ({entry['name']}): {entry['error']}")
 
     end_time = time.time() - start_time
 
     print(f"Document converted and figures exported in {end_time:.2f} seconds.")
+    print(f"Images: {image_summary['written']} written, {image_summary['skipped']} existing, {image_summary['failed']} failed, {image_summary['bytes'] / 2**20:.1f} MiB")
     for label, elements_list in elements.items():
         print(f"{label}: {len(elements_list)}")
     return elements, tables, images
 
 
+class _RenderContext:
+    # options of one export plus the list state the renderers share while walking the document
+    __slots__ = ('document', 'labels', 'strict_text', 'image_placeholder', 'image_modes', 'indent', 'text_width',
+                 'rendered_tables', 'list_nesting_level', 'in_list', 'options_key')
+
+    def __init__(self, document: "ModifiedExportDocument", labels, strict_text: bool, image_placeholder: str,
+                 image_modes: tuple, indent: int, text_width: int, rendered_tables: Optional[Dict[str, str]]):
+        self.document = document
+        self.labels = labels
+        self.strict_text = strict_text
+        self.image_placeholder = image_placeholder
+        self.image_modes = image_modes
+        self.indent = indent
+        self.text_width = text_width
+        self.rendered_tables = rendered_tables
+        self.list_nesting_level = 0  # Track the current list nesting level
+        self.in_list = False  # Track if we're currently processing list items
+        self.options_key = (frozenset(labels), strict_text, image_placeholder, indent, text_width)
+
+
+# A renderer takes (item, level, context) and returns the item's markdown fragments as (text, item) pairs, or None.
+# Renderers are looked up by (item type, label), falling back to (item type, None) and then to the base classes.
+MarkdownRenderer = Callable[[NodeItem, int, _RenderContext], Optional[List[Tuple[Union[str, Dict[ImageRefMode, str]], Optional[DocItem]]]]]
+MARKDOWN_RENDERERS: Dict[Tuple[type, Optional[str]], MarkdownRenderer] = {}
+
+
+def register_markdown_renderer(item_type: type, label: Optional[str] = None, renderer: Optional[MarkdownRenderer] = None):
+    """Register the renderer of `item_type` items with `label` (any label if None). Usable as a decorator."""
+    def register(renderer: MarkdownRenderer) -> MarkdownRenderer:
+        MARKDOWN_RENDERERS[(item_type, label)] = renderer
+        return renderer
+    return register(renderer) if renderer is not None else register
+
+
+def resolve_markdown_renderer(item_type: type, label: Optional[str],
+                              renderers: Optional[Dict[Tuple[type, Optional[str]], MarkdownRenderer]] = None) -> Optional[MarkdownRenderer]:
+    renderers = {**MARKDOWN_RENDERERS, **renderers} if renderers else MARKDOWN_RENDERERS
+    for cls in item_type.__mro__:
+        renderer = renderers.get((cls, label)) or renderers.get((cls, None))
+        if renderer is not None:
+            return renderer
+    return None
+
+
+@register_markdown_renderer(GroupItem, GroupLabel.LIST)
+@register_markdown_renderer(GroupItem, GroupLabel.ORDERED_LIST)
+def _render_list_group(item: GroupItem, level: int, ctx: _RenderContext):
+    fragments = None
+    if ctx.list_nesting_level == 0:  # Check if we're on the top level.
+        # In that case a new list starts directly after another list.
+        fragments = [("\n", None)]  # Add a blank line
+    # Increment list nesting level when entering a new list
+    ctx.list_nesting_level += 1
+    ctx.in_list = True
+    return fragments
+
+
+@register_markdown_renderer(GroupItem)
+@register_markdown_renderer(TextItem, DocItemLabel.CAPTION)  # captions are printed in picture and table ... skipping for now
+def _render_nothing(item: NodeItem, level: int, ctx: _RenderContext):
+    return None
+
+
+@register_markdown_renderer(TextItem, DocItemLabel.TITLE)
+def _render_title(item: TextItem, level: int, ctx: _RenderContext):
+    ctx.in_list = False
+    marker = "" if ctx.strict_text else "#"
+    return [(f"{marker} {item.text}".strip() + "\n", item)]
+
+
+@register_markdown_renderer(TextItem, DocItemLabel.SECTION_HEADER)
+@register_markdown_renderer(SectionHeaderItem)
+def _render_section_header(item: TextItem, level: int, ctx: _RenderContext):
+    ctx.in_list = False
+    marker = ""
+    if not ctx.strict_text:
+        marker = "#" * level
+        if len(marker) < 2:
+            marker = "##"
+    return [(f"{marker} {item.text}\n".strip() + "\n", item)]
+
+
+@register_markdown_renderer(TextItem, DocItemLabel.CODE)
+def _render_code(item: TextItem, level: int, ctx: _RenderContext):
+    ctx.in_list = False
+    return [(f"```\n{item.text}\n```\n", item)]
+
+
+@register_markdown_renderer(ListItem, DocItemLabel.LIST_ITEM)
+def _render_list_item(item: ListItem, level: int, ctx: _RenderContext):
+    ctx.in_list = True
+    # Calculate indent based on list_nesting_level
+    # -1 because level 1 needs no indent
+    list_indent = " " * (ctx.indent * (ctx.list_nesting_level - 1))
+
+    marker = ""
+    if ctx.strict_text:
+        marker = ""
+    elif item.enumerated:
+        marker = item.marker
+    else:
+        marker = "-"  # Markdown needs only dash as item marker.
+    return [(f"{list_indent}{marker} {item.text}", item)]
+
+
+@register_markdown_renderer(TextItem)
+def _render_text(item: TextItem, level: int, ctx: _RenderContext):
+    if item.label not in ctx.labels:
+        return None
+    ctx.in_list = False
+    if len(item.text) and ctx.text_width > 0:
+        return [(textwrap.fill(item.text, width=ctx.text_width) + "\n", item)]
+    elif len(item.text):
+        return [(f"{item.text}\n", item)]
+    return None
+
+
+@register_markdown_renderer(DocItem)
+def _render_missing_text(item: DocItem, level: int, ctx: _RenderContext):
+    if item.label not in ctx.labels:
+        return None
+    ctx.in_list = False
+    return [("<missing-text>", item)]
+
+
+@register_markdown_renderer(TableItem)
+def _render_table(item: TableItem, level: int, ctx: _RenderContext):
+    if ctx.strict_text:
+        return _render_missing_text(item, level, ctx)
+    ctx.in_list = False
+    if ctx.rendered_tables is not None and item.self_ref in ctx.rendered_tables:
+        md_table = ctx.rendered_tables[item.self_ref]
+    else:
+        md_table = item.export_to_markdown()
+    return [(item.caption_text(ctx.document), item), ("\n" + md_table + "\n", item)]
+
+
+def _picture_markdown(item: PictureItem, image_mode: ImageRefMode, image_placeholder: str) -> str:
+    if image_mode == ImageRefMode.PLACEHOLDER:
+        return "\n" + image_placeholder + "\n"
+    elif image_mode == ImageRefMode.EMBEDDED and isinstance(item.image, ImageRef):
+        return f"![Image]({item.image.uri})\n"
+    elif image_mode == ImageRefMode.EMBEDDED and not isinstance(item.image, ImageRef):
+        return (
+            "<!-- 🖼️❌ Image not available. "
+            "Please use `PdfPipelineOptions(generate_picture_images=True)`"
+            " --> "
+        )
+    return ""
+
+
+@register_markdown_renderer(PictureItem)
+def _render_picture(item: PictureItem, level: int, ctx: _RenderContext):
+    if ctx.strict_text:
+        return _render_missing_text(item, level, ctx)
+    ctx.in_list = False
+    # one rendering per image mode requested by the variants of this export
+    return [(item.caption_text(ctx.document), item),
+            ({image_mode: _picture_markdown(item, image_mode, ctx.image_placeholder) for image_mode in ctx.image_modes}, item)]
+
+
+def _item_signature(item: NodeItem, document: DoclingDocument) -> tuple:
+    # what a cached fragment of `item` was rendered from; an item whose signature changed is rendered again
+    if isinstance(item, TextItem):
+        return (type(item), item.label, item.text, getattr(item, 'marker', None), getattr(item, 'enumerated', None))
+    if isinstance(item, TableItem):
+        # the cells only: the computed grid would cost about as much as rendering the table
+        return (type(item), item.label, item.data.model_dump_json(exclude={'grid'}), item.caption_text(document))
+    if isinstance(item, PictureItem):
+        image_uri = str(item.image.uri) if item.image is not None and not str(item.image.uri).startswith('data:') else id(item.image)
+        return (type(item), item.label, image_uri, item.caption_text(document))
+    return (type(item), item.label)
+
+
+class FragmentCache:
+    """Rendered markdown fragments of one document, reused across exports.
+
+    Entries are keyed by the item's self_ref, its renderer, the render options and the list state the item is
+    rendered in, and hold the fragments with the list state they leave behind. An entry is only reused while the
+    item's content signature is unchanged, so editing an item re-renders it on the next export.
+    """
+
+    def __init__(self):
+        self.entries: Dict[tuple, tuple] = {}
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def render(self, item: NodeItem, level: int, ctx: "_RenderContext", renderer: "MarkdownRenderer"):
+        # only pictures render differently per image mode
+        options_key = ctx.options_key + (ctx.image_modes,) if isinstance(item, PictureItem) else ctx.options_key
+        key = (item.self_ref, renderer, options_key, level, ctx.list_nesting_level, ctx.in_list)
+        signature = _item_signature(item, ctx.document)
+        entry = self.entries.get(key)
+        if entry is not None and entry[0] == signature:
+            self.hits += 1
+            _, fragments, ctx.in_list, ctx.list_nesting_level = entry
+            return fragments
+        if entry is not None:
+            self.invalidations += 1
+        self.misses += 1
+        fragments = renderer(item, level, ctx)
+        self.entries[key] = (signature, fragments, ctx.in_list, ctx.list_nesting_level)
+        return fragments
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'invalidations': self.invalidations,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': len(self.entries),
+        }
+
+
+class _MarkdownAssembler:
+    # collects the fragments of one markdown variant and finishes them into the exported text
+    def __init__(self, delim: str = "\n", image_mode: ImageRefMode = ImageRefMode.PLACEHOLDER,
+                 postprocess: Optional[Callable[[str, DocItem, int], str]] = None):
+        self.delim = delim
+        self.image_mode = image_mode
+        self.postprocess = postprocess
+        self.mdtexts: list[str] = []
+
+    def add(self, text: Union[str, Dict[ImageRefMode, str]], item: Optional[DocItem], ix: int):
+        if isinstance(text, dict):
+            text = text[self.image_mode]
+        if self.postprocess is not None and item is not None:
+            text = self.postprocess(text, item, ix) if text else text
+        self.mdtexts.append(text)
+
+    def end_list(self):
+        self.mdtexts[-1] += "\n"
+
+    def result(self) -> str:
+        mdtext = (self.delim.join(self.mdtexts)).strip()
+        mdtext = re.sub(
+            r"\n\n\n+", "\n\n", mdtext
+        )  # remove cases of double or more empty lines.
+
+        # Our export markdown doesn't contain any emphasis styling:
+        # Bold, Italic, or Bold-Italic
+        # Hence, any underscore that we print into Markdown is coming from document text
+        # That means we need to escape it, to properly reflect content in the markdown
+        def escape_underscores(text):
+            # Replace "_" with "\_" only if it's not already escaped
+            escaped_text = re.sub(r"(?<!\\)_", r"\_", text)
+            return escaped_text
+
+        return escape_underscores(mdtext)
+
+
+# batched postprocess hook: takes [(text, item, index), ...] and returns the rewritten texts in the same order
+BatchPostprocess = Callable[[List[Tuple[str, DocItem, int]]], List[str]]
+
+
+class _BatchMarkdownAssembler(_MarkdownAssembler):
+    # gathers the fragments to postprocess and hands them to the hook in batches when the text is finished.
+    # List-end newlines are kept aside and appended after the hook has rewritten the fragment they belong to.
+    def __init__(self, delim: str = "\n", image_mode: ImageRefMode = ImageRefMode.PLACEHOLDER,
+                 postprocess_batch: Optional[BatchPostprocess] = None, batch_size: int = 64):
+        super().__init__(delim, image_mode)
+        self.postprocess_batch = postprocess_batch
+        self.batch_size = batch_size
+        self.pending: List[Tuple[int, Tuple[str, DocItem, int]]] = []
+        self.suffixes: Dict[int, str] = {}
+
+    def add(self, text: Union[str, Dict[ImageRefMode, str]], item: Optional[DocItem], ix: int):
+        super().add(text, item, ix)
+        if item is not None and self.mdtexts[-1]:
+            self.pending.append((len(self.mdtexts) - 1, (self.mdtexts[-1], item, ix)))
+
+    def end_list(self):
+        position = len(self.mdtexts) - 1
+        self.suffixes[position] = self.suffixes.get(position, "") + "\n"
+
+    def batches(self) -> List[List[Tuple[int, Tuple[str, DocItem, int]]]]:
+        return [self.pending[i:i + self.batch_size] for i in range(0, len(self.pending), self.batch_size)]
+
+    def apply(self, batch: List[Tuple[int, Tuple[str, DocItem, int]]], texts: List[str]):
+        if len(texts) != len(batch):
+            raise ValueError(f"postprocess_batch returned {len(texts)} texts for a batch of {len(batch)} fragments")
+        for (position, _), text in zip(batch, texts):
+            self.mdtexts[position] = text
+
+    def finish(self) -> str:
+        for position, suffix in self.suffixes.items():
+            self.mdtexts[position] += suffix
+        return super().result()
+
+    def result(self) -> str:
+        for batch in self.batches():
+            self.apply(batch, self.postprocess_batch([fragment for _, fragment in batch]))
+        return self.finish()
+
+    async def aresult(self, max_concurrency: int = 4) -> str:
+        # the hook is a coroutine function here; at most max_concurrency batches are awaited at once
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(batch):
+            async with semaphore:
+                self.apply(batch, await self.postprocess_batch([fragment for _, fragment in batch]))
+
+        await asyncio.gather(*(run(batch) for batch in self.batches()))
+        return self.finish()
+
+
+class _MarkdownStream:
+    # incremental form of _MarkdownAssembler.result(): strip, blank-line collapsing and underscore escaping applied
+    # to text as it arrives. Whitespace is held back until more text follows it, so a run of newlines is only
+    # collapsed once it is complete and trailing whitespace never reaches the output.
+    def __init__(self):
+        self.started = False
+        self.held = ""
+        self.previous_char = ""
+
+    def feed(self, text: str) -> str:
+        if not self.started:
+            text = text.lstrip()
+            if not text:
+                return ""
+            self.started = True
+        text = self.held + text
+        complete = text.rstrip()
+        self.held = text[len(complete):]
+        if not complete:
+            return ""
+        complete = re.sub(r"\n\n\n+", "\n\n", complete)
+        # the character before this chunk decides whether its first underscore is already escaped
+        prefix = "\\" if self.previous_char == "\\" else " "
+        escaped = re.sub(r"(?<!\\)_", r"\_", prefix + complete)[1:]
+        self.previous_char = complete[-1]
+        return escaped
+
+    def close(self) -> str:
+        self.held = ""
+        return ""
+
+
+class _StreamingMarkdownAssembler(_MarkdownAssembler):
+    def __init__(self, delim: str = "\n", image_mode: ImageRefMode = ImageRefMode.PLACEHOLDER,
+                 postprocess: Optional[Callable[[str, DocItem, int], str]] = None):
+        super().__init__(delim, image_mode, postprocess)
+        self.stream = _MarkdownStream()
+        self.first = True
+
+    def add(self, text: Union[str, Dict[ImageRefMode, str]], item: Optional[DocItem], ix: int) -> str:
+        # the list-end newline belongs to the previous fragment and the delimiter goes between fragments,
+        # so both can be written out as they come without holding fragments back
+        super().add(text, item, ix)
+        text = self.mdtexts.pop()
+        out = self.stream.feed(text if self.first else self.delim + text)
+        self.first = False
+        return out
+
+    def end_list(self) -> str:
+        return self.stream.feed("\n")
+
+    def result(self) -> str:
+        return self.stream.close()
+
+
 class ModifiedExportDocument(DoclingDocument):
+    _fragment_cache: Optional[FragmentCache] = PrivateAttr(default=None)
 
-    def export_to_markdown(self, delim = "\n", from_element = 0, to_element = sys.maxsize, 
-                           labels = DEFAULT_EXPORT_LABELS, strict_text = False, image_placeholder = "<!-- image -->", 
-                           image_mode = ImageRefMode.PLACEHOLDER, indent = 4, text_width = -1, page_no = None,
-                           postprocess: Optional[Callable[[str, "DoclingDocument", int], str]] = None) -> str:
-        mdtexts: list[str] = []
-        list_nesting_level = 0  # Track the current list nesting level
-        previous_level = 0  # Track the previous item's level
-        in_list = False  # Track if we're currently processing list items
+    @property
+    def fragment_cache(self) -> FragmentCache:
+        # repeated exports of this document, with or without postprocess, page_no or images, share rendered fragments
+        if self._fragment_cache is None:
+            self._fragment_cache = FragmentCache()
+        return self._fragment_cache
 
+    @classmethod
+    def from_document(cls, document: DoclingDocument) -> "ModifiedExportDocument":
+        # shares the items of `document` instead of copying them through export_to_dict
+        return cls.model_construct(_fields_set=document.model_fields_set, **{name: getattr(document, name) for name in document.model_fields})
 
-        def apply_postprocess(text: str, item: DocItem, index: int):
-            if postprocess is not None:
-                text = postprocess(text, item, index) if text else text
-            mdtexts.append(text)
-        
+    def _iter_fragments(self, from_element = 0, to_element = sys.maxsize, labels = DEFAULT_EXPORT_LABELS,
+                        strict_text = False, image_placeholder = "<!-- image -->",
+                        image_modes = (ImageRefMode.PLACEHOLDER,), indent = 4, text_width = -1, page_no = None,
+                        on_item: Optional[Callable[[DocItem], None]] = None, rendered_tables: Optional[Dict[str, str]] = None,
+                        renderers: Optional[Dict[Tuple[type, Optional[str]], MarkdownRenderer]] = None,
+                        use_cache: bool = True) -> Iterator[Tuple[Union[str, Dict[ImageRefMode, str], None], Optional[DocItem], int]]:
+        # The single traversal behind every markdown export. Yields (text, item, index) per markdown fragment;
+        # the text of a picture is a dict with one rendering per requested image mode, every other fragment is
+        # rendered once and shared by all variants. (None, None, index) marks the end of a list, after which the
+        # previous fragment gets a trailing newline, and a fragment without an item is not postprocessed.
+        # on_item sees every DocItem, in or out of the element range, before it is rendered; rendered_tables maps
+        # self_refs to table markdown the caller already has. renderers override MARKDOWN_RENDERERS for this export.
+        # Each item's renderer is resolved once per (type, label) instead of testing every item against every rule,
+        # and its fragments come from the document's FragmentCache when it was rendered the same way before.
+        ctx = _RenderContext(self, labels, strict_text, image_placeholder, image_modes, indent, text_width, rendered_tables)
+        # the caller's table markdown is not part of the cache key, so fragments rendered with it are not cached
+        fragment_cache = self.fragment_cache if use_cache and rendered_tables is None else None
+        resolved: Dict[Tuple[type, str], Optional[MarkdownRenderer]] = {}
+        previous_level = 0  # Track the previous item's level
+        emitted = 0
 
         for ix, (item, level) in enumerate(
             self.iterate_items(self.body, with_groups=True, page_no=page_no)
         ):
+            if on_item is not None and isinstance(item, DocItem):
+                on_item(item)
+
             # If we've moved to a lower level, we're exiting one or more groups
             if level < previous_level:
-                # Calculate how many levels we've exited
-                level_difference = previous_level - level
                 # Decrement list_nesting_level for each list group we've exited
-                list_nesting_level = max(0, list_nesting_level - level_difference)
+                ctx.list_nesting_level = max(0, ctx.list_nesting_level - (previous_level - level))
 
             previous_level = level  # Update previous_level for next iteration
 
@@ -187,147 +1258,139 @@ class ModifiedExportDocument(DoclingDocument):
                 continue  # skip as many items as you want
 
             # Handle newlines between different types of content
-            if (
-                len(mdtexts) > 0
-                and not isinstance(item, (ListItem, GroupItem))
-                and in_list
-            ):
-                mdtexts[-1] += "\n"
-                in_list = False
-
-            if isinstance(item, GroupItem) and item.label in [
-                GroupLabel.LIST,
-                GroupLabel.ORDERED_LIST,
-            ]:
-
-                if list_nesting_level == 0:  # Check if we're on the top level.
-                    # In that case a new list starts directly after another list.
-                    mdtexts.append("\n")  # Add a blank line
-
-                # Increment list nesting level when entering a new list
-                list_nesting_level += 1
-                in_list = True
-                continue
-
-            elif isinstance(item, GroupItem):
-                continue
-
-            elif isinstance(item, TextItem) and item.label in [DocItemLabel.TITLE]:
-                in_list = False
-                marker = "" if strict_text else "#"
-                text = f"{marker} {item.text}"
-                # mdtexts.append(text.strip() + "\n")
-                apply_postprocess(text.strip() + "\n", item, ix)
-
-            elif (
-                isinstance(item, TextItem)
-                and item.label in [DocItemLabel.SECTION_HEADER]
-            ) or isinstance(item, SectionHeaderItem):
-                in_list = False
-                marker = ""
-                if not strict_text:
-                    marker = "#" * level
-                    if len(marker) < 2:
-                        marker = "##"
-                text = f"{marker} {item.text}\n"
-                # mdtexts.append(text.strip() + "\n")
-                apply_postprocess(text.strip() + "\n", item, ix)
-
-            elif isinstance(item, TextItem) and item.label in [DocItemLabel.CODE]:
-                in_list = False
-                text = f"```\n{item.text}\n```\n"
-                # mdtexts.append(text)
-                apply_postprocess(text, item, ix)
-
-            elif isinstance(item, TextItem) and item.label in [DocItemLabel.CAPTION]:
-                # captions are printed in picture and table ... skipping for now
-                continue
-
-            elif isinstance(item, ListItem) and item.label in [DocItemLabel.LIST_ITEM]:
-                in_list = True
-                # Calculate indent based on list_nesting_level
-                # -1 because level 1 needs no indent
-                list_indent = " " * (indent * (list_nesting_level - 1))
-
-                marker = ""
-                if strict_text:
-                    marker = ""
-                elif item.enumerated:
-                    marker = item.marker
+            if emitted > 0 and ctx.in_list and not isinstance(item, (ListItem, GroupItem)):
+                yield None, None, ix
+                ctx.in_list = False
+
+            key = (type(item), item.label)
+            renderer = resolved.get(key, resolved)
+            if renderer is resolved:
+                renderer = resolved[key] = resolve_markdown_renderer(type(item), item.label, renderers)
+            if renderer is None:
+                fragments = None
+            elif fragment_cache is not None:
+                fragments = fragment_cache.render(item, level, ctx, renderer)
+            else:
+                fragments = renderer(item, level, ctx)
+            if fragments:
+                for text, fragment_item in fragments:
+                    emitted += 1
+                    yield text, fragment_item, ix
+
+    def export_markdown_variants(self, variants: Dict[str, dict], delim = "\n", from_element = 0, to_element = sys.maxsize,
+                                 labels = DEFAULT_EXPORT_LABELS, strict_text = False, image_placeholder = "<!-- image -->",
+                                 indent = 4, text_width = -1, page_no = None,
+                                 on_item: Optional[Callable[[DocItem], None]] = None,
+                                 rendered_tables: Optional[Dict[str, str]] = None,
+                                 renderers: Optional[Dict[Tuple[type, Optional[str]], MarkdownRenderer]] = None, use_cache: bool = True) -> Dict[str, str]:
+        """Render several markdown exports in one walk over the document.
+
+        `variants` maps a name to its `image_mode` and `postprocess`, e.g.
+        {'plain': {}, 'with_images': {'image_mode': ImageRefMode.EMBEDDED}, 'attributed': {'postprocess': f}}.
+        A variant can give `postprocess_batch` and `batch_size` instead of `postprocess`, see export_to_markdown.
+        Each returned text is identical to the matching export_to_markdown call. `renderers` maps (item type, label)
+        to a renderer used instead of the registered one, see register_markdown_renderer. With use_cache, fragments
+        rendered by earlier exports of this document are reused, see fragment_cache.
+        """
+        assemblers = self._assemble_variants(variants, delim, from_element, to_element, labels, strict_text, image_placeholder,
+                                             indent, text_width, page_no, on_item, rendered_tables, renderers, use_cache)
+        return {name: assembler.result() for name, assembler in assemblers.items()}
+
+    def _assemble_variants(self, variants: Dict[str, dict], delim, from_element, to_element, labels, strict_text,
+                           image_placeholder, indent, text_width, page_no, on_item, rendered_tables, renderers,
+                           use_cache: bool = True) -> Dict[str, _MarkdownAssembler]:
+        assemblers = {}
+        for name, options in variants.items():
+            image_mode = options.get('image_mode', ImageRefMode.PLACEHOLDER)
+            if options.get('postprocess_batch') is not None:
+                assemblers[name] = _BatchMarkdownAssembler(delim, image_mode, options['postprocess_batch'], options.get('batch_size', 64))
+            else:
+                assemblers[name] = _MarkdownAssembler(delim, image_mode, options.get('postprocess'))
+        image_modes = tuple({assembler.image_mode for assembler in assemblers.values()})
+        for text, item, ix in self._iter_fragments(from_element, to_element, labels, strict_text, image_placeholder,
+                                                   image_modes, indent, text_width, page_no, on_item, rendered_tables, renderers,
+                                                   use_cache):
+            for assembler in assemblers.values():
+                if text is None:
+                    assembler.end_list()
                 else:
-                    marker = "-"  # Markdown needs only dash as item marker.
-
-                text = f"{list_indent}{marker} {item.text}"
-                # mdtexts.append(text)
-                apply_postprocess(text, item, ix)
-
-            elif isinstance(item, TextItem) and item.label in labels:
-                in_list = False
-                if len(item.text) and text_width > 0:
-                    wrapped_text = textwrap.fill(text, width=text_width)
-                    # mdtexts.append(wrapped_text + "\n")
-                    apply_postprocess(wrapped_text + "\n", item, ix)
-                elif len(item.text):
-                    text = f"{item.text}\n"
-                    # mdtexts.append(text)
-                    apply_postprocess(text, item, ix)
-
-            elif isinstance(item, TableItem) and not strict_text:
-                in_list = False
-                # mdtexts.append(item.caption_text(self))
-                apply_postprocess(item.caption_text(self), item, ix)
-                md_table = item.export_to_markdown()
-                # mdtexts.append("\n" + md_table + "\n")
-                apply_postprocess("\n" + md_table + "\n", item, ix)
-
-            elif isinstance(item, PictureItem) and not strict_text:
-                in_list = False
-                # mdtexts.append(item.caption_text(self))
-                apply_postprocess(item.caption_text(self), item, ix)
-
-                if image_mode == ImageRefMode.PLACEHOLDER:
-                    # mdtexts.append("\n" + image_placeholder + "\n")
-                    apply_postprocess("\n" + image_placeholder + "\n", item, ix)
-                elif image_mode == ImageRefMode.EMBEDDED and isinstance(
-                    item.image, ImageRef
-                ):
-                    text = f"![Local Image]({item.image.uri})\n"
-                    # mdtexts.append(text)
-                    apply_postprocess(text, item, ix)
-                elif image_mode == ImageRefMode.EMBEDDED and not isinstance(
-                    item.image, ImageRef
-                ):
-                    text = (
-                        "<!-- 🖼️❌ Image not available. "
-                        "Please use `PdfPipelineOptions(generate_picture_images=True)`"
-                        " --> "
-                    )
-                    # mdtexts.append(text)
-                    apply_postprocess(text, item, ix)
-
-            elif isinstance(item, DocItem) and item.label in labels:
-                in_list = False
-                text = "<missing-text>"
-                # mdtexts.append(text)
-                apply_postprocess(text, item, ix)
-
-        mdtext = (delim.join(mdtexts)).strip()
-        mdtext = re.sub(
-            r"\n\n\n+", "\n\n", mdtext
-        )  # remove cases of double or more empty lines.
+                    assembler.add(text, item, ix)
+        return assemblers
 
-        # Our export markdown doesn't contain any emphasis styling:
-        # Bold, Italic, or Bold-Italic
-        # Hence, any underscore that we print into Markdown is coming from document text
-        # That means we need to escape it, to properly reflect content in the markdown
-        def escape_underscores(text):
-            # Replace "_" with "\_" only if it's not already escaped
-            escaped_text = re.sub(r"(?<!\\)_", r"\_", text)
-            return escaped_text
+    def iter_markdown(self, delim = "\n", from_element = 0, to_element = sys.maxsize, labels = DEFAULT_EXPORT_LABELS,
+                      strict_text = False, image_placeholder = "<!-- image -->", image_mode = ImageRefMode.PLACEHOLDER,
+                      indent = 4, text_width = -1, page_no = None,
+                      postprocess: Optional[Callable[[str, "DoclingDocument", int], str]] = None,
+                      chunk_size: int = 1 << 16, renderers: Optional[Dict[Tuple[type, Optional[str]], MarkdownRenderer]] = None,
+                      use_cache: bool = True) -> Iterator[str]:
+        """Yield the export_to_markdown text in chunks of about chunk_size characters as the items are rendered.
+
+        Joining the chunks gives exactly the export_to_markdown output, without the whole text ever being in memory.
+        """
+        assembler = _StreamingMarkdownAssembler(delim, image_mode, postprocess)
+        pending, pending_size = [], 0
+        for text, item, ix in self._iter_fragments(from_element, to_element, labels, strict_text, image_placeholder,
+                                                   (image_mode,), indent, text_width, page_no, renderers=renderers,
+                                                   use_cache=use_cache):
+            out = assembler.end_list() if text is None else assembler.add(text, item, ix)
+            if out:
+                pending.append(out)
+                pending_size += len(out)
+                if pending_size >= chunk_size:
+                    yield "".join(pending)
+                    pending, pending_size = [], 0
+        pending.append(assembler.result())
+        if "".join(pending):
+            yield "".join(pending)
+
+    def write_markdown(self, out, encoding: str = "utf-8", **kwargs) -> int:
+        """Stream the markdown export to a path, a binary or text file object, or a socket. Returns the bytes written."""
+        if isinstance(out, (str, PurePath)):
+            with open(out, "wb") as f:
+                return self.write_markdown(f, encoding, **kwargs)
+        written = 0
+        for chunk in self.iter_markdown(**kwargs):
+            if hasattr(out, "sendall"):
+                data = chunk.encode(encoding)
+                out.sendall(data)
+            elif isinstance(out, TextIOBase):
+                out.write(chunk)
+                data = chunk.encode(encoding)
+            else:
+                data = chunk.encode(encoding)
+                out.write(data)
+            written += len(data)
+        return written
 
-        mdtext = escape_underscores(mdtext)
+    def export_to_markdown(self, delim = "\n", from_element = 0, to_element = sys.maxsize, 
+                           labels = DEFAULT_EXPORT_LABELS, strict_text = False, image_placeholder = "<!-- image -->", 
+                           image_mode = ImageRefMode.PLACEHOLDER, indent = 4, text_width = -1, page_no = None,
+                           postprocess: Optional[Callable[[str, "DoclingDocument", int], str]] = None,
+                           renderers: Optional[Dict[Tuple[type, Optional[str]], MarkdownRenderer]] = None,
+                           postprocess_batch: Optional[BatchPostprocess] = None, batch_size: int = 64,
+                           use_cache: bool = True) -> str:
+        # postprocess_batch replaces postprocess with one call per batch_size fragments, each fragment given as
+        # (text, item, index), e.g. to send them to a model in a single request; it returns the texts in order
+        return self.export_markdown_variants(
+            {'markdown': {'image_mode': image_mode, 'postprocess': postprocess, 'postprocess_batch': postprocess_batch,
+                          'batch_size': batch_size}},
+            delim, from_element, to_element, labels, strict_text, image_placeholder, indent, text_width, page_no,
+            renderers=renderers, use_cache=use_cache,
+        )['markdown']
 
-        return mdtext
+    async def aexport_to_markdown(self, postprocess_batch: Callable[[List[Tuple[str, DocItem, int]]], Awaitable[List[str]]],
+                                  batch_size: int = 64, max_concurrency: int = 4, delim = "\n", from_element = 0,
+                                  to_element = sys.maxsize, labels = DEFAULT_EXPORT_LABELS, strict_text = False,
+                                  image_placeholder = "<!-- image -->", image_mode = ImageRefMode.PLACEHOLDER, indent = 4,
+                                  text_width = -1, page_no = None,
+                                  renderers: Optional[Dict[Tuple[type, Optional[str]], MarkdownRenderer]] = None) -> str:
+        """export_to_markdown with an async batch hook, awaiting up to max_concurrency batches at a time."""
+        assembler = self._assemble_variants(
+            {'markdown': {'image_mode': image_mode, 'postprocess_batch': postprocess_batch, 'batch_size': batch_size}},
+            delim, from_element, to_element, labels, strict_text, image_placeholder, indent, text_width, page_no,
+            None, None, renderers,
+        )['markdown']
+        return await assembler.aresult(max_concurrency)
     
 
 if __name__ == "__main__":
@@ -1,23 +1,146 @@
-
-from dotenv import load_dotenv
-load_dotenv()
-import mdpd
+import hashlib
+import json
 import os
-import pandas as pd
+import threading
+import time
+import weakref
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, fields
+from docling_core.types.doc.document import DoclingDocument
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from elasticsearch import ApiError, AsyncElasticsearch, Elasticsearch
+from elasticsearch.helpers import expand_action
+
+from utils.search_utils import item_records
+from utils.table_utils import document_id
+
+
+@dataclass
+class ClientSettings:
+    """Connection settings of the shared clients. Unset url and api_key are read from the environment (or .env)
+    when a client is first made, ELASTICSEARCH_URL and ELASTICSEARCH_API_KEY, as are basic auth credentials.
+
+    `connections_per_node` bounds the pooled keep-alive connections to each node, which should be at least the
+    number of threads sending requests at once (e.g. BulkIndexer.max_inflight); keep_alive=False closes each
+    connection after its request instead.
+    """
+    url: Optional[str] = None
+    api_key: Optional[str] = None
+    connections_per_node: int = 10
+    request_timeout: float = 30.0
+    keep_alive: bool = True
+    max_retries: int = 3
+    retry_on_timeout: bool = True
+    http_compress: bool = False
+
+    def client_kwargs(self) -> dict:
+        # dotenv is only loaded for the first client, not when the module is imported
+        from dotenv import load_dotenv
+        load_dotenv()
+        url = self.url or os.getenv('ELASTICSEARCH_URL')
+        if not url:
+            raise RuntimeError("No Elasticsearch URL: set ELASTICSEARCH_URL or call configure_client(url=...)")
+        kwargs = {
+            'connections_per_node': self.connections_per_node,
+            'request_timeout': self.request_timeout,
+            'max_retries': self.max_retries,
+            'retry_on_timeout': self.retry_on_timeout,
+            'http_compress': self.http_compress,
+            'headers': {'connection': 'keep-alive' if self.keep_alive else 'close'},
+        }
+        api_key = self.api_key or os.getenv('ELASTICSEARCH_API_KEY')
+        if api_key:
+            kwargs['api_key'] = api_key
+        elif os.getenv('ELASTICSEARCH_USERNAME'):
+            kwargs['basic_auth'] = (os.getenv('ELASTICSEARCH_USERNAME'), os.getenv('ELASTICSEARCH_PASSWORD'))
+        return {'hosts': url, **kwargs}
+
+
+_settings = ClientSettings()
+_lock = threading.Lock()
+_client: Optional[Elasticsearch] = None
+_client_pid: Optional[int] = None
+# one async client per event loop, since its connections belong to the loop that opened them
+_async_clients: "weakref.WeakKeyDictionary" = weakref.WeakKeyDictionary()
+
+
+def _reset_after_fork():
+    # the parent's connections must not be shared with a child, and the lock may have been held by another thread
+    global _lock, _client, _client_pid
+    _lock = threading.Lock()
+    _client = None
+    _client_pid = None
+    _async_clients.clear()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def configure_client(**settings) -> ClientSettings:
+    """Change the settings of the shared clients, e.g. configure_client(connections_per_node=32, request_timeout=60).
+
+    Clients made with the old settings are closed; the next get_client() makes a new one.
+    """
+    global _settings
+    unknown = set(settings) - {f.name for f in fields(ClientSettings)}
+    if unknown:
+        raise TypeError(f"Unknown client settings: {', '.join(sorted(unknown))}")
+    close_client()
+    _settings = ClientSettings(**{**vars(_settings), **settings})
+    return _settings
+
 
-## connect to local Elastic Search instance
-from elasticsearch import Elasticsearch
+def get_client() -> Elasticsearch:
+    """The process-wide Elasticsearch client, created on first use and again in a forked child. Thread safe."""
+    global _client, _client_pid
+    client = _client
+    if client is not None and _client_pid == os.getpid():
+        return client
+    with _lock:
+        if _client is None or _client_pid != os.getpid():
+            _client = Elasticsearch(**_settings.client_kwargs())
+            _client_pid = os.getpid()
+        return _client
 
-es = Elasticsearch(
-    os.getenv('ELASTICSEARCH_URL'), 
-    api_key=os.getenv('ELASTICSEARCH_API_KEY'),
-    # basic_auth=(
-    #     os.getenv('ELASTICSEARCH_USERNAME'), 
-    #     os.getenv('ELASTICSEARCH_PASSWORD')
-    # ),  # both work
-)
 
-def node_report(client=es):
+def get_async_client() -> AsyncElasticsearch:
+    """The AsyncElasticsearch client of the running event loop, created on first use. Needs aiohttp installed."""
+    import asyncio
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = _async_clients[loop] = AsyncElasticsearch(**_settings.client_kwargs())
+    return client
+
+
+def close_client():
+    global _client, _client_pid
+    with _lock:
+        if _client is not None and _client_pid == os.getpid():
+            _client.close()
+        _client = None
+        _client_pid = None
+
+
+async def close_async_client():
+    import asyncio
+    client = _async_clients.pop(asyncio.get_running_loop(), None)
+    if client is not None:
+        await client.close()
+
+
+def __getattr__(name: str):
+    # `es` used to be made at import; it now resolves to the shared client on first access
+    if name == 'es':
+        return get_client()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def node_report(client: Optional[Elasticsearch] = None):
+    client = client or get_client()
     nodes = client.nodes.info()
     report = f'Total nodes: {nodes["_nodes"]["total"]}, successful: {nodes["_nodes"]["successful"]}, failed: {nodes["_nodes"]["failed"]}'
     for node_id, node in nodes['nodes'].items():
@@ -25,5 +148,294 @@ def node_report(client=es):
     return report
 
 
+# mapping of the index records made by item_records
+ITEM_MAPPINGS = {
+    'properties': {
+        'document_id': {'type': 'keyword'},
+        'source': {'type': 'keyword'},
+        'self_ref': {'type': 'keyword'},
+        'label': {'type': 'keyword'},
+        'position': {'type': 'integer'},
+        'text': {'type': 'text'},
+        'caption': {'type': 'text'},
+        'page_no': {'type': 'integer'},
+        'bbox': {'properties': {'l': {'type': 'float'}, 't': {'type': 'float'}, 'r': {'type': 'float'}, 'b': {'type': 'float'}}},
+        'coord_origin': {'type': 'keyword'},
+    }
+}
+
+
+def create_index(index: str, client: Optional[Elasticsearch] = None) -> bool:
+    # creates the index with ITEM_MAPPINGS unless it already exists
+    client = client or get_client()
+    if client.indices.exists(index=index):
+        return False
+    client.indices.create(index=index, mappings=ITEM_MAPPINGS)
+    return True
+
+
+def item_id(doc_id: str, self_ref: str) -> str:
+    # deterministic _id of an item record, so re-indexing a document overwrites its records instead of duplicating them
+    return f"{doc_id}:{self_ref}"
+
+
+def record_hash(record: dict) -> str:
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+# an action as sent: its _id and its NDJSON header and source lines, the latter None for a delete
+_BulkLines = Tuple[Optional[str], bytes, Optional[bytes]]
+
+
+def _bulk_batches(actions: Iterable[dict], index: str, max_docs: int, max_bytes: int) -> Iterator[List[_BulkLines]]:
+    # serializes the actions once and cuts them into batches of at most max_docs actions and max_bytes of NDJSON
+    batch = []
+    batch_bytes = 0
+    for action in actions:
+        header, source = expand_action({'_index': index, **action})
+        lines = (action.get('_id'), json.dumps(header).encode('utf-8'),
+                 json.dumps(source).encode('utf-8') if source is not None else None)
+        size = sum(len(line) + 1 for line in lines[1:] if line is not None)
+        if batch and (len(batch) == max_docs or batch_bytes + size > max_bytes):
+            yield batch
+            batch = []
+            batch_bytes = 0
+        batch.append(lines)
+        batch_bytes += size
+    if batch:
+        yield batch
+
+
+class BulkIndexer:
+    """Sends index actions through the bulk API with `max_inflight` requests in flight at once.
+
+    Actions are `{'_source': ..., '_id': ..., '_op_type': ...}` dicts as taken by elasticsearch.helpers, or bare
+    records to index. They are batched by count and bytes; a whole batch or any of its items rejected with 429 is
+    resent after an exponential backoff, up to `max_retries` times, and any other failure is counted and listed.
+    The _ids of failed actions are kept in `failed_ids`. Deleting a record that is already gone counts as a success.
+    """
+
+    def __init__(self, index: str, client: Optional[Elasticsearch] = None, max_docs: int = 500, max_bytes: int = 5 * 2**20,
+                 max_inflight: int = 4, max_retries: int = 5, initial_backoff: float = 0.5, max_backoff: float = 30.0):
+        self.index = index
+        # backoff on 429 is ours, so the transport should not retry them straight away on its own
+        self.client = (client or get_client()).options(retry_on_status=[502, 503, 504])
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self.max_inflight = max_inflight
+        self.max_retries = max_retries
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self.stats = {'docs': 0, 'succeeded': 0, 'failed': 0, 'retries': 0, 'batches': 0, 'bytes': 0, 'errors': []}
+        self.failed_ids = set()
+
+    def _count(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.stats[name] += value
+
+    def _fail(self, batch: List[_BulkLines], error: str):
+        with self._lock:
+            self.stats['failed'] += len(batch)
+            self.failed_ids.update(lines[0] for lines in batch if lines[0] is not None)
+            if len(self.stats['errors']) < 100:
+                self.stats['errors'].append(error)
+
+    def _send(self, batch: List[_BulkLines]):
+        attempt = 0
+        while batch:
+            operations = [line for lines in batch for line in lines[1:] if line is not None]
+            self._count(batches=1, bytes=sum(len(line) + 1 for line in operations))
+            try:
+                response = self.client.bulk(operations=operations)
+                retry = []
+                for lines, result in zip(batch, response['items']):
+                    (op_type, result), = result.items()
+                    if result.get('status', 500) < 300 or (op_type == 'delete' and result['status'] == 404):
+                        self._count(succeeded=1)
+                    elif result['status'] == 429 and attempt < self.max_retries:
+                        retry.append(lines)
+                    else:
+                        self._fail([lines], f"{op_type} {result.get('_id')}: {result.get('status')} {result.get('error')}")
+            except ApiError as e:
+                if e.meta.status != 429 or attempt >= self.max_retries:
+                    self._fail(batch, f"bulk request of {len(batch)} actions: {e.meta.status} {e.message}")
+                    return
+                retry = batch
+            if retry:
+                self._count(retries=len(retry))
+                time.sleep(min(self.initial_backoff * 2 ** attempt, self.max_backoff))
+                attempt += 1
+            batch = retry
+
+    def index_actions(self, actions: Iterable[dict], verbose: bool = False) -> dict:
+        """Send every action and return the stats of this call, including docs_per_sec."""
+        start_time = time.time()
+        before = {name: value for name, value in self.stats.items() if name != 'errors'}
+        # like ImageWriter, at most 2 * max_inflight batches are serialized ahead of the requests
+        slots = threading.BoundedSemaphore(2 * self.max_inflight)
+        futures: List[Future] = []
+        with ThreadPoolExecutor(max_workers=self.max_inflight, thread_name_prefix='bulk-index') as pool:
+            for batch in _bulk_batches(actions, self.index, self.max_docs, self.max_bytes):
+                self._count(docs=len(batch))
+                slots.acquire()
+                future = pool.submit(self._send, batch)
+                future.add_done_callback(lambda _: slots.release())
+                futures.append(future)
+            for future in futures:
+                future.result()
+        report = {name: self.stats[name] - value for name, value in before.items()}
+        report['seconds'] = time.time() - start_time
+        report['docs_per_sec'] = report['succeeded'] / report['seconds'] if report['seconds'] else 0.0
+        report['errors'] = list(self.stats['errors'])
+        if verbose:
+            print(f"Indexed {report['succeeded']}/{report['docs']} records into {self.index} in {report['seconds']:.2f} seconds "
+                  f"({report['docs_per_sec']:.0f} docs/sec, {report['batches']} requests, {report['retries']} retried, {report['failed']} failed)")
+        return report
+
+
+def index_documents(documents: Iterable[DoclingDocument], index: str, client: Optional[Elasticsearch] = None, verbose: bool = False,
+                    **indexer_kwargs) -> dict:
+    # all documents go through one indexer, so batches fill across document boundaries
+    indexer = BulkIndexer(index, client, **indexer_kwargs)
+    records = ({'_id': item_id(record['document_id'], record['self_ref']), '_source': record}
+               for document in documents for record in item_records(document))
+    return indexer.index_actions(records, verbose=verbose)
+
+
+class IndexState:
+    """Content hash of every item record last written to an index, one JSON file per document.
+
+    Written only for the records the index acknowledged, so a failed action is sent again on the next sync.
+    Must be cleared whenever the index itself is dropped or recreated.
+    """
+
+    def __init__(self, state_dir: Union[str, Path]):
+        self.state_dir = Path(state_dir)
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, doc_id: str) -> Path:
+        return self.state_dir / f"{doc_id}.json"
+
+    def get(self, doc_id: str) -> Dict[str, str]:
+        try:
+            with open(self._path(doc_id), 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def put(self, doc_id: str, hashes: Dict[str, str]):
+        if not hashes:
+            self.discard(doc_id)
+            return
+        tmp_path = self._path(doc_id).with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(hashes, f)
+        os.replace(tmp_path, self._path(doc_id))
+
+    def discard(self, doc_id: str):
+        try:
+            os.remove(self._path(doc_id))
+        except FileNotFoundError:
+            pass
+
+    def document_ids(self) -> List[str]:
+        return sorted(path.stem for path in self.state_dir.glob('*.json'))
+
+    def clear(self):
+        for doc_id in self.document_ids():
+            self.discard(doc_id)
+
+
+def sync_documents(documents: Iterable[DoclingDocument], index: str, state: IndexState, client: Optional[Elasticsearch] = None,
+                   remove_missing: bool = False, verbose: bool = False, **indexer_kwargs) -> dict:
+    """Bring the index up to date with `documents`, sending only what changed since the last sync.
+
+    Records whose hash differs from `state` are (re)indexed, records that disappeared from their document are
+    deleted, and with remove_missing the records of every document in `state` but not in `documents` are too.
+    Copies of the same PDF share their record ids, so only the first one is indexed and the rest are counted as
+    duplicates. An unchanged corpus sends no requests at all.
+    """
+    new_hashes = {}
+    changes = {'unchanged': 0, 'inserts': 0, 'updates': 0, 'deletes': 0, 'documents_changed': 0, 'duplicates': 0}
+
+    def actions():
+        synced = set()
+        for document in documents:
+            doc_id = document_id(document)
+            if doc_id in synced:
+                # otherwise its records would overwrite the first copy's, with another source, on every sync
+                changes['duplicates'] += 1
+                continue
+            synced.add(doc_id)
+            old = state.get(doc_id)
+            new = {}
+            for record in item_records(document, doc_id):
+                record_id = item_id(doc_id, record['self_ref'])
+                new[record_id] = record_hash(record)
+                if old.get(record_id) == new[record_id]:
+                    changes['unchanged'] += 1
+                    continue
+                changes['updates' if record_id in old else 'inserts'] += 1
+                yield {'_id': record_id, '_source': record}
+            for record_id in old.keys() - new.keys():
+                changes['deletes'] += 1
+                yield {'_op_type': 'delete', '_id': record_id}
+            if new != old:
+                new_hashes[doc_id] = (old, new)
+        if remove_missing:
+            for doc_id in sorted(set(state.document_ids()) - synced):
+                old = state.get(doc_id)
+                changes['deletes'] += len(old)
+                for record_id in old:
+                    yield {'_op_type': 'delete', '_id': record_id}
+                new_hashes[doc_id] = (old, {})
+
+    indexer = BulkIndexer(index, client, **indexer_kwargs)
+    report = indexer.index_actions(actions())
+
+    # a failed action leaves the record as the index last acknowledged it: unknown for an insert, the old hash for
+    # an update or a delete, so the next sync sends it again
+    for doc_id, (old, new) in new_hashes.items():
+        hashes = {record_id: new_hash for record_id, new_hash in new.items() if record_id not in indexer.failed_ids}
+        hashes.update({record_id: old[record_id] for record_id in indexer.failed_ids & old.keys()})
+        state.put(doc_id, hashes)
+    changes['documents_changed'] = len(new_hashes)
+    report.update(changes)
+    if verbose:
+        print(f"Synced {index}: {changes['inserts']} inserts, {changes['updates']} updates, {changes['deletes']} deletes, "
+              f"{changes['unchanged']} unchanged records, {changes['duplicates']} duplicate documents in {report['seconds']:.2f} seconds "
+              f"({report['batches']} requests, {report['failed']} failed)")
+    return report
+
+
+def index_converted(converted_path: Union[str, Path] = 'data/converted', index: str = 'thoth-items',
+                    client: Optional[Elasticsearch] = None, verbose: bool = False, **indexer_kwargs) -> dict:
+    # indexes every converted document under converted_path, loading one document at a time
+    from utils.docling_utils import _document_exists, _load_document
+    create_index(index, client)
+    output_dirs = sorted(p for p in Path(converted_path).iterdir() if _document_exists(p))
+    documents = (_load_document(output_dir) for output_dir in output_dirs)
+    return index_documents(documents, index, client, verbose=verbose, **indexer_kwargs)
+
+
+def sync_converted(converted_path: Union[str, Path] = 'data/converted', index: str = 'thoth-items',
+                   state_dir: Union[str, Path] = 'data/index_state', client: Optional[Elasticsearch] = None,
+                   verbose: bool = False, **indexer_kwargs) -> dict:
+    # the change-aware index_converted: documents removed from converted_path are removed from the index too
+    from utils.docling_utils import _document_exists, _load_document
+    state = IndexState(Path(state_dir) / index)
+    if create_index(index, client):
+        # a new index holds none of the records the state remembers
+        state.clear()
+    output_dirs = sorted(p for p in Path(converted_path).iterdir() if _document_exists(p))
+    documents = (_load_document(output_dir) for output_dir in output_dirs)
+    return sync_documents(documents, index, state, client, remove_missing=True, verbose=verbose, **indexer_kwargs)
+
+
 if __name__ == "__main__":
-    print(node_report())
\ No newline at end of file
+    import sys
+    print(node_report())
+    if len(sys.argv) > 1:
+        sync_converted(*sys.argv[1:3], verbose=True)
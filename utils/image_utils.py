@@ -0,0 +1,285 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from docling_core.types.doc.document import DocItemLabel, DoclingDocument, DocItem, ImageRef
+from docling_core.types.doc import Size
+from io import BytesIO
+from pathlib import Path
+from PIL import Image
+from pydantic import AnyUrl
+from typing import Optional, Dict, List, Union
+
+
+@dataclass
+class ImageResolutionPolicy:
+    """How finely each kind of image is kept, instead of one IMAGE_RESOLUTION_SCALE for everything.
+
+    Scales are relative to 72 DPI, like PdfPipelineOptions.images_scale. Tables are kept at `table_scale` for
+    the downstream table/vision step, pictures are shrunk to at most `picture_max_pixels`, and page images are
+    only stored when `page_scale` is set (`pdf_utils.render_page_image` renders them on demand otherwise).
+    `label_scales` and `label_max_pixels` override the defaults per DocItemLabel value, e.g. {'formula': 3.0}.
+    """
+    table_scale: float = 2.0
+    picture_scale: float = 2.0
+    picture_max_pixels: Optional[int] = 1_000_000
+    page_scale: Optional[float] = None
+    label_scales: Dict[str, float] = field(default_factory=dict)
+    label_max_pixels: Dict[str, int] = field(default_factory=dict)
+
+    def scale_for(self, label: str) -> float:
+        if label in self.label_scales:
+            return self.label_scales[label]
+        return self.table_scale if label == DocItemLabel.TABLE.value else self.picture_scale
+
+    def max_pixels_for(self, label: str) -> Optional[int]:
+        if label in self.label_max_pixels:
+            return self.label_max_pixels[label]
+        return None if label == DocItemLabel.TABLE.value else self.picture_max_pixels
+
+    @property
+    def render_scale(self) -> float:
+        # the pipeline renders pages once, at the finest scale any image needs, and everything else is reduced from it
+        return max([self.table_scale, self.picture_scale, self.page_scale or 0.0, *self.label_scales.values()])
+
+    def apply_to_pipeline_options(self, pipeline_options):
+        pipeline_options = pipeline_options.model_copy(deep=True)
+        pipeline_options.images_scale = self.render_scale
+        pipeline_options.generate_page_images = self.page_scale is not None
+        pipeline_options.generate_picture_images = True
+        pipeline_options.generate_table_images = True
+        return pipeline_options
+
+    def fingerprint(self) -> str:
+        return hashlib.sha256(json.dumps(asdict(self), sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def _encoded_size(image_ref: ImageRef) -> int:
+    if isinstance(image_ref.uri, AnyUrl) and image_ref.uri.scheme == 'data':
+        return len(str(image_ref.uri).split(',', 1)[1]) * 3 // 4
+    try:
+        return Path(str(image_ref.uri.path if isinstance(image_ref.uri, AnyUrl) else image_ref.uri)).stat().st_size
+    except OSError:
+        return 0
+
+
+def _is_file_backed(image_ref: ImageRef) -> bool:
+    return not (isinstance(image_ref.uri, AnyUrl) and image_ref.uri.scheme == 'data')
+
+
+def _image_path(image_ref: ImageRef) -> Optional[Path]:
+    if not _is_file_backed(image_ref):
+        return None
+    return Path(str(image_ref.uri.path if isinstance(image_ref.uri, AnyUrl) else image_ref.uri)).resolve()
+
+
+def _image_ref(image: Image.Image, dpi: int, images_dir: Optional[Path]) -> ImageRef:
+    # images that were spilled to disk stay on disk, as a new content-addressed file next to the original; the path
+    # is only used in memory, saving the document stores it as a sidecar reference relative to the output directory
+    if images_dir is None:
+        return ImageRef.from_pil(image, dpi=dpi)
+    buffer = BytesIO()
+    image.save(buffer, format='PNG')
+    image_path = images_dir / f"{hashlib.sha256(buffer.getvalue()).hexdigest()}.png"
+    if not image_path.exists():
+        images_dir.mkdir(parents=True, exist_ok=True)
+        image_path.write_bytes(buffer.getvalue())
+    return ImageRef(mimetype='image/png', dpi=dpi, size=Size(width=image.width, height=image.height), uri=image_path.resolve())
+
+
+def _rescale(image_ref: ImageRef, scale: float, max_pixels: Optional[int]) -> Optional[Image.Image]:
+    # returns the reduced image, or None if the stored one already fits; images are never upscaled
+    source_scale = image_ref.dpi / 72
+    factor = min(scale / source_scale, 1.0)
+    width, height = image_ref.size.width * factor, image_ref.size.height * factor
+    if max_pixels and width * height > max_pixels:
+        factor *= (max_pixels / (width * height)) ** 0.5
+    if factor >= 0.999:
+        return None
+    image = image_ref.pil_image
+    return image.resize((max(1, round(image.width * factor)), max(1, round(image.height * factor))), Image.LANCZOS)
+
+
+def apply_resolution_policy(document: DoclingDocument, policy: ImageResolutionPolicy,
+                            images_dir: Optional[Union[str, Path]] = None) -> dict:
+    """Reduce the page and element images of a converted document to what `policy` asks for, in place.
+
+    Returns a report of the time spent re-rasterizing and the encoded image bytes before and after, per label.
+    File-backed images (from the low-memory mode) are rewritten as new files in `images_dir`, and the files they
+    replace are deleted once no image of the document refers to them any more.
+    """
+    start_time = time.time()
+    images_dir = Path(images_dir) if images_dir is not None else None
+    report = {'seconds': 0.0, 'bytes_before': 0, 'bytes_after': 0, 'labels': {}}
+    superseded = set()
+
+    def account(label: str, before: int, after: int):
+        stats = report['labels'].setdefault(label, {'count': 0, 'bytes_before': 0, 'bytes_after': 0})
+        stats['count'] += 1
+        stats['bytes_before'] += before
+        stats['bytes_after'] += after
+        report['bytes_before'] += before
+        report['bytes_after'] += after
+
+    for page in document.pages.values():
+        if page.image is None:
+            continue
+        before = _encoded_size(page.image)
+        source_path = _image_path(page.image)
+        if policy.page_scale is None:
+            page.image = None
+        else:
+            image = _rescale(page.image, policy.page_scale, None)
+            if image is not None:
+                target_dir = images_dir if _is_file_backed(page.image) else None
+                page.image = _image_ref(image, int(72 * policy.page_scale), target_dir)
+        if source_path is not None and (page.image is None or _image_path(page.image) != source_path):
+            superseded.add(source_path)
+        account('page', before, _encoded_size(page.image) if page.image is not None else 0)
+
+    for item, _level in document.iterate_items(traverse_pictures=True):
+        if not isinstance(item, DocItem) or getattr(item, 'image', None) is None:
+            continue
+        label = item.label.value
+        before = _encoded_size(item.image)
+        image = _rescale(item.image, policy.scale_for(label), policy.max_pixels_for(label))
+        if image is not None:
+            source_path = _image_path(item.image)
+            target_dir = images_dir if source_path is not None else None
+            dpi = round(item.image.dpi * image.width / item.image.size.width)
+            item.image = _image_ref(image, dpi, target_dir)
+            if source_path is not None and _image_path(item.image) != source_path:
+                superseded.add(source_path)
+        account(label, before, _encoded_size(item.image))
+
+    # the full-resolution files are content-addressed, so one may still back another image of the document
+    if superseded and images_dir is not None:
+        referenced = {_image_path(page.image) for page in document.pages.values() if page.image is not None}
+        referenced.update(_image_path(item.image) for item, _level in document.iterate_items(traverse_pictures=True)
+                          if isinstance(item, DocItem) and getattr(item, 'image', None) is not None)
+        for image_path in superseded - referenced:
+            if image_path.parent == images_dir.resolve():
+                image_path.unlink(missing_ok=True)
+
+    report['bytes_saved'] = report['bytes_before'] - report['bytes_after']
+    report['seconds'] = time.time() - start_time
+    return report
+
+
+@dataclass
+class ImageEncoding:
+    """File format and compression for exported images.
+
+    `compress_level` is the zlib level of PNG (0-9), `quality` the JPEG/WebP quality, and `lossless` makes WebP
+    lossless. JPEG suits photos, PNG and lossless WebP suit tables, charts and line art.
+    """
+    format: str = 'PNG'
+    compress_level: int = 6
+    quality: int = 90
+    lossless: bool = False
+
+    @classmethod
+    def parse(cls, spec: Union[str, "ImageEncoding", None]) -> "ImageEncoding":
+        # accepts 'png', 'png:1', 'jpeg:85', 'webp:lossless' or 'webp:80'
+        if isinstance(spec, ImageEncoding):
+            return spec
+        if not spec:
+            return cls()
+        name, _, option = spec.partition(':')
+        encoding = cls(format={'jpg': 'JPEG'}.get(name.lower(), name.upper()))
+        if encoding.format not in ('PNG', 'JPEG', 'WEBP'):
+            raise ValueError(f"Unsupported image format: {name}")
+        if option == 'lossless':
+            encoding.lossless = True
+        elif option:
+            if encoding.format == 'PNG':
+                encoding.compress_level = int(option)
+            else:
+                encoding.quality = int(option)
+        return encoding
+
+    @property
+    def extension(self) -> str:
+        return {'PNG': 'png', 'JPEG': 'jpg', 'WEBP': 'webp'}[self.format]
+
+    def save(self, image: Image.Image, path: Union[str, Path]):
+        if self.format == 'PNG':
+            image.save(path, 'PNG', compress_level=self.compress_level)
+        elif self.format == 'JPEG':
+            # JPEG has no alpha channel or palette
+            image.convert('RGB').save(path, 'JPEG', quality=self.quality, optimize=True)
+        else:
+            image.save(path, 'WEBP', quality=self.quality, lossless=self.lossless, method=4)
+
+
+class ImageWriter:
+    """Encodes and writes images on a bounded pool of threads while the caller carries on.
+
+    At most `max_pending` images are queued; `submit` blocks beyond that so a figure-heavy document cannot hold
+    every decoded image in memory at once. `flush` waits for every write and returns the manifest, one entry per
+    image with its file, size and encode time, or the error it failed with. Existing files are not rewritten.
+    """
+
+    def __init__(self, max_workers: int = 4, max_pending: Optional[int] = None):
+        self.max_workers = max_workers
+        self._pool = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='image-writer')
+        self._slots = threading.BoundedSemaphore(max_pending or 4 * max_workers)
+        self._futures: List[Future] = []
+
+    def _write(self, name: str, image: Image.Image, path: Path, encoding: ImageEncoding) -> dict:
+        entry = {'name': name, 'path': str(path), 'format': encoding.format}
+        start_time = time.time()
+        try:
+            # inside the try: a missing or unreadable image is an error of its own entry, not of the whole flush
+            entry['width'], entry['height'] = image.width, image.height
+            if path.exists():
+                entry['skipped'] = True
+            else:
+                # written under a temporary name so an interrupted export never leaves a truncated image behind
+                tmp_path = path.with_name(f".{path.name}.{threading.get_ident()}.tmp")
+                encoding.save(image, tmp_path)
+                os.replace(tmp_path, path)
+            entry['bytes'] = path.stat().st_size
+        except Exception as e:
+            entry['error'] = f"{type(e).__name__}: {e}"
+        entry['seconds'] = time.time() - start_time
+        return entry
+
+    def submit(self, name: str, image: Image.Image, path: Union[str, Path], encoding: Optional[ImageEncoding] = None) -> Future:
+        self._slots.acquire()
+        future = self._pool.submit(self._write, name, image, Path(path), encoding or ImageEncoding())
+        future.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(future)
+        return future
+
+    def flush(self) -> List[dict]:
+        manifest = [future.result() for future in self._futures]
+        self._futures = []
+        return manifest
+
+    def close(self):
+        self._pool.shutdown(wait=True)
+
+    def __enter__(self) -> "ImageWriter":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_image_manifest(manifest: List[dict], path: Union[str, Path]) -> dict:
+    # writes the manifest with a summary of what was written and returns the summary
+    summary = {
+        'images': len(manifest),
+        'written': sum(1 for entry in manifest if 'error' not in entry and not entry.get('skipped')),
+        'skipped': sum(1 for entry in manifest if entry.get('skipped')),
+        'failed': sum(1 for entry in manifest if 'error' in entry),
+        'bytes': sum(entry.get('bytes', 0) for entry in manifest),
+        'encode_seconds': sum(entry['seconds'] for entry in manifest),
+    }
+    with open(path, 'w') as f:
+        json.dump({'summary': summary, 'images': manifest}, f, indent=4)
+    return summary
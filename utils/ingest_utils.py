@@ -0,0 +1,161 @@
+import argparse
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from pathlib import Path
+from tqdm import tqdm
+from typing import Union, Optional, Tuple, List, Iterable, Callable
+
+from docling.datamodel.pipeline_options import PdfPipelineOptions
+from utils.cache_utils import ParseCache
+from utils.docling_utils import docling_parse, default_pipeline_options, init_conversion_worker
+
+# a document whose worker dies (segfault, OOM kill) again after the shared retry is run alone this many times
+# before it is reported as failed
+MAX_CRASH_ATTEMPTS = 2
+
+
+def _ingest_one(document_path: str, output_dir: str, pipeline_options: PdfPipelineOptions, force_parse: bool,
+                cache: Optional[ParseCache] = None) -> dict:
+    start_time = time.time()
+    hits_before = cache.hits if cache is not None else 0
+    try:
+        document, _ = docling_parse(document_path, output_dir, force_parse=force_parse, pipeline_options=pipeline_options, cache=cache)
+        return {
+            'path': document_path,
+            'output_dir': output_dir,
+            'ok': True,
+            'num_pages': len(document.pages),
+            'cache_hit': cache is not None and cache.hits > hits_before,
+            'seconds': time.time() - start_time,
+        }
+    except Exception as e:
+        return {
+            'path': document_path,
+            'output_dir': output_dir,
+            'ok': False,
+            'error': f"{type(e).__name__}: {e}",
+            'traceback': traceback.format_exc(),
+            'seconds': time.time() - start_time,
+        }
+
+
+def _retry_crashed(crashed: List[Tuple[str, str]], run_pool: Callable[[List[Tuple[str, str]], int], List[Tuple[str, str]]],
+                   max_workers: int) -> List[Tuple[Tuple[str, str], int]]:
+    # a dead worker takes down every in-flight and queued future with it, so the crashed set holds the poison job
+    # together with jobs that were merely unlucky. The set is bisected, each half getting a fresh pool, and only the
+    # halves that crash again are split further, so a single poison PDF costs O(log n) pool runs rather than
+    # running everything after it serially. A job that crashes alone counts against its attempts.
+    # Returns the jobs that used up MAX_CRASH_ATTEMPTS with their attempt counts.
+    attempts = {}
+    given_up = []
+    groups = [crashed] if crashed else []
+    while groups:
+        group = groups.pop(0)
+        if len(group) > 1:
+            middle = len(group) // 2
+            for half in (group[:middle], group[middle:]):
+                if len(half) == 1:
+                    groups.append(half)
+                    continue
+                half_crashed = run_pool(half, min(max_workers, len(half)))
+                if half_crashed:
+                    groups.append(half_crashed)
+            continue
+        job = group[0]
+        attempts[job] = attempts.get(job, 0) + 1
+        if not run_pool([job], 1):
+            continue
+        if attempts[job] >= MAX_CRASH_ATTEMPTS:
+            given_up.append((job, attempts[job]))
+        else:
+            groups.append([job])
+    return given_up
+
+
+def list_documents(ingest_path: Union[str, Path], suffixes: Iterable[str] = ('.pdf',)) -> List[Path]:
+    suffixes = {s.lower() for s in suffixes}
+    return [p for p in sorted(Path(ingest_path).iterdir()) if p.is_file() and p.suffix.lower() in suffixes]
+
+
+def ingest_batch(document_paths: Iterable[Union[str, Path]], converted_path: Union[str, Path] = 'data/converted',
+                 max_workers: Optional[int] = None, pipeline_options: Optional[PdfPipelineOptions] = None,
+                 force_parse: bool = False, cache: Optional[ParseCache] = None, verbose: bool = False) -> Tuple[List[dict], List[dict]]:
+    """Convert many documents with a pool of worker processes, returning (successes, failures).
+
+    Documents are submitted largest first so long PDFs do not end up as the stragglers of the batch.
+    """
+    start_time = time.time()
+    max_workers = max_workers or os.cpu_count() or 1
+    threads_per_worker = max(1, (os.cpu_count() or 1) // max_workers)
+    pipeline_options = pipeline_options or default_pipeline_options()
+    converted_path = Path(converted_path)
+
+    jobs = []
+    for document_path in document_paths:
+        document_path = Path(document_path)
+        jobs.append((str(document_path), str(converted_path / document_path.stem)))
+    jobs.sort(key=lambda job: os.path.getsize(job[0]), reverse=True)
+
+    successes, failures = [], []
+    progress = tqdm(total=len(jobs), disable=not verbose)
+
+    def run_pool(pool_jobs: List[Tuple[str, str]], pool_workers: int) -> List[Tuple[str, str]]:
+        crashed = []
+        # spawn rather than fork: the parent may already hold torch/OpenMP state that does not survive a fork.
+        # Every worker holds its own warmed converter for the lifetime of the pool.
+        with ProcessPoolExecutor(max_workers=pool_workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_conversion_worker, initargs=(pipeline_options, threads_per_worker)) as pool:
+            futures = {
+                pool.submit(_ingest_one, path, output_dir, pipeline_options, force_parse, cache): (path, output_dir)
+                for path, output_dir in pool_jobs
+            }
+            for future in as_completed(futures):
+                try:
+                    result = future.result()
+                except BrokenProcessPool:
+                    crashed.append(futures[future])
+                    continue
+                (successes if result['ok'] else failures).append(result)
+                progress.update(1)
+        return crashed
+
+    for (path, output_dir), attempts in _retry_crashed(run_pool(jobs, max_workers), run_pool, max_workers):
+        failures.append({'path': path, 'output_dir': output_dir, 'ok': False, 'attempts': attempts,
+                         'error': 'worker process died during conversion', 'traceback': '', 'seconds': 0.0})
+        progress.update(1)
+    progress.close()
+
+    if verbose:
+        end_time = time.time() - start_time
+        print(f"Ingested {len(successes)} documents ({len(failures)} failed) in {end_time:.2f} seconds.")
+        if cache is not None:
+            cache_hits = sum(result['cache_hit'] for result in successes)
+            print(f"Parse cache: {cache_hits} hits, {len(successes) - cache_hits} conversions, {cache.stats()['bytes'] / 2**20:.1f} MiB on disk.")
+        for failure in failures:
+            print(f"FAILED {failure['path']}: {failure['error']}")
+    return successes, failures
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Convert every PDF in a directory with a pool of docling workers.")
+    parser.add_argument('ingest_path', nargs='?', default='data/ingest')
+    parser.add_argument('converted_path', nargs='?', default='data/converted')
+    parser.add_argument('-j', '--workers', type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument('--force', action='store_true', help="re-convert documents that were already converted")
+    parser.add_argument('--cache-dir', default=None, help="content-addressed parse cache shared across runs")
+    parser.add_argument('--cache-max-gb', type=float, default=20.0)
+    args = parser.parse_args(argv)
+
+    cache = ParseCache(args.cache_dir, max_bytes=int(args.cache_max_gb * 2**30)) if args.cache_dir else None
+    documents = list_documents(args.ingest_path)
+    _, failures = ingest_batch(documents, args.converted_path, max_workers=args.workers, force_parse=args.force,
+                               cache=cache, verbose=True)
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
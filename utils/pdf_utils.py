@@ -1,15 +1,253 @@
-from pypdf import PdfReader, PdfWriter
+import hashlib
+import math
+from collections import Counter
+from dataclasses import dataclass
+from io import BytesIO
+from pypdf import PageObject, PdfReader, PdfWriter
+from pypdf.generic import ArrayObject, ContentStream, DictionaryObject, StreamObject
+from typing import Dict, List, Optional, Tuple
 
-def write_pdf_pages(pdf_path, output_path, page_range=10):
+
+def _pages_writer(pdf_in: PdfReader, page_range, rotations: Optional[Dict[int, int]] = None) -> PdfWriter:
     if isinstance(page_range, int):
         page_range = range(page_range)
     page_range = list(page_range)
     assert isinstance(page_range, list), "page_range must be a list of integers."
 
-    pdf_in = PdfReader(pdf_path)
     pdf_out = PdfWriter()
     for i in page_range:
-        pdf_out.add_page(pdf_in.pages[i])
-    
+        page = pdf_out.add_page(pdf_in.pages[i])
+        if rotations and i in rotations:
+            page.rotation = rotations[i]
+    return pdf_out
+
+
+def write_pdf_pages(pdf_path, output_path, page_range=10):
+    pdf_out = _pages_writer(PdfReader(pdf_path), page_range)
     with open(output_path, "wb") as f:
         pdf_out.write(f)
+
+
+def pdf_pages_to_bytes(pdf_in, page_range=10, rotations: Optional[Dict[int, int]] = None) -> bytes:
+    # in-memory equivalent of write_pdf_pages, accepts a path or an already opened PdfReader.
+    # rotations maps page indices to the /Rotate value they are written with
+    if not isinstance(pdf_in, PdfReader):
+        pdf_in = PdfReader(pdf_in)
+    buffer = BytesIO()
+    _pages_writer(pdf_in, page_range, rotations).write(buffer)
+    return buffer.getvalue()
+
+
+def count_pdf_pages(pdf_path) -> int:
+    return len(PdfReader(pdf_path).pages)
+
+
+def split_pdf_pages(pdf_path, shard_size: int) -> List[Tuple[int, bytes]]:
+    # returns (index of the shard's first page, shard PDF bytes) for consecutive page ranges of shard_size pages
+    pdf_in = PdfReader(pdf_path)
+    num_pages = len(pdf_in.pages)
+    return [
+        (start, pdf_pages_to_bytes(pdf_in, range(start, min(start + shard_size, num_pages))))
+        for start in range(0, num_pages, shard_size)
+    ]
+
+
+def _hash_pdf_object(obj, hasher, seen: dict):
+    # hashes a page resource tree: dictionaries by sorted key, streams by their bytes, shared objects once.
+    # Repeated objects are hashed by visit order rather than object number, which changes when pages are re-saved.
+    if hasattr(obj, 'idnum'):
+        if (obj.idnum, obj.generation) in seen:
+            hasher.update(f"<ref {seen[(obj.idnum, obj.generation)]}>".encode())
+            return
+        seen[(obj.idnum, obj.generation)] = len(seen)
+        obj = obj.get_object()
+    if isinstance(obj, StreamObject):
+        try:
+            hasher.update(obj.get_data())
+        except Exception:
+            # filters pypdf cannot decode (e.g. some image codecs) are hashed in their encoded form
+            hasher.update(getattr(obj, '_data', b'') or b'')
+    if isinstance(obj, DictionaryObject):
+        for key in sorted(obj.keys()):
+            if key == '/Parent':
+                continue
+            hasher.update(key.encode())
+            _hash_pdf_object(obj.raw_get(key), hasher, seen)
+    elif isinstance(obj, ArrayObject):
+        hasher.update(b'[')
+        for value in obj:
+            _hash_pdf_object(value, hasher, seen)
+        hasher.update(b']')
+    elif not isinstance(obj, StreamObject):
+        hasher.update(repr(obj).encode())
+
+
+def page_fingerprint(page: PageObject) -> str:
+    hasher = hashlib.sha256()
+    hasher.update(repr(([float(x) for x in page.mediabox], page.rotation)).encode())
+    contents = page.get_contents()
+    if contents is not None:
+        hasher.update(contents.get_data())
+    resources = page.raw_get('/Resources') if '/Resources' in page else None
+    if resources is not None:
+        _hash_pdf_object(resources, hasher, {})
+    return hasher.hexdigest()
+
+
+def page_fingerprints(pdf_path) -> List[str]:
+    # one content hash per page: a page keeps its fingerprint when other pages of the PDF are replaced or moved
+    return [page_fingerprint(page) for page in PdfReader(pdf_path).pages]
+
+
+def render_page_image(pdf_path, page_no: int, scale: float = 1.0):
+    # renders one page (1-based, like DoclingDocument.pages) as a PIL image, for page images that were not stored.
+    # pypdfium2 is the renderer docling itself uses, imported here so the rest of this module only needs pypdf
+    import pypdfium2
+    pdf = pypdfium2.PdfDocument(str(pdf_path))
+    try:
+        return pdf[page_no - 1].render(scale=scale).to_pil()
+    finally:
+        pdf.close()
+
+
+# a page whose images cover at least this fraction of it and that has fewer visible characters than
+# MIN_TEXT_CHARS is a scan; with a text layer as well it is mixed
+SCANNED_IMAGE_COVERAGE = 0.5
+MIN_TEXT_CHARS = 20
+_MAX_FORM_DEPTH = 4
+
+
+@dataclass
+class PageProfile:
+    """What the content stream of one page says about it, gathered without rendering anything.
+
+    `rotation` is the clockwise angle (0, 90, 180 or 270) the page content is displayed at, from the page's
+    /Rotate combined with the direction of its text or, on a scan, of its largest image.
+    """
+    page_no: int
+    kind: str
+    text_chars: int
+    invisible_chars: int
+    image_coverage: float
+    rotation: int
+    page_rotation: int
+
+    @property
+    def needs_ocr(self) -> bool:
+        return self.kind != 'born-digital'
+
+    @property
+    def upright_rotation(self) -> int:
+        # the /Rotate value that displays this page upright
+        return (self.page_rotation - self.rotation) % 360
+
+
+def _multiply(m: List[float], n: List[float]) -> List[float]:
+    # m x n for PDF matrices [a b c d e f]
+    return [
+        m[0] * n[0] + m[1] * n[2], m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2], m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4], m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+def _angle(m: List[float]) -> int:
+    # counter-clockwise angle of a matrix' x axis, snapped to a quarter turn
+    return int(round(math.degrees(math.atan2(m[1], m[0])) / 90.0)) % 4 * 90
+
+
+def _unit_square_bbox(m: List[float]) -> Tuple[float, float, float, float]:
+    xs = [m[4], m[0] + m[4], m[2] + m[4], m[0] + m[2] + m[4]]
+    ys = [m[5], m[1] + m[5], m[3] + m[5], m[1] + m[3] + m[5]]
+    return min(xs), min(ys), max(xs), max(ys)
+
+
+def _scan_content(content, resources, ctm: List[float], stats: dict, depth: int = 0):
+    # walks the operators of a content stream, tracking the graphics state just far enough to know where
+    # images land on the page and which way text runs
+    xobjects = resources.get('/XObject', {}) if resources is not None else {}
+    xobjects = xobjects.get_object() if hasattr(xobjects, 'get_object') else xobjects
+    stack, text_matrix, invisible = [], [1, 0, 0, 1, 0, 0], False
+    for operands, operator in content.operations:
+        if operator == b'q':
+            stack.append((ctm, invisible))
+        elif operator == b'Q' and stack:
+            ctm, invisible = stack.pop()
+        elif operator == b'cm':
+            ctm = _multiply([float(x) for x in operands], ctm)
+        elif operator == b'Tm':
+            text_matrix = [float(x) for x in operands]
+        elif operator == b'BT':
+            text_matrix = [1, 0, 0, 1, 0, 0]
+        elif operator == b'Tr':
+            invisible = int(operands[0]) == 3
+        elif operator in (b'Tj', b"'", b'"', b'TJ'):
+            strings = operands[0] if operator == b'TJ' else operands[-1:]
+            chars = sum(len(x) for x in strings if isinstance(x, (str, bytes)))
+            if invisible:
+                stats['invisible_chars'] += chars
+            else:
+                stats['text_chars'] += chars
+                stats['text_angles'][_angle(_multiply(text_matrix, ctm))] += chars
+        elif operator == b'INLINE IMAGE':
+            stats['images'].append((_unit_square_bbox(ctm), _angle(ctm)))
+        elif operator == b'Do' and operands[0] in xobjects:
+            xobject = xobjects[operands[0]].get_object()
+            if xobject.get('/Subtype') == '/Image':
+                stats['images'].append((_unit_square_bbox(ctm), _angle(ctm)))
+            elif xobject.get('/Subtype') == '/Form' and depth < _MAX_FORM_DEPTH:
+                matrix = [float(x) for x in xobject.get('/Matrix', [1, 0, 0, 1, 0, 0])]
+                form = ContentStream(xobject, None)
+                _scan_content(form, xobject.get('/Resources', resources), _multiply(matrix, ctm), stats, depth + 1)
+
+
+def _image_coverage(images: List[tuple], box: Tuple[float, float, float, float]) -> float:
+    # fraction of the page covered by the union of image bounding boxes, on a coarse grid
+    width, height = box[2] - box[0], box[3] - box[1]
+    if not images or width <= 0 or height <= 0:
+        return 0.0
+    steps, covered = 32, set()
+    for (x0, y0, x1, y1), _ in images:
+        # clipped to the page first, so a degenerate matrix cannot put a bound at infinity
+        x0, y0, x1, y1 = max(x0, box[0]), max(y0, box[1]), min(x1, box[2]), min(y1, box[3])
+        if x0 >= x1 or y0 >= y1:
+            continue
+        i0, i1 = max(0, int((x0 - box[0]) / width * steps)), min(steps, math.ceil((x1 - box[0]) / width * steps))
+        j0, j1 = max(0, int((y0 - box[1]) / height * steps)), min(steps, math.ceil((y1 - box[1]) / height * steps))
+        covered.update((i, j) for i in range(i0, i1) for j in range(j0, j1))
+    return len(covered) / steps**2
+
+
+def classify_page(page: PageObject, page_no: int) -> PageProfile:
+    """Label a page born-digital, scanned or mixed from its text layer and image coverage, and find its rotation."""
+    stats = {'text_chars': 0, 'invisible_chars': 0, 'text_angles': Counter(), 'images': []}
+    box = tuple(float(x) for x in page.mediabox)
+    contents = page.get_contents()
+    if contents is not None:
+        try:
+            _scan_content(ContentStream(contents, None), page.get('/Resources'), [1, 0, 0, 1, 0, 0], stats)
+        except Exception:
+            # a content stream pypdf cannot follow is treated as an image covering the page: OCR it
+            stats['images'].append((box, 0))
+    coverage = _image_coverage(stats['images'], box)
+
+    if stats['text_chars'] >= MIN_TEXT_CHARS:
+        kind = 'mixed' if coverage >= SCANNED_IMAGE_COVERAGE else 'born-digital'
+        content_angle = stats['text_angles'].most_common(1)[0][0]
+    elif coverage >= SCANNED_IMAGE_COVERAGE:
+        kind = 'scanned'
+        largest = max(stats['images'], key=lambda image: (image[0][2] - image[0][0]) * (image[0][3] - image[0][1]))
+        content_angle = largest[1]
+    else:
+        # nearly empty or vector-only pages have nothing OCR could add
+        kind, content_angle = 'born-digital', 0
+    # /Rotate turns the page clockwise, a content matrix angle is counter-clockwise
+    rotation = (page.rotation - content_angle) % 360
+    return PageProfile(page_no=page_no, kind=kind, text_chars=stats['text_chars'],
+                       invisible_chars=stats['invisible_chars'], image_coverage=round(coverage, 3),
+                       rotation=rotation, page_rotation=page.rotation % 360)
+
+
+def classify_pages(pdf_path) -> List[PageProfile]:
+    # page_no is 1-based like DoclingDocument.pages
+    return [classify_page(page, i + 1) for i, page in enumerate(PdfReader(pdf_path).pages)]
@@ -0,0 +1,407 @@
+import argparse
+import json
+import numpy as np
+import os
+import re
+import shutil
+import uuid
+from collections import Counter
+from docling_core.types.doc.document import DocItem, DoclingDocument, PictureItem, TableItem, TextItem
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from utils.table_utils import document_id
+
+# BM25 parameters, the Lucene/Elasticsearch defaults so scores rank like the Elasticsearch path
+BM25_K1 = 1.2
+BM25_B = 0.75
+SEGMENT_FORMAT = 1
+MANIFEST_FILENAME = 'manifest.json'
+
+_TOKEN_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def _item_text(item: DocItem, document: DoclingDocument) -> str:
+    if isinstance(item, TextItem):
+        return item.text
+    if isinstance(item, TableItem):
+        # one line per table row, cells separated like a markdown table so neighbouring cells don't run together
+        rows = {}
+        for cell in sorted(item.data.table_cells, key=lambda cell: (cell.start_row_offset_idx, cell.start_col_offset_idx)):
+            rows.setdefault(cell.start_row_offset_idx, []).append(cell.text)
+        return '\n'.join(' | '.join(cells) for cells in rows.values())
+    return ''
+
+
+def item_records(document: DoclingDocument, doc_id: Optional[str] = None) -> Iterator[dict]:
+    """One index record per item of `document` that has text, a table or a caption, in reading order."""
+    doc_id = doc_id or document_id(document)
+    source = document.origin.filename if document.origin is not None else document.name
+    for position, (item, _level) in enumerate(document.iterate_items()):
+        if not isinstance(item, DocItem):
+            continue
+        text = _item_text(item, document)
+        caption = item.caption_text(document) if isinstance(item, (TableItem, PictureItem)) else ''
+        if not text and not caption:
+            continue
+        record = {
+            'document_id': doc_id,
+            'source': source,
+            'self_ref': item.self_ref,
+            'label': item.label.value,
+            'position': position,
+            'text': text,
+        }
+        if caption:
+            record['caption'] = caption
+        if item.prov:
+            prov = item.prov[0]
+            record['page_no'] = prov.page_no
+            record['bbox'] = {'l': prov.bbox.l, 't': prov.bbox.t, 'r': prov.bbox.r, 'b': prov.bbox.b}
+            record['coord_origin'] = prov.bbox.coord_origin.value
+        yield record
+
+
+def _record_tokens(record: dict) -> List[str]:
+    return tokenize(record['text']) + tokenize(record.get('caption', ''))
+
+
+def _write_segment(segment_dir: Path, records: List[dict]):
+    """Write the records as an immutable segment of flat arrays, each loaded memory-mapped at query time.
+
+    terms.bin/term_offsets.npy: the sorted vocabulary as concatenated UTF-8 and its boundaries
+    postings_offsets.npy: where each term's postings start in postings_items.npy/postings_tf.npy
+    item_lengths/item_doc/item_label/item_page.npy: per item token count and filter columns
+    items.jsonl/item_offsets.npy: the records themselves, read back only for the results returned
+    """
+    postings: Dict[str, List[Tuple[int, int]]] = {}
+    documents: Dict[str, int] = {}
+    labels: Dict[str, int] = {}
+    lengths = np.zeros(len(records), dtype=np.uint32)
+    item_doc = np.zeros(len(records), dtype=np.uint32)
+    item_label = np.zeros(len(records), dtype=np.uint8)
+    item_page = np.zeros(len(records), dtype=np.int32)
+    item_offsets = np.zeros(len(records) + 1, dtype=np.int64)
+
+    segment_dir.mkdir(parents=True)
+    with open(segment_dir / 'items.jsonl', 'wb') as f:
+        for i, record in enumerate(records):
+            tokens = _record_tokens(record)
+            lengths[i] = len(tokens)
+            for term, tf in Counter(tokens).items():
+                postings.setdefault(term, []).append((i, min(tf, 2**16 - 1)))
+            item_doc[i] = documents.setdefault(record['document_id'], len(documents))
+            item_label[i] = labels.setdefault(record['label'], len(labels))
+            item_page[i] = record.get('page_no', 0)
+            line = json.dumps(record).encode('utf-8') + b'\n'
+            f.write(line)
+            item_offsets[i + 1] = item_offsets[i] + len(line)
+
+    terms = sorted(postings)
+    encoded_terms = [term.encode('utf-8') for term in terms]
+    term_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    term_offsets[1:] = np.cumsum([len(term) for term in encoded_terms])
+    postings_offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+    postings_offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+    postings_items = np.empty(postings_offsets[-1], dtype=np.uint32)
+    postings_tf = np.empty(postings_offsets[-1], dtype=np.uint16)
+    for term, start in zip(terms, postings_offsets[:-1]):
+        entries = np.asarray(postings[term], dtype=np.uint32)
+        postings_items[start:start + len(entries)] = entries[:, 0]
+        postings_tf[start:start + len(entries)] = entries[:, 1]
+
+    (segment_dir / 'terms.bin').write_bytes(b''.join(encoded_terms))
+    for name, array in [('term_offsets', term_offsets), ('postings_offsets', postings_offsets),
+                        ('postings_items', postings_items), ('postings_tf', postings_tf), ('item_lengths', lengths),
+                        ('item_doc', item_doc), ('item_label', item_label), ('item_page', item_page),
+                        ('item_offsets', item_offsets)]:
+        np.save(segment_dir / f"{name}.npy", array)
+    with open(segment_dir / 'meta.json', 'w') as f:
+        json.dump({'format': SEGMENT_FORMAT, 'items': len(records), 'terms': len(terms),
+                   'documents': list(documents), 'labels': list(labels)}, f)
+
+
+class _Segment:
+    # read side of one segment; every array is a memory map, so opening a segment reads only its metadata
+
+    def __init__(self, segment_dir: Path):
+        self.segment_dir = segment_dir
+        with open(segment_dir / 'meta.json', 'r') as f:
+            meta = json.load(f)
+        self.documents: List[str] = meta['documents']
+        self.labels: List[str] = meta['labels']
+        self.num_items: int = meta['items']
+        load = lambda name: np.load(segment_dir / f"{name}.npy", mmap_mode='r')
+        self.term_offsets = load('term_offsets')
+        self.postings_offsets = load('postings_offsets')
+        self.postings_items = load('postings_items')
+        self.postings_tf = load('postings_tf')
+        self.item_lengths = load('item_lengths')
+        self.item_doc = load('item_doc')
+        self.item_label = load('item_label')
+        self.item_page = load('item_page')
+        self.item_offsets = load('item_offsets')
+        self.terms = np.memmap(segment_dir / 'terms.bin', dtype=np.uint8, mode='r') if self.term_offsets[-1] else b''
+        self.live = np.ones(self.num_items, dtype=bool)
+
+    def set_deleted(self, deleted: Iterable[str]):
+        deleted = set(deleted)
+        codes = [code for code, doc_id in enumerate(self.documents) if doc_id in deleted]
+        self.live = ~np.isin(self.item_doc, codes) if codes else np.ones(self.num_items, dtype=bool)
+
+    def _term(self, i: int) -> bytes:
+        return bytes(self.terms[self.term_offsets[i]:self.term_offsets[i + 1]])
+
+    def postings(self, term: str) -> Tuple[np.ndarray, np.ndarray]:
+        # binary search of the sorted vocabulary, then the term's slice of the postings arrays
+        target = term.encode('utf-8')
+        lo, hi = 0, len(self.term_offsets) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._term(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(self.term_offsets) - 1 or self._term(lo) != target:
+            return np.empty(0, dtype=np.uint32), np.empty(0, dtype=np.uint16)
+        start, end = self.postings_offsets[lo], self.postings_offsets[lo + 1]
+        return self.postings_items[start:end], self.postings_tf[start:end]
+
+    def record(self, i: int) -> dict:
+        with open(self.segment_dir / 'items.jsonl', 'rb') as f:
+            f.seek(self.item_offsets[i])
+            return json.loads(f.read(self.item_offsets[i + 1] - self.item_offsets[i]))
+
+    def records(self) -> Iterator[dict]:
+        with open(self.segment_dir / 'items.jsonl', 'rb') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def filter_mask(self, labels: Optional[set], pages: Optional[set], document_ids: Optional[set]) -> np.ndarray:
+        mask = self.live.copy()
+        if labels is not None:
+            mask &= np.isin(self.item_label, [code for code, label in enumerate(self.labels) if label in labels])
+        if pages is not None:
+            mask &= np.isin(self.item_page, list(pages))
+        if document_ids is not None:
+            mask &= np.isin(self.item_doc, [code for code, doc_id in enumerate(self.documents) if doc_id in document_ids])
+        return mask
+
+
+class SearchIndex:
+    """Offline BM25 full-text index of DoclingDocument items, for deployments without Elasticsearch.
+
+    The index is a set of immutable segments plus a manifest listing them and the documents deleted from each.
+    Adding documents writes a new segment and tombstones any earlier copy of those documents; deleting one only
+    touches the manifest. compact() rewrites everything still live into a single segment. Segment arrays are
+    memory-mapped, so opening the index is cheap and queries only page in the postings of their terms.
+    One process should write to an index at a time; readers pick up its changes with refresh().
+    """
+
+    def __init__(self, root: Union[str, Path] = 'data/search_index'):
+        self.root = Path(root)
+        self._segments: Dict[str, _Segment] = {}
+        self._manifest = {'segments': [], 'deleted': {}}
+        self.refresh()
+
+    @property
+    def _manifest_path(self) -> Path:
+        return self.root / MANIFEST_FILENAME
+
+    def refresh(self):
+        try:
+            with open(self._manifest_path, 'r') as f:
+                self._manifest = json.load(f)
+        except FileNotFoundError:
+            self._manifest = {'segments': [], 'deleted': {}}
+        self._segments = {name: self._segments.get(name) or _Segment(self.root / name) for name in self._manifest['segments']}
+        for name, segment in self._segments.items():
+            segment.set_deleted(self._manifest['deleted'].get(name, []))
+
+    def _write_manifest(self, manifest: dict):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self._manifest_path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        with open(tmp_path, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self._manifest_path)
+        # segments no longer in the manifest are removed once it no longer points at them
+        live = set(manifest['segments'])
+        for name in list(self._segments):
+            if name not in live:
+                del self._segments[name]
+                shutil.rmtree(self.root / name, ignore_errors=True)
+        self.refresh()
+
+    def _tombstone(self, manifest: dict, document_ids: set) -> int:
+        removed = 0
+        for name in manifest['segments']:
+            deleted = set(manifest['deleted'].get(name, []))
+            present = (set(self._segments[name].documents) & document_ids) - deleted
+            if present:
+                manifest['deleted'][name] = sorted(deleted | present)
+                removed += len(present)
+        return removed
+
+    def document_ids(self) -> List[str]:
+        doc_ids = set()
+        for name, segment in self._segments.items():
+            doc_ids.update(set(segment.documents) - set(self._manifest['deleted'].get(name, [])))
+        return sorted(doc_ids)
+
+    def add_documents(self, documents: Iterable[DoclingDocument]) -> dict:
+        """Index the items of `documents` as a new segment, replacing any documents that were already indexed."""
+        records = []
+        doc_ids = set()
+        for document in documents:
+            doc_id = document_id(document)
+            if doc_id in doc_ids:
+                records = [record for record in records if record['document_id'] != doc_id]
+            doc_ids.add(doc_id)
+            records.extend(item_records(document, doc_id))
+        manifest = json.loads(json.dumps(self._manifest))
+        replaced = self._tombstone(manifest, doc_ids)
+        if records:
+            name = f"seg-{uuid.uuid4().hex[:12]}"
+            # written under a dot-prefixed name and renamed, so a crash never leaves a half segment in place
+            tmp_dir = self.root / f".{name}"
+            _write_segment(tmp_dir, records)
+            os.rename(tmp_dir, self.root / name)
+            manifest['segments'].append(name)
+        self._write_manifest(manifest)
+        return {'documents': len(doc_ids), 'replaced': replaced, 'items': len(records)}
+
+    def add_document(self, document: DoclingDocument) -> dict:
+        return self.add_documents([document])
+
+    def delete_document(self, doc_id: str) -> bool:
+        manifest = json.loads(json.dumps(self._manifest))
+        if not self._tombstone(manifest, {doc_id}):
+            return False
+        # a segment whose every document is deleted is dropped outright
+        manifest['segments'] = [name for name in manifest['segments']
+                                if set(self._segments[name].documents) - set(manifest['deleted'].get(name, []))]
+        manifest['deleted'] = {name: doc_ids for name, doc_ids in manifest['deleted'].items() if name in manifest['segments']}
+        self._write_manifest(manifest)
+        return True
+
+    def compact(self) -> dict:
+        # rewrites the live items of every segment into one, dropping deleted items and merging the vocabularies
+        records = [record for segment in self._segments.values() for record, live in zip(segment.records(), segment.live) if live]
+        manifest = {'segments': [], 'deleted': {}}
+        if records:
+            name = f"seg-{uuid.uuid4().hex[:12]}"
+            _write_segment(self.root / f".{name}", records)
+            os.rename(self.root / f".{name}", self.root / name)
+            manifest['segments'].append(name)
+        self._write_manifest(manifest)
+        return {'segments': len(manifest['segments']), 'items': len(records)}
+
+    def search(self, query: str, k: int = 10, labels: Optional[Iterable[str]] = None, pages: Optional[Iterable[int]] = None,
+               document_ids: Optional[Iterable[str]] = None) -> List[dict]:
+        """The `k` best items for `query` by BM25, optionally only those with a label, on a page or in a document.
+
+        Each result is the item's index record (document_id, source, self_ref, label, page_no, bbox, text, ...)
+        with its `score`. Term statistics are those of the whole live index, independent of the filters.
+        """
+        terms = list(dict.fromkeys(tokenize(query)))
+        segments = list(self._segments.values())
+        if not terms or not segments:
+            return []
+        num_items = sum(int(segment.live.sum()) for segment in segments)
+        if num_items == 0:
+            return []
+        avg_length = sum(float(segment.item_lengths[segment.live].sum()) for segment in segments) / num_items
+
+        # postings of each query term in each segment, restricted to live items, for the document frequencies
+        postings = []
+        df = np.zeros(len(terms))
+        for segment in segments:
+            segment_postings = []
+            for t, term in enumerate(terms):
+                items, tf = segment.postings(term)
+                live = segment.live[items]
+                items, tf = items[live], tf[live]
+                df[t] += len(items)
+                segment_postings.append((items, tf))
+            postings.append(segment_postings)
+        idf = np.log(1 + (num_items - df + 0.5) / (df + 0.5))
+
+        labels = set(labels) if labels is not None else None
+        pages = set(pages) if pages is not None else None
+        document_ids = set(document_ids) if document_ids is not None else None
+        candidates = []
+        for segment, segment_postings in zip(segments, postings):
+            scores = np.zeros(segment.num_items, dtype=np.float32)
+            for t, (items, tf) in enumerate(segment_postings):
+                if len(items) == 0:
+                    continue
+                tf = tf.astype(np.float32)
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * segment.item_lengths[items] / avg_length)
+                scores[items] += idf[t] * tf * (BM25_K1 + 1) / (tf + norm)
+            if labels is not None or pages is not None or document_ids is not None:
+                scores[~segment.filter_mask(labels, pages, document_ids)] = 0
+            matched = np.flatnonzero(scores)
+            if len(matched) > k:
+                matched = matched[np.argpartition(-scores[matched], k)[:k]]
+            candidates.extend((float(scores[i]), segment, int(i)) for i in matched)
+
+        candidates.sort(key=lambda candidate: (-candidate[0], candidate[1].segment_dir.name, candidate[2]))
+        return [{'score': score, **segment.record(i)} for score, segment, i in candidates[:k]]
+
+    def stats(self) -> dict:
+        segment_bytes = {name: sum(f.stat().st_size for f in (self.root / name).iterdir()) for name in self._segments}
+        return {
+            'segments': len(self._segments),
+            'documents': len(self.document_ids()),
+            'items': sum(segment.num_items for segment in self._segments.values()),
+            'live_items': sum(int(segment.live.sum()) for segment in self._segments.values()),
+            'bytes': sum(segment_bytes.values()),
+        }
+
+
+def build_search_index(converted_path: Union[str, Path] = 'data/converted', index_path: Union[str, Path] = 'data/search_index',
+                       batch_documents: int = 50, verbose: bool = False) -> SearchIndex:
+    # (re)indexes every converted document under converted_path, batch_documents documents per segment, then
+    # drops the documents that are no longer there and compacts the index into one segment
+    from utils.docling_utils import _document_exists, _load_document
+    index = SearchIndex(index_path)
+    output_dirs = sorted(p for p in Path(converted_path).iterdir() if _document_exists(p))
+    seen = set()
+    for start in range(0, len(output_dirs), batch_documents):
+        documents = [_load_document(output_dir) for output_dir in output_dirs[start:start + batch_documents]]
+        seen.update(document_id(document) for document in documents)
+        result = index.add_documents(documents)
+        if verbose: print(f"Indexed {result['documents']} documents, {result['items']} items")
+    for doc_id in set(index.document_ids()) - seen:
+        index.delete_document(doc_id)
+    index.compact()
+    if verbose: print(index.stats())
+    return index
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build or query the offline full-text index of the converted documents.")
+    parser.add_argument('--index', default='data/search_index')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build_parser = subparsers.add_parser('build')
+    build_parser.add_argument('converted_path', nargs='?', default='data/converted')
+    query_parser = subparsers.add_parser('query')
+    query_parser.add_argument('query')
+    query_parser.add_argument('-k', type=int, default=10)
+    query_parser.add_argument('--label', action='append')
+    query_parser.add_argument('--page', type=int, action='append')
+    query_parser.add_argument('--document', action='append')
+    args = parser.parse_args(argv)
+    if args.command == 'build':
+        build_search_index(args.converted_path, args.index, verbose=True)
+    else:
+        for result in SearchIndex(args.index).search(args.query, args.k, args.label, args.page, args.document):
+            print(f"{result['score']:7.3f}  {result['source']}  p{result.get('page_no', '?')}  {result['self_ref']}  {result['label']}: {result['text'][:80]!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,624 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import json
+import mimetypes
+import mmap
+import os
+import typing
+import uuid
+from collections import OrderedDict
+from docling_core.types.doc.document import DoclingDocument, DocumentOrigin, GroupItem, NodeItem, PageItem
+from pathlib import Path
+from pydantic import TypeAdapter
+from typing import Union, Optional, List, Iterator, Tuple, Dict
+
+# Compact on-disk form of a DoclingDocument: the structure as minified, gzip-compressed JSON and every
+# base64-inlined image moved to a content-addressed sidecar file shared by all images with the same bytes.
+COMPACT_DOCUMENT_FILENAME = 'document.json.gz'
+COMPACT_CONVERSION_RESULT_FILENAME = 'conversion_result.json.gz'
+IMAGES_DIRNAME = 'images'
+DOCUMENT_INDEX_FILENAME = 'document.index.json'
+# image-free, indexed expansion of the compact document that LazyDocument reads when there is no document.json
+LAZY_DOCUMENT_FILENAME = 'document.lazy.json'
+DOCUMENT_INDEX_VERSION = 1
+CONVERSION_RESULT_INDEX_FILENAME = 'conversion_result.index.json'
+# fields of a conversion result too large to read up front: each is read on its own, pages one at a time
+LAZY_CONVERSION_RESULT_FIELDS = ('pages', 'assembled', 'document')
+# item collections of a DoclingDocument that the offset index covers, in the order they are written
+INDEXED_COLLECTIONS = ('groups', 'texts', 'pictures', 'tables', 'key_value_items')
+# marks an image uri that points into the images directory, so it is never confused with a real relative path
+SIDECAR_PREFIX = 'sidecar:'
+
+
+def _write_sidecar(data_uri: str, images_dir: Path, as_path: bool = False) -> str:
+    header, encoded = data_uri.split(',', 1)
+    mimetype = header[len('data:'):].split(';')[0]
+    image_bytes = base64.b64decode(encoded)
+    extension = mimetypes.guess_extension(mimetype) or '.bin'
+    filename = f"{hashlib.sha256(image_bytes).hexdigest()}{extension}"
+    image_path = images_dir / filename
+    if not image_path.exists():
+        tmp_path = image_path.with_name(f".{filename}.{uuid.uuid4().hex}")
+        with open(tmp_path, 'wb') as f:
+            f.write(image_bytes)
+        os.replace(tmp_path, image_path)
+    if as_path:
+        return str(image_path.resolve())
+    return f"{SIDECAR_PREFIX}{IMAGES_DIRNAME}/{filename}"
+
+
+def _sidecar_ref(uri: str, images_dir: Path) -> Optional[str]:
+    # the sidecar reference of an image file path that points into images_dir, None for any other uri
+    if uri.startswith('file://'):
+        uri = uri[len('file://'):]
+    if not os.path.isabs(uri):
+        return None
+    image_path = Path(uri)
+    if image_path.parent.resolve() != images_dir.resolve() or not image_path.exists():
+        return None
+    return f"{SIDECAR_PREFIX}{IMAGES_DIRNAME}/{image_path.name}"
+
+
+def _extract_images(node, images_dir: Path, as_path: bool = False) -> int:
+    # replaces inlined data URIs by sidecar references in place, returns how many were moved out;
+    # images already spilled to images_dir are stored by the same relative reference, never by absolute path
+    moved = 0
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'uri' and isinstance(value, str) and value.startswith('data:'):
+                node[key] = _write_sidecar(value, images_dir, as_path)
+                moved += 1
+            elif key == 'uri' and isinstance(value, str):
+                if not as_path:
+                    node[key] = _sidecar_ref(value, images_dir) or value
+            else:
+                moved += _extract_images(value, images_dir, as_path)
+    elif isinstance(node, list):
+        for value in node:
+            moved += _extract_images(value, images_dir, as_path)
+    return moved
+
+
+def spill_images(data: dict, output_dir: Union[str, Path]) -> int:
+    """Move the inlined images of an exported document to `output_dir/images`, leaving file paths behind.
+
+    Unlike the compact format, the result is still a valid DoclingDocument: ImageRef accepts file paths and
+    only opens them when `pil_image` is used. The paths only live in memory: saving the document to
+    output_dir turns them back into SIDECAR_PREFIX-relative references, so the directory can be moved.
+    """
+    images_dir = Path(output_dir) / IMAGES_DIRNAME
+    images_dir.mkdir(parents=True, exist_ok=True)
+    return _extract_images(data, images_dir, as_path=True)
+
+
+def _data_uri(image_path: Path) -> str:
+    mimetype = mimetypes.guess_type(image_path.name)[0] or 'application/octet-stream'
+    with open(image_path, 'rb') as f:
+        return f"data:{mimetype};base64,{base64.b64encode(f.read()).decode('utf-8')}"
+
+
+def _restore_images(node, base_dir: Path, embed_images: bool):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'uri' and isinstance(value, str) and value.startswith(SIDECAR_PREFIX):
+                image_path = base_dir / value[len(SIDECAR_PREFIX):]
+                if embed_images:
+                    node[key] = _data_uri(image_path)
+                else:
+                    node[key] = str(image_path.resolve())
+            else:
+                _restore_images(value, base_dir, embed_images)
+    elif isinstance(node, list):
+        for value in node:
+            _restore_images(value, base_dir, embed_images)
+
+
+def save_compact(data: dict, output_path: Union[str, Path]) -> int:
+    """Write a JSON-able dict in the compact format next to its sidecar images. `data` is modified in place."""
+    output_path = Path(output_path)
+    images_dir = output_path.parent / IMAGES_DIRNAME
+    images_dir.mkdir(parents=True, exist_ok=True)
+    moved = _extract_images(data, images_dir)
+    tmp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}")
+    with gzip.open(tmp_path, 'wb', compresslevel=6) as f:
+        f.write(json.dumps(data, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+    os.replace(tmp_path, output_path)
+    return moved
+
+
+def _read_compact(input_path: Path):
+    # the stored JSON with its sidecar references left as they are
+    with gzip.open(input_path, 'rb') as f:
+        return json.loads(f.read())
+
+
+def load_compact(input_path: Union[str, Path], embed_images: bool = True) -> dict:
+    """Read a compact file back into a dict. With embed_images=False, images stay on disk as file paths."""
+    input_path = Path(input_path)
+    data = _read_compact(input_path)
+    _restore_images(data, input_path.parent, embed_images)
+    return data
+
+
+def save_compact_document(document: DoclingDocument, output_dir: Union[str, Path]) -> Path:
+    output_path = Path(output_dir) / COMPACT_DOCUMENT_FILENAME
+    save_compact(document.export_to_dict(), output_path)
+    return output_path
+
+
+def load_compact_document(output_dir: Union[str, Path], embed_images: bool = True) -> DoclingDocument:
+    # embed_images=True gives back the data URIs the document was saved with; False leaves images as sidecar
+    # file paths, which ImageRef.pil_image opens only when an image is actually used
+    return DoclingDocument.model_validate(load_compact(Path(output_dir) / COMPACT_DOCUMENT_FILENAME, embed_images))
+
+
+def _inline_image_files(node) -> int:
+    moved = 0
+    if isinstance(node, dict):
+        for key, value in node.items():
+            if key == 'uri' and isinstance(value, str) and not value.startswith('data:') and Path(value).is_file():
+                node[key] = _data_uri(Path(value))
+                moved += 1
+            else:
+                moved += _inline_image_files(value)
+    elif isinstance(node, list):
+        for value in node:
+            moved += _inline_image_files(value)
+    return moved
+
+
+def inline_images(document: DoclingDocument) -> DoclingDocument:
+    """`document` with every image kept as a file path inlined as a data URI again, byte for byte as it was saved.
+
+    An export with embedded images then gives the same output for a document loaded with embed_images=False
+    as for a freshly converted one. Returns `document` itself when none of its images is a file path.
+    """
+    images = [item.image for item in list(document.pictures) + list(document.tables) + list(document.pages.values())]
+    if all(image is None or str(image.uri).startswith('data:') for image in images):
+        return document
+    data = document.export_to_dict()
+    _inline_image_files(data)
+    return DoclingDocument.model_validate(data)
+
+
+def has_fresh_compact_document(output_dir: Union[str, Path]) -> bool:
+    # the compact copy is only trusted if document.json has not been rewritten since
+    output_dir = Path(output_dir)
+    compact_path = output_dir / COMPACT_DOCUMENT_FILENAME
+    json_path = output_dir / 'document.json'
+    if not compact_path.exists():
+        return False
+    return not json_path.exists() or compact_path.stat().st_mtime >= json_path.stat().st_mtime
+
+
+def _dumps(value) -> bytes:
+    return json.dumps(value, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+
+def _item_pages(item: dict) -> List[int]:
+    return sorted({prov['page_no'] for prov in item.get('prov', [])})
+
+
+def _index_path(document_json_path: Path) -> Path:
+    # document.json -> document.index.json, document.lazy.json -> document.lazy.index.json
+    return document_json_path.with_suffix('.index.json')
+
+
+def _source_stat(source_path: Optional[Path]) -> Optional[List[int]]:
+    if source_path is None:
+        return None
+    stat = source_path.stat()
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def save_indexed_document_json(document: DoclingDocument, document_json_path: Union[str, Path],
+                               source_path: Optional[Union[str, Path]] = None) -> Path:
+    """Write the document as JSON plus an index of the byte span of every item, page and image inside it.
+
+    The file is ordinary DoclingDocument JSON that `load_from_json_file` reads as before; only the layout is
+    controlled so that `LazyDocument` can later read single items straight out of a memory map. `source_path`
+    is the file the document was read from, if any; the index goes stale when that file changes.
+    """
+    document_json_path = Path(document_json_path)
+    source_stat = _source_stat(Path(source_path) if source_path is not None else None)
+    data = document.export_to_dict()
+    header = {key: value for key, value in data.items() if key not in INDEXED_COLLECTIONS and key != 'pages'}
+    index = {'version': DOCUMENT_INDEX_VERSION, 'header': header, 'items': {}, 'pages': {}}
+
+    tmp_path = document_json_path.with_name(f".{document_json_path.name}.{uuid.uuid4().hex}")
+    with open(tmp_path, 'wb') as f:
+        def write_entry(value: dict) -> Tuple[int, int, Optional[List[int]]]:
+            # images go last in their object so the item can be read without them by cutting the span short
+            image = value.get('image')
+            if image is None:
+                offset = f.tell()
+                f.write(_dumps(value))
+                return offset, f.tell() - offset, None
+            without_image = _dumps({key: item for key, item in value.items() if key != 'image'})
+            offset = f.tell()
+            f.write(without_image[:-1] + (b',' if len(without_image) > 2 else b'') + b'"image":')
+            image_offset = f.tell()
+            f.write(_dumps(image))
+            image_span = [image_offset, f.tell() - image_offset]
+            f.write(b'}')
+            return offset, f.tell() - offset, image_span
+
+        f.write(_dumps(header)[:-1])
+        for collection in INDEXED_COLLECTIONS:
+            f.write(f',"{collection}":['.encode('utf-8'))
+            for i, item in enumerate(data.get(collection, [])):
+                if i:
+                    f.write(b',\n')
+                offset, length, image_span = write_entry(item)
+                index['items'][item['self_ref']] = {
+                    'span': [offset, length],
+                    'image': image_span,
+                    'label': item.get('label'),
+                    'pages': _item_pages(item),
+                    'children': [child['$ref'] for child in item.get('children', [])],
+                }
+            f.write(b']')
+        f.write(b',"pages":{')
+        for i, (page_no, page) in enumerate(data.get('pages', {}).items()):
+            if i:
+                f.write(b',\n')
+            f.write(_dumps(str(page_no)) + b':')
+            offset, length, image_span = write_entry(page)
+            index['pages'][str(page_no)] = {'span': [offset, length], 'image': image_span}
+        f.write(b'}}')
+    os.replace(tmp_path, document_json_path)
+
+    stat = document_json_path.stat()
+    index['document_size'] = stat.st_size
+    index['document_mtime_ns'] = stat.st_mtime_ns
+    index['source'] = source_stat
+    with open(_index_path(document_json_path), 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    return document_json_path
+
+
+def _collection_adapter(collection: str) -> TypeAdapter:
+    # validates one element of a DoclingDocument list field, e.g. the SectionHeaderItem/ListItem/TextItem union of texts
+    return TypeAdapter(typing.get_args(DoclingDocument.model_fields[collection].annotation)[0])
+
+
+class LazyDocument:
+    """Read-only view of a saved DoclingDocument that materializes items only when they are accessed.
+
+    Backed by document.lazy.json, the expansion of the compact document (or a legacy document.json), mapped into
+    memory and the offset index written by `save_indexed_document_json`.
+    Tree traversal and page filtering run on the index alone, so scanning a large document keeps at most
+    `cache_size` parsed items in memory, and images are only decoded for items requested `with_images`.
+    """
+
+    def __init__(self, document_json_path: Union[str, Path], cache_size: int = 256,
+                 source_path: Optional[Union[str, Path]] = None):
+        self.document_json_path = Path(document_json_path)
+        index_path = _index_path(self.document_json_path)
+        with open(index_path, 'r') as f:
+            self._index = json.load(f)
+        stat = self.document_json_path.stat()
+        if (self._index.get('version') != DOCUMENT_INDEX_VERSION or self._index.get('document_size') != stat.st_size
+                or self._index.get('document_mtime_ns') != stat.st_mtime_ns
+                or self._index.get('source') != _source_stat(Path(source_path) if source_path is not None else None)):
+            raise ValueError(f"Document index {index_path} is stale, rebuild it with build_document_index()")
+
+        self._file = open(self.document_json_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._cache: OrderedDict = OrderedDict()
+        self._cache_size = cache_size
+        self._adapters: Dict[str, TypeAdapter] = {}
+        header = self._index['header']
+        self.name: str = header['name']
+        self.body = GroupItem.model_validate(header['body'])
+        self.furniture = GroupItem.model_validate(header['furniture'])
+
+    def close(self):
+        self._cache.clear()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "LazyDocument":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self) -> int:
+        return len(self._index['items'])
+
+    @property
+    def origin(self) -> Optional[DocumentOrigin]:
+        origin = self._index['header'].get('origin')
+        return DocumentOrigin.model_validate(origin) if origin is not None else None
+
+    @property
+    def page_numbers(self) -> List[int]:
+        return sorted(int(page_no) for page_no in self._index['pages'])
+
+    def _read(self, entry: dict, with_image: bool) -> dict:
+        offset, length = entry['span']
+        if entry['image'] is None or with_image:
+            return json.loads(self._mmap[offset:offset + length])
+        # cut the span just before the trailing "image" member and close the object
+        image_offset = entry['image'][0]
+        raw = self._mmap[offset:image_offset - len(b'"image":')].rstrip(b',')
+        return json.loads(raw + b'}')
+
+    def _adapter(self, self_ref: str) -> TypeAdapter:
+        collection = self_ref.split('/')[1]
+        if collection not in self._adapters:
+            self._adapters[collection] = _collection_adapter(collection)
+        return self._adapters[collection]
+
+    def get_item(self, self_ref: str, with_image: bool = True) -> NodeItem:
+        if self_ref == self.body.self_ref:
+            return self.body
+        if self_ref == self.furniture.self_ref:
+            return self.furniture
+        key = (self_ref, with_image)
+        item = self._cache.get(key)
+        if item is not None:
+            self._cache.move_to_end(key)
+            return item
+        entry = self._index['items'][self_ref]
+        item = self._adapter(self_ref).validate_python(self._read(entry, with_image))
+        self._cache[key] = item
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return item
+
+    def __getitem__(self, self_ref: str) -> NodeItem:
+        return self.get_item(self_ref)
+
+    def resolve(self, ref) -> NodeItem:
+        return self.get_item(ref if isinstance(ref, str) else ref.cref)
+
+    def get_page(self, page_no: int, with_image: bool = True) -> PageItem:
+        return PageItem.model_validate(self._read(self._index['pages'][str(page_no)], with_image))
+
+    def item_pages(self, self_ref: str) -> List[int]:
+        return self._index['items'][self_ref]['pages']
+
+    def iterate_items(self, root: Optional[Union[NodeItem, str]] = None, with_groups: bool = False,
+                      traverse_pictures: bool = False, page_no: Optional[int] = None, with_images: bool = True,
+                      _level: int = 0) -> Iterator[Tuple[NodeItem, int]]:
+        """Same traversal as DoclingDocument.iterate_items, deciding from the index which items to materialize."""
+        root_ref = root if isinstance(root, str) else (root.self_ref if root is not None else self.body.self_ref)
+        if root_ref in (self.body.self_ref, self.furniture.self_ref):
+            entry = {'label': None, 'children': [child.cref for child in self.get_item(root_ref).children], 'pages': []}
+            is_group = True
+        else:
+            entry = self._index['items'][root_ref]
+            is_group = root_ref.startswith('#/groups/')
+
+        if not is_group or with_groups:
+            if is_group or page_no is None or page_no in entry['pages']:
+                yield self.get_item(root_ref, with_image=with_images), _level
+
+        if root_ref.startswith('#/pictures/') and not traverse_pictures:
+            return
+
+        for child_ref in entry['children']:
+            yield from self.iterate_items(child_ref, with_groups=with_groups, traverse_pictures=traverse_pictures,
+                                          page_no=page_no, with_images=with_images, _level=_level + 1)
+
+    def iterate_texts(self, page_no: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+        # (self_ref, text) of every text item in reading order, without touching tables or pictures
+        for item, _ in self.iterate_items(page_no=page_no, with_images=False):
+            text = getattr(item, 'text', None)
+            if text:
+                yield item.self_ref, text
+
+    def to_document(self) -> DoclingDocument:
+        return DoclingDocument.model_validate_json(self._mmap[:])
+
+
+def build_document_index(document_json_path: Union[str, Path]) -> Path:
+    """Rewrite an existing document.json in the indexed layout and write its index (a one-off full load)."""
+    document_json_path = Path(document_json_path)
+    document = DoclingDocument.load_from_json_file(document_json_path)
+    return save_indexed_document_json(document, document_json_path)
+
+
+def build_compact_document_index(output_dir: Union[str, Path]) -> Path:
+    """Expand the compact document into an indexed document.lazy.json, leaving its images in the sidecar files."""
+    output_dir = Path(output_dir)
+    document = load_compact_document(output_dir, embed_images=False)
+    return save_indexed_document_json(document, output_dir / LAZY_DOCUMENT_FILENAME,
+                                      source_path=output_dir / COMPACT_DOCUMENT_FILENAME)
+
+
+def load_lazy_document(output_dir: Union[str, Path], cache_size: int = 256) -> LazyDocument:
+    output_dir = Path(output_dir)
+    if has_fresh_compact_document(output_dir):
+        # also the only copy left after migrate_output_dir(remove_json=True); the expansion is rebuilt
+        # whenever the compact file it was made from changes
+        lazy_path = output_dir / LAZY_DOCUMENT_FILENAME
+        compact_path = output_dir / COMPACT_DOCUMENT_FILENAME
+        try:
+            return LazyDocument(lazy_path, cache_size=cache_size, source_path=compact_path)
+        except (FileNotFoundError, ValueError):
+            build_compact_document_index(output_dir)
+            return LazyDocument(lazy_path, cache_size=cache_size, source_path=compact_path)
+
+    document_json_path = output_dir / 'document.json'
+    try:
+        return LazyDocument(document_json_path, cache_size=cache_size)
+    except (FileNotFoundError, ValueError):
+        if not document_json_path.exists():
+            raise
+        build_document_index(document_json_path)
+        return LazyDocument(document_json_path, cache_size=cache_size)
+
+
+def save_indexed_conversion_result(data: dict, output_path: Union[str, Path]) -> int:
+    """Write a conversion result in the compact format with an index of its pages and large fields.
+
+    Every page and large field is a gzip member of its own, so one of them can be decompressed without the rest,
+    while the file as a whole is still the gzip stream of the full JSON that `load_compact` reads. `data` is
+    modified in place; returns how many images were moved to sidecar files.
+    """
+    output_path = Path(output_path)
+    images_dir = output_path.parent / IMAGES_DIRNAME
+    images_dir.mkdir(parents=True, exist_ok=True)
+    moved = _extract_images(data, images_dir)
+    header = {key: value for key, value in data.items() if key not in LAZY_CONVERSION_RESULT_FIELDS}
+    index = {'version': DOCUMENT_INDEX_VERSION, 'header': header, 'fields': {}, 'pages': []}
+
+    tmp_path = output_path.with_name(f".{output_path.name}.{uuid.uuid4().hex}")
+    with open(tmp_path, 'wb') as f:
+        def write_member(raw: bytes) -> List[int]:
+            offset = f.tell()
+            f.write(gzip.compress(raw, compresslevel=6))
+            return [offset, f.tell() - offset]
+
+        opening = _dumps(header)[:-1]
+        separator = b',' if header else b''
+        for field in LAZY_CONVERSION_RESULT_FIELDS:
+            if field not in data:
+                continue
+            if field == 'pages':
+                write_member(opening + separator + b'"pages":[')
+                for i, page in enumerate(data['pages']):
+                    # the separating comma goes with the page, _read_member strips it
+                    span = write_member((b',' if i else b'') + _dumps(page))
+                    index['pages'].append({'span': span, 'page_no': page.get('page_no'), 'size': page.get('size')})
+                write_member(b']')
+            else:
+                write_member(opening + separator + _dumps(field) + b':')
+                index['fields'][field] = write_member(_dumps(data[field]))
+            opening, separator = b'', b','
+        write_member(opening + b'}')
+    os.replace(tmp_path, output_path)
+
+    stat = output_path.stat()
+    index['result_size'] = stat.st_size
+    index['result_mtime_ns'] = stat.st_mtime_ns
+    with open(output_path.with_name(CONVERSION_RESULT_INDEX_FILENAME), 'w') as f:
+        json.dump(index, f, separators=(',', ':'))
+    return moved
+
+
+class IndexedConversionResult:
+    """A saved conversion result whose header fields are read up front and whose pages and large fields
+    (`LAZY_CONVERSION_RESULT_FIELDS`) are decompressed one at a time from a memory map, with images as file paths.
+    """
+
+    def __init__(self, result_path: Union[str, Path]):
+        self.result_path = Path(result_path)
+        index_path = self.result_path.with_name(CONVERSION_RESULT_INDEX_FILENAME)
+        with open(index_path, 'r') as f:
+            self._index = json.load(f)
+        stat = self.result_path.stat()
+        if (self._index.get('version') != DOCUMENT_INDEX_VERSION or self._index.get('result_size') != stat.st_size
+                or self._index.get('result_mtime_ns') != stat.st_mtime_ns):
+            raise ValueError(f"Conversion result index {index_path} is stale")
+        self._file = open(self.result_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        self._mmap.close()
+        self._file.close()
+
+    @property
+    def header(self) -> dict:
+        return self._index['header']
+
+    @property
+    def page_summaries(self) -> List[dict]:
+        # page_no and size of every page, known without reading the pages
+        return [{'page_no': page['page_no'], 'size': page['size']} for page in self._index['pages']]
+
+    def _read_member(self, span: List[int]):
+        offset, length = span
+        data = json.loads(gzip.decompress(self._mmap[offset:offset + length]).lstrip(b','))
+        _restore_images(data, self.result_path.parent, embed_images=False)
+        return data
+
+    def page(self, i: int) -> dict:
+        return self._read_member(self._index['pages'][i]['span'])
+
+    def has_field(self, field: str) -> bool:
+        return field in self._index['fields']
+
+    def field(self, field: str, default=None):
+        span = self._index['fields'].get(field)
+        return self._read_member(span) if span is not None else default
+
+
+def load_indexed_conversion_result(output_dir: Union[str, Path]) -> IndexedConversionResult:
+    """Open the conversion result of a docling_parse output directory for reading on demand.
+
+    A legacy conversion_result.json, or a compact one written without an index, is rewritten once in the
+    indexed compact format (a one-off full load); every later open only reads the index.
+    """
+    output_dir = Path(output_dir)
+    compact_path = output_dir / COMPACT_CONVERSION_RESULT_FILENAME
+    json_path = output_dir / 'conversion_result.json'
+    if json_path.exists() and (not compact_path.exists() or json_path.stat().st_mtime > compact_path.stat().st_mtime):
+        with open(json_path, 'r') as f:
+            save_indexed_conversion_result(json.load(f), compact_path)
+    try:
+        return IndexedConversionResult(compact_path)
+    except (FileNotFoundError, ValueError):
+        if not compact_path.exists():
+            raise
+        save_indexed_conversion_result(_read_compact(compact_path), compact_path)
+        return IndexedConversionResult(compact_path)
+
+
+def migrate_output_dir(output_dir: Union[str, Path], remove_json: bool = False, verbose: bool = False) -> dict:
+    """Convert the document.json and conversion_result.json of a docling_parse output directory to the compact format."""
+    output_dir = Path(output_dir)
+    report = {'output_dir': str(output_dir), 'bytes_before': 0, 'bytes_after': 0, 'images': 0}
+    for json_name, compact_name in (('document.json', COMPACT_DOCUMENT_FILENAME),
+                                    ('conversion_result.json', COMPACT_CONVERSION_RESULT_FILENAME)):
+        json_path = output_dir / json_name
+        if not json_path.exists():
+            continue
+        with open(json_path, 'r') as f:
+            data = json.load(f)
+        if compact_name == COMPACT_CONVERSION_RESULT_FILENAME:
+            report['images'] += save_indexed_conversion_result(data, output_dir / compact_name)
+        else:
+            report['images'] += save_compact(data, output_dir / compact_name)
+        report['bytes_before'] += json_path.stat().st_size
+        report['bytes_after'] += (output_dir / compact_name).stat().st_size
+        if remove_json:
+            os.remove(json_path)
+            # the offset index only describes the removed file; load_lazy_document now reads the compact copy
+            if json_name == 'document.json' and (output_dir / DOCUMENT_INDEX_FILENAME).exists():
+                os.remove(output_dir / DOCUMENT_INDEX_FILENAME)
+
+    images_dir = output_dir / IMAGES_DIRNAME
+    if images_dir.exists():
+        report['bytes_after'] += sum(p.stat().st_size for p in images_dir.iterdir())
+    if verbose:
+        print(f"{output_dir}: {report['bytes_before'] / 2**20:.1f} MiB -> {report['bytes_after'] / 2**20:.1f} MiB, {report['images']} images")
+    return report
+
+
+def migrate_tree(root: Union[str, Path], remove_json: bool = False, verbose: bool = False) -> List[dict]:
+    return [
+        migrate_output_dir(document_json_path.parent, remove_json=remove_json, verbose=verbose)
+        for document_json_path in sorted(Path(root).rglob('document.json'))
+    ]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Convert docling_parse output directories to the compact storage format.")
+    parser.add_argument('root', nargs='?', default='data/converted')
+    parser.add_argument('--remove-json', action='store_true', help="delete document.json and conversion_result.json after migrating")
+    args = parser.parse_args(argv)
+
+    reports = migrate_tree(args.root, remove_json=args.remove_json, verbose=True)
+    before = sum(r['bytes_before'] for r in reports)
+    after = sum(r['bytes_after'] for r in reports)
+    print(f"Migrated {len(reports)} output directories: {before / 2**20:.1f} MiB -> {after / 2**20:.1f} MiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,264 @@
+import hashlib
+import numpy as np
+import os
+import pandas as pd
+import shutil
+import uuid
+from docling_core.types.doc.document import DoclingDocument, TableCell, TableData, TableItem
+from pathlib import Path
+from typing import Iterable, List, Optional, Tuple, Union
+
+# columns of the long, one row per cell, form of a document's tables
+CELL_COLUMNS = ['table_index', 'self_ref', 'row', 'col', 'row_span', 'col_span', 'text', 'column_header', 'row_header']
+
+
+def table_cells_frame(document: DoclingDocument) -> pd.DataFrame:
+    """Every cell of every table in `document`, one row per cell, built straight from the table cells."""
+    columns = {name: [] for name in CELL_COLUMNS}
+    for table_index, table in enumerate(document.tables):
+        cells = table.data.table_cells
+        columns['table_index'].extend([table_index] * len(cells))
+        columns['self_ref'].extend([table.self_ref] * len(cells))
+        for cell in cells:
+            columns['row'].append(cell.start_row_offset_idx)
+            columns['col'].append(cell.start_col_offset_idx)
+            columns['row_span'].append(cell.end_row_offset_idx - cell.start_row_offset_idx)
+            columns['col_span'].append(cell.end_col_offset_idx - cell.start_col_offset_idx)
+            columns['text'].append(cell.text)
+            columns['column_header'].append(cell.column_header)
+            columns['row_header'].append(cell.row_header)
+    frame = pd.DataFrame(columns, columns=CELL_COLUMNS)
+    return frame.astype({'table_index': 'int32', 'row': 'int32', 'col': 'int32', 'row_span': 'int32', 'col_span': 'int32',
+                         'column_header': 'bool', 'row_header': 'bool'})
+
+
+def _table_grid(table: TableItem) -> Tuple[np.ndarray, np.ndarray]:
+    # text of every grid position, a spanning cell repeated over its span like TableData.grid, and whether the
+    # cell at each position is a column header
+    num_rows, num_cols = table.data.num_rows, table.data.num_cols
+    texts = np.full((num_rows, num_cols), '', dtype=object)
+    headers = np.zeros((num_rows, num_cols), dtype=bool)
+    for cell in table.data.table_cells:
+        rows = slice(cell.start_row_offset_idx, min(cell.end_row_offset_idx, num_rows))
+        cols = slice(cell.start_col_offset_idx, min(cell.end_col_offset_idx, num_cols))
+        texts[rows, cols] = cell.text
+        headers[rows, cols] = cell.column_header
+    return texts, headers
+
+
+def _count_header_rows(headers: np.ndarray) -> int:
+    # leading rows made only of column header cells, always leaving at least one body row
+    count = 0
+    while count < len(headers) - 1 and headers[count].all():
+        count += 1
+    return count
+
+
+def table_to_frame(table: TableItem, header_rows: Optional[int] = None) -> pd.DataFrame:
+    """The table as a DataFrame of strings, without rendering it to markdown first.
+
+    The leading column header rows become the columns, a MultiIndex when there are several of them. Cells that
+    span rows or columns are repeated over their span. header_rows=None detects the header rows and, like the
+    markdown round-trip this replaces, falls back to using the first row when no cell is marked as a header.
+    """
+    texts, headers = _table_grid(table)
+    if header_rows is None:
+        header_rows = _count_header_rows(headers)
+        if header_rows == 0 and len(texts) > 1:
+            header_rows = 1
+    body = texts[header_rows:]
+    if header_rows == 0:
+        return pd.DataFrame(body)
+    if header_rows == 1:
+        columns = pd.Index(texts[0], dtype=object)
+    else:
+        columns = pd.MultiIndex.from_arrays([texts[i] for i in range(header_rows)])
+    return pd.DataFrame(body, columns=columns)
+
+
+def _flat_column_names(columns: pd.Index) -> List[str]:
+    # Arrow needs unique string names: header levels are joined and repeats numbered like pandas' read_csv
+    if isinstance(columns, pd.MultiIndex):
+        names = [' / '.join(dict.fromkeys(str(level) for level in column if str(level))) for column in columns]
+    else:
+        names = [str(column) for column in columns]
+    seen = {}
+    unique = []
+    for name in names:
+        name = name or f"column_{len(unique)}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        unique.append(name)
+    return unique
+
+
+def table_to_arrow(table: TableItem, header_rows: Optional[int] = None, document: Optional[DoclingDocument] = None):
+    """The table as a pyarrow.Table of string columns; the self_ref and caption are kept in the schema metadata."""
+    import pyarrow as pa
+    frame = table_to_frame(table, header_rows)
+    names = _flat_column_names(frame.columns)
+    arrays = [pa.array(frame.iloc[:, i].tolist(), type=pa.string()) for i in range(frame.shape[1])]
+    metadata = {'self_ref': table.self_ref}
+    if document is not None:
+        metadata['caption'] = table.caption_text(document)
+    return pa.Table.from_arrays(arrays, names=names, metadata=metadata)
+
+
+def document_tables(document: DoclingDocument, header_rows: Optional[int] = None) -> List[pd.DataFrame]:
+    # one DataFrame per table, in the order of document.tables
+    return [table_to_frame(table, header_rows) for table in document.tables]
+
+
+def document_tables_arrow(document: DoclingDocument, header_rows: Optional[int] = None) -> list:
+    return [table_to_arrow(table, header_rows, document) for table in document.tables]
+
+
+def document_id(document: DoclingDocument) -> str:
+    # stable across re-conversions of the same PDF bytes and independent of where the output directory lives
+    if document.origin is not None:
+        return f"{document.origin.binary_hash:016x}"
+    return hashlib.sha256(document.name.encode('utf-8')).hexdigest()[:16]
+
+
+# one row per table cell; the table-level columns repeat per cell and are dictionary encoded by Parquet
+TABLE_STORE_COLUMNS = ['table_id', 'source', 'page_no', 'bbox_l', 'bbox_t', 'bbox_r', 'bbox_b', 'caption', 'num_rows', 'num_cols',
+                       'row', 'col', 'row_span', 'col_span', 'text', 'column_header', 'row_header']
+
+
+def document_table_rows(document: DoclingDocument, doc_id: Optional[str] = None):
+    """The cells of every table in `document` as one pyarrow.Table, with the table's source, page, bbox and caption."""
+    import pyarrow as pa
+    doc_id = doc_id or document_id(document)
+    cells = table_cells_frame(document)
+    tables = []
+    for table in document.tables:
+        prov = table.prov[0] if table.prov else None
+        tables.append({
+            'table_id': f"{doc_id}:{table.self_ref}",
+            'source': document.origin.filename if document.origin is not None else document.name,
+            'page_no': prov.page_no if prov is not None else None,
+            'bbox_l': prov.bbox.l if prov is not None else None,
+            'bbox_t': prov.bbox.t if prov is not None else None,
+            'bbox_r': prov.bbox.r if prov is not None else None,
+            'bbox_b': prov.bbox.b if prov is not None else None,
+            'caption': table.caption_text(document),
+            'num_rows': table.data.num_rows,
+            'num_cols': table.data.num_cols,
+        })
+    table_columns = pd.DataFrame(tables, columns=TABLE_STORE_COLUMNS[:10])
+    rows = table_columns.iloc[cells['table_index']].reset_index(drop=True)
+    rows = pd.concat([rows, cells.drop(columns=['table_index', 'self_ref']).reset_index(drop=True)], axis=1)
+    return pa.Table.from_pandas(rows, schema=table_store_schema(), preserve_index=False)
+
+
+def table_store_schema():
+    import pyarrow as pa
+    return pa.schema([
+        ('table_id', pa.string()), ('source', pa.string()), ('page_no', pa.int32()),
+        ('bbox_l', pa.float32()), ('bbox_t', pa.float32()), ('bbox_r', pa.float32()), ('bbox_b', pa.float32()),
+        ('caption', pa.string()), ('num_rows', pa.int32()), ('num_cols', pa.int32()),
+        ('row', pa.int32()), ('col', pa.int32()), ('row_span', pa.int32()), ('col_span', pa.int32()),
+        ('text', pa.string()), ('column_header', pa.bool_()), ('row_header', pa.bool_()),
+    ])
+
+
+class TableStore:
+    """Corpus-wide Parquet dataset of every table cell, partitioned by document.
+
+    Each document's rows live in their own hive partition, root/document_id=<id>/, which write_document replaces
+    as a whole: re-exporting a document rewrites only its own rows, and a reader never sees half of them.
+    Queries go through pyarrow.dataset, so they read only the requested columns and the matching partitions.
+    """
+
+    def __init__(self, root: Union[str, Path] = 'data/tables'):
+        self.root = Path(root)
+
+    def _partition_dir(self, doc_id: str) -> Path:
+        return self.root / f"document_id={doc_id}"
+
+    def write_document(self, document: DoclingDocument, doc_id: Optional[str] = None) -> int:
+        import pyarrow.parquet as pq
+        doc_id = doc_id or document_id(document)
+        rows = document_table_rows(document, doc_id)
+        partition_dir = self._partition_dir(doc_id)
+        if rows.num_rows == 0:
+            self.delete_document(doc_id)
+            return 0
+        # dot-prefixed directories are ignored by dataset discovery until they are renamed into place
+        tmp_dir = self.root / f".tmp-{doc_id}-{uuid.uuid4().hex}"
+        tmp_dir.mkdir(parents=True)
+        pq.write_table(rows, tmp_dir / 'part-0.parquet', compression='zstd')
+        old_dir = self.root / f".old-{doc_id}-{uuid.uuid4().hex}"
+        if partition_dir.exists():
+            os.rename(partition_dir, old_dir)
+        os.rename(tmp_dir, partition_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return rows.num_rows
+
+    def delete_document(self, doc_id: str) -> bool:
+        partition_dir = self._partition_dir(doc_id)
+        if not partition_dir.exists():
+            return False
+        old_dir = self.root / f".old-{doc_id}-{uuid.uuid4().hex}"
+        os.rename(partition_dir, old_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return True
+
+    def document_ids(self) -> List[str]:
+        if not self.root.exists():
+            return []
+        return sorted(p.name.split('=', 1)[1] for p in self.root.iterdir() if p.is_dir() and p.name.startswith('document_id='))
+
+    def dataset(self):
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+        partitioning = ds.partitioning(pa.schema([('document_id', pa.string())]), flavor='hive')
+        return ds.dataset(self.root, format='parquet', partitioning=partitioning,
+                          schema=table_store_schema().append(pa.field('document_id', pa.string())))
+
+    def query(self, columns: Optional[List[str]] = None, filter=None, document_ids: Optional[Iterable[str]] = None):
+        """Read `columns` of the rows matching the pyarrow.dataset `filter` expression, from `document_ids` only if given."""
+        import pyarrow.dataset as ds
+        if document_ids is not None:
+            partition_filter = ds.field('document_id').isin(list(document_ids))
+            filter = partition_filter if filter is None else partition_filter & filter
+        return self.dataset().to_table(columns=columns, filter=filter)
+
+    def table_frame(self, table_id: str) -> pd.DataFrame:
+        # rebuilds one stored table as the DataFrame table_to_frame would have made from the TableItem
+        doc_id = table_id.split(':', 1)[0]
+        import pyarrow.dataset as ds
+        cells = self.query(['num_rows', 'num_cols', 'row', 'col', 'row_span', 'col_span', 'text', 'column_header'],
+                           ds.field('table_id') == table_id, [doc_id]).to_pandas()
+        if cells.empty:
+            raise KeyError(table_id)
+        table = TableItem(self_ref='#/tables/0', data=TableData(
+            num_rows=int(cells['num_rows'].iloc[0]), num_cols=int(cells['num_cols'].iloc[0]),
+            table_cells=[
+                TableCell(text=cell.text, start_row_offset_idx=cell.row, end_row_offset_idx=cell.row + cell.row_span,
+                          start_col_offset_idx=cell.col, end_col_offset_idx=cell.col + cell.col_span,
+                          column_header=cell.column_header)
+                for cell in cells.itertuples()
+            ]))
+        return table_to_frame(table)
+
+
+def build_table_store(converted_path: Union[str, Path] = 'data/converted', store_root: Union[str, Path] = 'data/tables',
+                      verbose: bool = False) -> TableStore:
+    # adds the tables of every converted document under converted_path, replacing what the store held for them
+    from utils.docling_utils import _document_exists, _load_document
+    store = TableStore(store_root)
+    for output_dir in sorted(Path(converted_path).iterdir()):
+        if not _document_exists(output_dir):
+            continue
+        rows = store.write_document(_load_document(output_dir))
+        if verbose: print(f"{output_dir.name}: {rows} table cells")
+    return store
+
+
+if __name__ == "__main__":
+    import sys
+    build_table_store(*sys.argv[1:3], verbose=True)